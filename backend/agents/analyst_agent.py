@@ -1,99 +1,134 @@
 # backend/agents/analyst_agent.py
-from sqlalchemy import select, delete
-from db import SessionLocal
-from models import ColumnMeta, ColumnDictionary, Metric
-import asyncio
+import datetime
+from sqlalchemy import select, delete, or_
+from sqlalchemy.dialects.postgresql import insert
+from db import agents_engine
+from models import ColumnMeta, ColumnDictionary, Metric, MetricScan
+
+# Rows kept by the per-category count metrics
+TOP_CATEGORIES = 20
+# importance_score per kind of metric, ranking what the materializer precomputes first:
+# per-category counts group the whole table, daily counts usually read its rollup,
+# and all SUM / AVG metrics share one fused scan
+IMPORTANCE = {"categorical": 3, "time-series": 2, "scalar": 1}
+
+
+def scalar_scan_key(table_name: str) -> str:
+    return f"{table_name}.scalars"
+
+
+def daily_count_sql(table_name: str, col: str) -> str:
+    return (
+        f"SELECT DATE(\"{col}\") AS day, COUNT(*) AS count "
+        f"FROM \"{table_name}\" GROUP BY DATE(\"{col}\") ORDER BY day"
+    )
+
+
+def category_count_sql(table_name: str, col: str) -> str:
+    return (
+        f"SELECT \"{col}\" AS category, COUNT(*) AS count "
+        f"FROM \"{table_name}\" GROUP BY \"{col}\" ORDER BY count DESC LIMIT {TOP_CATEGORIES}"
+    )
+
+
+def plan_metrics(table_name: str, columns: list) -> tuple[list[dict], dict]:
+    """
+    Heuristic metric definitions for a table's columns, plus its fused scan:
+    every scalar aggregate computed in one SELECT. Scalar metrics keep their
+    standalone SQL and name their output column in the scan.
+    """
+    scan_key = scalar_scan_key(table_name)
+    metrics, aggregates = [], []
+
+    for col_meta in columns:
+        col = col_meta.column_name
+
+        # Numeric → SUM, AVG
+        if col_meta.is_numeric:
+            for func, alias in (("SUM", f"sum_{col}"), ("AVG", f"avg_{col}")):
+                expr = f"{func}(\"{col}\")"
+                aggregates.append(f"{expr} AS \"{alias}\"")
+                metrics.append({
+                    "metric_name": f"{table_name}.{col}_{func.lower()}",
+                    "sql_definition": f"SELECT {expr} AS \"{alias}\" FROM \"{table_name}\"",
+                    "viz_hint": {"x": None, "y": alias, "type": "numeric"},
+                    "tags": [table_name, col, func.lower()],
+                    "importance_score": IMPORTANCE["scalar"],
+                    "scan_key": scan_key,
+                    "scan_column": alias,
+                })
+
+        # Datetime → daily counts
+        elif col_meta.is_datetime:
+            metrics.append({
+                "metric_name": f"{table_name}.{col}_count_per_day",
+                "sql_definition": daily_count_sql(table_name, col),
+                "viz_hint": {"x": "day", "y": "count", "type": "line"},
+                "tags": [table_name, col, "time-series"],
+                "importance_score": IMPORTANCE["time-series"],
+            })
+
+        # Categorical → top-20 counts
+        else:
+            metrics.append({
+                "metric_name": f"{table_name}.{col}_distinct_count",
+                "sql_definition": category_count_sql(table_name, col),
+                "viz_hint": {"x": "category", "y": "count", "type": "bar"},
+                "tags": [table_name, col, "categorical"],
+                "importance_score": IMPORTANCE["categorical"],
+            })
+
+    scan = None
+    if aggregates:
+        scan = {
+            "scan_key": scan_key,
+            "table_name": table_name,
+            "sql_definition": f"SELECT {', '.join(aggregates)} FROM \"{table_name}\"",
+        }
+    for metric in metrics:
+        metric.setdefault("scan_key", None)
+        metric.setdefault("scan_column", None)
+        metric["table_name"] = table_name
+    return metrics, scan
+
 
 async def analyst_agent(table_name: str):
     """
-    Generate simple heuristic-based metrics for each column and insert into `metrics`.
+    Generate simple heuristic-based metrics for each column and upsert them into
+    `metrics` in one statement; metrics of columns that are gone are removed.
     """
-    async with SessionLocal() as session:
-        # Fetch columns + descriptions
-        result = await session.execute(
-            select(ColumnMeta, ColumnDictionary.description)
+    async with agents_engine.begin() as conn:
+        # Columns that made it through the dictionary stage
+        result = await conn.execute(
+            select(ColumnMeta)
             .join(ColumnDictionary, ColumnMeta.id == ColumnDictionary.column_id)
             .where(ColumnMeta.table_name == table_name)
+            .order_by(ColumnMeta.ordinal_position)
         )
-        rows = result.all()
+        metrics, scan = plan_metrics(table_name, result.all())
+        now = datetime.datetime.utcnow()
+
+        if scan:
+            stmt = insert(MetricScan).values(**scan, updated_at=now)
+            await conn.execute(stmt.on_conflict_do_update(
+                index_elements=[MetricScan.scan_key],
+                set_={"sql_definition": stmt.excluded.sql_definition, "updated_at": now},
+            ))
+        else:
+            await conn.execute(delete(MetricScan).where(MetricScan.scan_key == scalar_scan_key(table_name)))
 
-        # Delete existing metrics for this table
-        await session.execute(
-            delete(Metric).where(Metric.metric_name.startswith(f"{table_name}."))
+        # Drop metrics of this table that are no longer generated
+        await conn.execute(
+            delete(Metric)
+            .where(or_(Metric.table_name == table_name,
+                       Metric.metric_name.startswith(f"{table_name}.", autoescape=True)))
+            .where(Metric.metric_name.not_in([m["metric_name"] for m in metrics]))
         )
+        if not metrics:
+            return
 
-        for col_meta, desc in rows:
-            col = col_meta.column_name
-
-            # Numeric → SUM, AVG
-            if col_meta.is_numeric:
-                sum_name = f"{table_name}.{col}_sum"
-                avg_name = f"{table_name}.{col}_avg"
-                sum_sql = f"SELECT SUM(\"{col}\") AS \"sum_{col}\" FROM \"{table_name}\""
-                avg_sql = f"SELECT AVG(\"{col}\") AS \"avg_{col}\" FROM \"{table_name}\""
-
-                await session.execute(
-                    """
-                    INSERT INTO metrics (metric_name, sql_definition, viz_hint, tags)
-                    VALUES (:name, :sql, :viz, :tags)
-                    """,
-                    {
-                        "name": sum_name,
-                        "sql": sum_sql,
-                        "viz": {"x": None, "y": f"sum_{col}", "type": "numeric"},
-                        "tags": [table_name, col, "sum"]
-                    }
-                )
-                await session.execute(
-                    """
-                    INSERT INTO metrics (metric_name, sql_definition, viz_hint, tags)
-                    VALUES (:name, :sql, :viz, :tags)
-                    """,
-                    {
-                        "name": avg_name,
-                        "sql": avg_sql,
-                        "viz": {"x": None, "y": f"avg_{col}", "type": "numeric"},
-                        "tags": [table_name, col, "avg"]
-                    }
-                )
-
-            # Datetime → daily counts
-            elif col_meta.is_datetime:
-                daily_name = f"{table_name}.{col}_count_per_day"
-                daily_sql = (
-                    f"SELECT DATE(\"{col}\") AS day, COUNT(*) AS count "
-                    f"FROM \"{table_name}\" GROUP BY DATE(\"{col}\") ORDER BY day"
-                )
-                await session.execute(
-                    """
-                    INSERT INTO metrics (metric_name, sql_definition, viz_hint, tags)
-                    VALUES (:name, :sql, :viz, :tags)
-                    """,
-                    {
-                        "name": daily_name,
-                        "sql": daily_sql,
-                        "viz": {"x": "day", "y": "count", "type": "line"},
-                        "tags": [table_name, col, "time-series"]
-                    }
-                )
-
-            # Categorical → top-20 counts
-            else:
-                distinct_name = f"{table_name}.{col}_distinct_count"
-                distinct_sql = (
-                    f"SELECT \"{col}\" AS category, COUNT(*) AS count "
-                    f"FROM \"{table_name}\" GROUP BY \"{col}\" ORDER BY count DESC LIMIT 20"
-                )
-                await session.execute(
-                    """
-                    INSERT INTO metrics (metric_name, sql_definition, viz_hint, tags)
-                    VALUES (:name, :sql, :viz, :tags)
-                    """,
-                    {
-                        "name": distinct_name,
-                        "sql": distinct_sql,
-                        "viz": {"x": "category", "y": "count", "type": "bar"},
-                        "tags": [table_name, col, "categorical"]
-                    }
-                )
-        await session.commit()
+        stmt = insert(Metric).values(metrics)
+        await conn.execute(stmt.on_conflict_do_update(
+            index_elements=[Metric.metric_name],
+            set_={key: stmt.excluded[key] for key in metrics[0] if key != "metric_name"},
+        ))
@@ -1,54 +1,116 @@
 # backend/agents/dictionary_agent.py
 import os
-import openai
-from sqlalchemy import select, update
-from db import SessionLocal
+import asyncio
+import datetime
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from db import agents_engine
 from models import ColumnMeta, ColumnDictionary
+from llm import LLMClient, get_llm_client
+from description_cache import description_cache, fingerprint, sample_hashes
 from dotenv import load_dotenv
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# Columns described per prompt, and prompts in flight per table
+BATCH_SIZE = int(os.getenv("DICTIONARY_BATCH_SIZE", "25"))
+LLM_CONCURRENCY = int(os.getenv("DICTIONARY_LLM_CONCURRENCY", "4"))
+
+SYSTEM_PROMPT = (
+    "You document database columns for developers. Reply with a JSON object that maps "
+    "every column name you are given, exactly as written, to a brief description. "
+    "Include typical use cases or units if applicable."
+)
+
+_client: LLMClient = None
+
+
+def get_client() -> LLMClient:
+    """One client per process, so HTTP connections are reused across tables."""
+    global _client
+    if _client is None:
+        _client = get_llm_client()
+    return _client
+
+
+def _batch_prompt(table_name: str, columns: list[tuple[str, str]]) -> str:
+    lines = "\n".join(f"- {name} ({data_type})" for name, data_type in columns)
+    return f"Table: {table_name}\nColumns:\n{lines}"
+
+
+async def describe_columns(
+    client: LLMClient,
+    table_name: str,
+    columns: list[tuple[str, str]],
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = LLM_CONCURRENCY,
+) -> dict[str, str]:
+    """
+    Describe (name, data_type) columns with one prompt per `batch_size` columns,
+    at most `concurrency` prompts at a time. Returns { column name: description }.
+    Columns a reply left out are asked for once more in a batch of their own.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run_batch(batch):
+        async with limit:
+            answer = await client.complete_json(SYSTEM_PROMPT, _batch_prompt(table_name, batch))
+        return {name: str(answer[name]).strip() for name, _ in batch if answer.get(name)}
+
+    batches = [columns[i:i + batch_size] for i in range(0, len(columns), max(batch_size, 1))]
+    descriptions = {}
+    for result in await asyncio.gather(*(run_batch(b) for b in batches)):
+        descriptions.update(result)
+
+    missing = [col for col in columns if col[0] not in descriptions]
+    if missing:
+        descriptions.update(await run_batch(missing))
+        missing = [name for name, _ in columns if name not in descriptions]
+        if missing:
+            raise ValueError(f"LLM returned no description for column(s) {missing}")
+    return descriptions
+
 
 async def dictionary_agent(table_name: str):
     """
     Generate descriptions for each column in `columns` table, upsert into `column_dictionary`.
     """
-    async with SessionLocal() as session:
-        result = await session.execute(
-            select(ColumnMeta).where(ColumnMeta.table_name == table_name)
+    client = get_client()
+    async with agents_engine.begin() as conn:
+        result = await conn.execute(
+            select(ColumnMeta.id, ColumnMeta.column_name, ColumnMeta.data_type)
+            .where(ColumnMeta.table_name == table_name)
+        )
+        cols = result.all()
+        if not cols:
+            return
+
+        samples = await sample_hashes(conn, table_name, [name for _, name, _ in cols])
+        fingerprints = {
+            name: fingerprint(client.model_id, table_name, name, data_type, samples.get(name))
+            for _, name, data_type in cols
+        }
+        cached = await description_cache.get_many(conn, list(fingerprints.values()))
+
+    descriptions = {name: cached[fp] for name, fp in fingerprints.items() if fp in cached}
+    misses = [(name, data_type) for _, name, data_type in cols if name not in descriptions]
+    fresh = {}
+    if misses:
+        # Only cache misses reach the model; no connection is held open meanwhile
+        fresh = await describe_columns(client, table_name, misses)
+        descriptions.update(fresh)
+
+    now = datetime.datetime.utcnow()
+    stmt = insert(ColumnDictionary).values([
+        {"column_id": col_id, "description": descriptions[name], "updated_at": now}
+        for col_id, name, _ in cols
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ColumnDictionary.column_id],
+        set_={"description": stmt.excluded.description, "updated_at": stmt.excluded.updated_at},
+    )
+    async with agents_engine.begin() as conn:
+        await conn.execute(stmt)
+        await description_cache.put_many(
+            conn, {fingerprints[name]: desc for name, desc in fresh.items()}, client.model_id
         )
-        cols = result.scalars().all()
-
-        for col in cols:
-            prompt = (
-                f"Describe the following database column in a brief, developer-friendly way:\n"
-                f"Table: {table_name}\n"
-                f"Column: {col.column_name}\n"
-                f"Data Type: {col.data_type}\n"
-                f"Include typical use cases or units if applicable."
-            )
-            resp = openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2,
-            )
-            desc = resp.choices[0].message.content.strip()
-
-            existing = await session.execute(
-                select(ColumnDictionary).where(ColumnDictionary.column_id == col.id)
-            )
-            if existing.scalar_one_or_none():
-                await session.execute(
-                    update(ColumnDictionary)
-                    .where(ColumnDictionary.column_id == col.id)
-                    .values(description=desc)
-                )
-            else:
-                await session.execute(
-                    """
-                    INSERT INTO column_dictionary (column_id, description)
-                    VALUES (:cid, :desc)
-                    """,
-                    {"cid": col.id, "desc": desc}
-                )
-        await session.commit()
@@ -1,39 +1,98 @@
 # backend/agents/extractor.py
-from sqlalchemy import inspect, delete
-from db import SessionLocal
+from sqlalchemy import text, delete
+from sqlalchemy.dialects.postgresql import insert
+from db import agents_engine
 from models import ColumnMeta
-import asyncio
+
+# One catalog round-trip: every column's type and its pg_stats profile. Partitioned
+# tables only have inherited stats, plain tables only non-inherited ones.
+COLUMNS_SQL = text("""
+    SELECT DISTINCT ON (a.attnum)
+        a.attnum AS ordinal_position,
+        a.attname AS column_name,
+        format_type(a.atttypid, a.atttypmod) AS data_type,
+        t.typcategory::text AS category,
+        c.reltuples,
+        s.null_frac,
+        s.n_distinct,
+        s.histogram_bounds::text::text[] AS histogram_bounds,
+        s.most_common_vals::text::text[] AS most_common_vals,
+        s.most_common_freqs
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_type t ON t.oid = a.atttypid
+    LEFT JOIN pg_stats s
+           ON s.schemaname = n.nspname AND s.tablename = c.relname AND s.attname = a.attname
+    WHERE a.attrelid = to_regclass(:tbl)
+      AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum, s.inherited DESC
+""")
+
+
+def _value_range(category: str, histogram: list, common: list) -> tuple:
+    """Approximate (min, max) from the histogram bounds and most common values."""
+    values = [v for v in (histogram or []) + (common or []) if v is not None]
+    if not values:
+        return None, None
+    if histogram and not common:
+        return histogram[0], histogram[-1]   # bounds are already sorted in the column's order
+    if category == "N":
+        try:
+            return min(values, key=float), max(values, key=float)
+        except ValueError:
+            pass
+    # ISO dates and timestamps compare correctly as text
+    return min(values), max(values)
+
+
+def _profile_row(table_name: str, row) -> dict:
+    n_distinct = row["n_distinct"]
+    if n_distinct is not None and n_distinct < 0:
+        # Negative n_distinct is a fraction of the row count
+        n_distinct = -n_distinct * max(row["reltuples"], 0)
+    common = row["most_common_vals"]
+    min_value, max_value = _value_range(row["category"], row["histogram_bounds"], common)
+    return {
+        "table_name": table_name,
+        "column_name": row["column_name"],
+        "data_type": row["data_type"],
+        "is_numeric": row["category"] == "N",
+        "is_datetime": row["category"] == "D",
+        "ordinal_position": row["ordinal_position"],
+        "null_fraction": row["null_frac"],
+        "n_distinct": n_distinct,
+        "min_value": min_value,
+        "max_value": max_value,
+        "histogram_bounds": row["histogram_bounds"],
+        "most_common_values": (
+            [[value, freq] for value, freq in zip(common, row["most_common_freqs"])] if common else None
+        ),
+    }
+
 
 async def extractor_agent(table_name: str):
     """
-    Extract column metadata from Postgres table and persist into `columns`.
+    Extract column metadata and the pg_stats profile of a Postgres table into
+    `columns`. Existing rows are updated in place, so their ids (and the
+    dictionary entries hanging off them) survive a re-extract.
     """
-    async with SessionLocal() as session:
-        engine = session.bind
-        insp = inspect(engine.sync_engine)
-        columns = insp.get_columns(table_name)
-
-        # Delete any existing metadata for this table
-        await session.execute(
-            delete(ColumnMeta).where(ColumnMeta.table_name == table_name)
+    async with agents_engine.begin() as conn:
+        result = await conn.execute(COLUMNS_SQL, {"tbl": f'"{table_name}"'})
+        rows = [_profile_row(table_name, row) for row in result.mappings().all()]
+
+        # Drop metadata of columns the table no longer has
+        await conn.execute(
+            delete(ColumnMeta)
+            .where(ColumnMeta.table_name == table_name)
+            .where(ColumnMeta.column_name.not_in([r["column_name"] for r in rows]))
         )
+        if not rows:
+            return
 
-        # Insert fresh rows
-        for col in columns:
-            dtype = col["type"].__class__.__name__.lower()
-            is_num = "int" in dtype or "double" in dtype or "numeric" in dtype
-            is_dt = "date" in dtype or "time" in dtype
-            await session.execute(
-                """
-                INSERT INTO columns (table_name, column_name, data_type, is_numeric, is_datetime)
-                VALUES (:tbl, :col, :dt, :num, :dtm)
-                """,
-                {
-                    "tbl": table_name,
-                    "col": col["name"],
-                    "dt": dtype,
-                    "num": is_num,
-                    "dtm": is_dt
-                }
-            )
-        await session.commit()
+        stmt = insert(ColumnMeta).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_table_column",
+            set_={key: stmt.excluded[key] for key in rows[0] if key not in ("table_name", "column_name")},
+        )
+        await conn.execute(stmt)
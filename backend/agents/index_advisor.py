@@ -0,0 +1,209 @@
+# backend/agents/index_advisor.py
+import os
+import json
+import time
+import hashlib
+import datetime
+from sqlalchemy import select, text, update, cast
+from sqlalchemy.dialects.postgresql import insert, JSONB
+from db import agents_engine, DATABASE_REPLICA_URL
+from models import ColumnMeta, Metric, QueryLog, AdvisedIndex
+from query_log import predicates
+from sql_guard import STATEMENT_TIMEOUT_MS
+
+# Tables under this many rows (pg_class.reltuples) are cheap to scan and get no index
+MIN_ROWS = int(os.getenv("INDEX_MIN_ROWS", "100000"))
+# BRIN only pays off when values follow the physical row order, e.g. append-only timestamps
+BRIN_MIN_CORRELATION = float(os.getenv("INDEX_BRIN_MIN_CORRELATION", "0.9"))
+BTREE_MAX_DISTINCT = int(os.getenv("INDEX_BTREE_MAX_DISTINCT", "10000"))
+# Filters on a column (metric SQL + logged questions) before it gets a btree index
+MIN_FILTERS = int(os.getenv("INDEX_MIN_FILTERS", "3"))
+LOOKBACK_DAYS = int(os.getenv("INDEX_LOOKBACK_DAYS", "30"))
+# Advised indexes never scanned this long after their creation are dropped again
+UNUSED_DAYS = float(os.getenv("INDEX_UNUSED_DAYS", "7"))
+# Time the affected metrics with EXPLAIN ANALYZE before and after each build
+BENCHMARK = os.getenv("INDEX_BENCHMARK", "1") == "1"
+
+STATS_SQL = text("""
+    SELECT s.attname, s.correlation
+    FROM pg_stats s
+    JOIN pg_class c ON c.relname = s.tablename
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = s.schemaname
+    WHERE c.oid = to_regclass(:tbl)
+""")
+# First key column of every index on the table
+INDEXED_SQL = text("""
+    SELECT a.attname
+    FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    WHERE i.indrelid = to_regclass(:tbl)
+""")
+UNUSED_SQL = text("""
+    SELECT ai.index_name, s.idx_scan
+    FROM advised_indexes ai
+    LEFT JOIN pg_stat_user_indexes s ON s.indexrelname = ai.index_name
+    WHERE ai.status = 'active' AND ai.created_at < :cutoff
+""")
+
+
+def index_name(table_name: str, column: str, method: str) -> str:
+    name = f"adv_{table_name}_{column}_{method}"
+    if len(name) > 63:   # Postgres truncates identifiers; keep names unique instead
+        name = f"{name[:54]}_{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+    return name
+
+
+async def _latency_ms(sql: str) -> float:
+    """Server-side execution time of `sql`, from EXPLAIN ANALYZE in a read-only transaction."""
+    async with agents_engine.begin() as conn:
+        await conn.execute(text("SET TRANSACTION READ ONLY"))
+        await conn.execute(text(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}"))
+        plan = (await conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"))).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return round(plan[0]["Execution Time"], 3)
+
+
+async def _timings(metrics: list) -> dict:
+    timings = {}
+    for metric in metrics:
+        try:
+            timings[metric.id] = await _latency_ms(metric.sql_definition)
+        except Exception:
+            timings[metric.id] = None   # broken or timed-out metric: nothing to compare
+    return timings
+
+
+async def _ddl(statement: str):
+    # CONCURRENTLY cannot run inside a transaction block
+    async with agents_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(statement))
+
+
+async def drop_unused_indexes() -> list[str]:
+    """Drop advised indexes of every table that were never scanned since INDEX_UNUSED_DAYS ago."""
+    if DATABASE_REPLICA_URL:
+        # API reads run on the replica, whose index scans the primary's statistics do not count
+        return []
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=UNUSED_DAYS)
+    async with agents_engine.connect() as conn:
+        rows = (await conn.execute(UNUSED_SQL, {"cutoff": cutoff})).all()
+    dropped = []
+    for name, scans in rows:
+        if scans:
+            continue
+        # scans is None when the index is already gone, e.g. with its table on a replace
+        await _ddl(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+        dropped.append(name)
+    if dropped:
+        async with agents_engine.begin() as conn:
+            await conn.execute(
+                update(AdvisedIndex).where(AdvisedIndex.index_name.in_(dropped))
+                .values(status="dropped", dropped_at=datetime.datetime.utcnow())
+            )
+    return dropped
+
+
+async def _filter_counts(conn, table_name: str, columns: set, metrics: list) -> dict:
+    """{ (column, kind): filters } over the table's metric SQL and the logged questions of LOOKBACK_DAYS."""
+    counts = {}
+    found = [predicates(metric.sql_definition, {table_name: columns}) for metric in metrics]
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=LOOKBACK_DAYS)
+    result = await conn.execute(
+        select(QueryLog.predicates)
+        .where(QueryLog.created_at > cutoff)
+        .where(cast(QueryLog.tables, JSONB).contains([table_name]))
+    )
+    found += [logged or [] for logged in result.scalars()]
+    for entry in found:
+        for table, column, kind in entry:
+            if table == table_name:
+                counts[(column, kind)] = counts.get((column, kind), 0) + 1
+    return counts
+
+
+def plan_indexes(columns: list, correlations: dict, indexed: set, counts: dict, daily: set) -> list[tuple]:
+    """(column, method, reason) for each index worth building."""
+    planned = []
+    for col in columns:
+        name = col.column_name
+        if name in indexed:
+            continue
+        filters = sum(n for (column, _), n in counts.items() if column == name)
+        correlation = correlations.get(name)
+        if col.is_datetime and correlation is not None and abs(correlation) >= BRIN_MIN_CORRELATION \
+                and (name in daily or filters):
+            planned.append((name, "brin", f"append-ordered (correlation {correlation:.2f}); "
+                                          f"{'per-day metric, ' if name in daily else ''}{filters} filters"))
+        elif not col.is_datetime and col.n_distinct is not None and col.n_distinct <= BTREE_MAX_DISTINCT \
+                and filters >= MIN_FILTERS:
+            planned.append((name, "btree", f"{filters} filters; ~{col.n_distinct:.0f} distinct values"))
+    return planned
+
+
+async def index_advisor_agent(table_name: str):
+    """
+    Index the table's columns that its metrics and logged questions filter or
+    bucket on: BRIN for append-ordered timestamps, btree for frequently
+    filtered low-cardinality columns. Indexes are built CONCURRENTLY, so
+    loads and dashboards keep running; the latency of the metrics reading
+    the column is recorded before and after. Advised indexes left unused for
+    INDEX_UNUSED_DAYS are dropped again, on every table (not with a read
+    replica, whose scans are not counted here).
+    """
+    await drop_unused_indexes()
+
+    async with agents_engine.connect() as conn:
+        found = (await conn.execute(
+            text("SELECT reltuples, relkind FROM pg_class WHERE oid = to_regclass(:tbl)"), {"tbl": f'"{table_name}"'}
+        )).first()
+        # CREATE INDEX CONCURRENTLY is refused on a partitioned table; its partitions
+        # are pruned by the key instead, and get no advised indexes
+        if found is None or found.relkind == "p" or found.reltuples < MIN_ROWS:
+            return
+        columns = (await conn.execute(
+            select(ColumnMeta).where(ColumnMeta.table_name == table_name).order_by(ColumnMeta.ordinal_position)
+        )).all()
+        metrics = (await conn.execute(select(Metric).where(Metric.table_name == table_name))).all()
+        correlations = dict((await conn.execute(STATS_SQL, {"tbl": f'"{table_name}"'})).all())
+        indexed = set((await conn.execute(INDEXED_SQL, {"tbl": f'"{table_name}"'})).scalars())
+        counts = await _filter_counts(conn, table_name, {c.column_name for c in columns}, metrics)
+
+    daily = {m.tags[1] for m in metrics if m.tags and "time-series" in m.tags and len(m.tags) > 1}
+    for column, method, reason in plan_indexes(columns, correlations, indexed, counts, daily):
+        name = index_name(table_name, column, method)
+        affected = [m for m in metrics if f'"{column}"' in (m.sql_definition or "")]
+        before = await _timings(affected) if BENCHMARK else {}
+
+        started = time.perf_counter()
+        status = "active"
+        try:
+            await _ddl(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" '
+                       f'ON "{table_name}" USING {method} ("{column}")')
+        except Exception as e:
+            # A failed concurrent build leaves an INVALID index behind
+            await _ddl(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+            status, reason = "failed", f"{reason}; {e}"
+        build_ms = int((time.perf_counter() - started) * 1000)
+
+        after = await _timings(affected) if BENCHMARK and status == "active" else {}
+        latency = {str(m.id): {"before_ms": before.get(m.id), "after_ms": after.get(m.id)} for m in affected}
+        row = {
+            "index_name": name,
+            "table_name": table_name,
+            "column_name": column,
+            "method": method,
+            "reason": reason,
+            "status": status,
+            "build_ms": build_ms,
+            "latency": latency,
+            "created_at": datetime.datetime.utcnow(),
+            "dropped_at": None,
+        }
+        async with agents_engine.begin() as conn:
+            stmt = insert(AdvisedIndex).values(row)
+            await conn.execute(stmt.on_conflict_do_update(
+                index_elements=[AdvisedIndex.index_name],
+                set_={key: stmt.excluded[key] for key in row if key != "index_name"},
+            ))
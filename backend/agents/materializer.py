@@ -0,0 +1,65 @@
+# backend/agents/materializer.py
+import os
+import time
+import datetime
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from db import AgentSession
+from models import Metric, MetricSnapshot
+from metric_runner import evaluate_metric
+from result_cache import metric_cache, sql_hash, table_version
+
+# Most important metrics to precompute per table (0 = all of them), and the
+# wall-clock budget after which the rest is left to be computed on demand
+TOP_N = int(os.getenv("MATERIALIZE_TOP_N", "0"))
+TIME_BUDGET_SECONDS = float(os.getenv("MATERIALIZE_TIME_BUDGET_SECONDS", "30"))
+
+
+async def materializer_agent(table_name: str):
+    """
+    Precompute the table's metrics, most important first, into `metric_snapshots`
+    for the current data version, warming this worker's result cache on the way.
+    A metric whose SQL fails is skipped rather than failing the stage.
+    """
+    started = time.perf_counter()
+    async with AgentSession() as session:
+        version = await table_version(session, table_name)
+        query = (
+            select(Metric)
+            .where(Metric.table_name == table_name)
+            .order_by(Metric.importance_score.desc().nulls_last(), Metric.id)
+        )
+        if TOP_N > 0:
+            query = query.limit(TOP_N)
+        metrics = (await session.execute(query)).scalars().all()
+
+        snapshots = []
+        for metric in metrics:
+            if time.perf_counter() - started > TIME_BUDGET_SECONDS:
+                break
+            metric_started = time.perf_counter()
+            try:
+                async with session.begin_nested():
+                    # Through the cache, so a table's fused scan runs once for all its scalar metrics
+                    rows = await evaluate_metric(session, metric, cache=metric_cache, fused=True)
+            except Exception:
+                continue
+            snapshots.append({
+                "metric_id": metric.id,
+                "table_name": table_name,
+                "version": version,
+                "sql_hash": sql_hash(metric.sql_definition),
+                "payload": jsonable_encoder(rows),
+                "row_count": len(rows),
+                "duration_ms": int((time.perf_counter() - metric_started) * 1000),
+                "computed_at": datetime.datetime.utcnow(),
+            })
+
+        if snapshots:
+            stmt = insert(MetricSnapshot).values(snapshots)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=[MetricSnapshot.metric_id],
+                set_={key: stmt.excluded[key] for key in snapshots[0] if key != "metric_id"},
+            ))
+        await session.commit()
@@ -1,63 +1,264 @@
 # backend/agents/query_runner.py
-import os
-import openai
-from langchain import LLMChain, PromptTemplate
-from langchain.sql_database import SQLDatabase
-from langchain.sql_database import SQLDatabaseChain
-from sqlalchemy import text
-from db import SessionLocal
+import re
+import time
+import asyncio
+import hashlib
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import InteractiveSession
+from models import ColumnMeta, ColumnDictionary, IngestHistory, TableVersion
+from llm import LLMClient, get_llm_client
+from query_cache import query_cache, query_results, normalize
+from schema_index import SchemaIndex
+from result_cache import sql_hash
+from result_transport import fetch_rows
+from downsample import downsample, guess_viz
+from query_log import log_query, predicates
+from approximate import METHOD, check_sample_percent, run_approximate, downsample_approximate
 from dotenv import load_dotenv
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
-async def query_runner_agent(nl_query: str, user: str = "anonymous"):
+SYSTEM_PROMPT = (
+    "You translate questions about a PostgreSQL database into a single read-only SELECT "
+    "statement. Use only the tables and columns listed, double-quote every identifier, and "
+    "reply with a JSON object of the form {\"sql\": \"...\"}."
+)
+
+
+def _schema_prompt(tables: dict[str, list[tuple]]) -> str:
+    """One block per table: "Table t:" followed by "- column (type): description" lines."""
+    blocks = []
+    for table_name, columns in tables.items():
+        blocks.append(f"Table {table_name}:")
+        for column_name, data_type, description in columns:
+            line = f"- {column_name} ({data_type})"
+            blocks.append(f"{line}: {description}" if description else line)
+    return "\n".join(blocks)
+
+
+def _schema_fingerprints(tables: dict[str, list[tuple]]) -> dict[str, str]:
+    """{ table: hash of its column names and types }, to tell when cached SQL may no longer fit."""
+    fingerprints = {}
+    for table, columns in tables.items():
+        signature = "\x1f".join(f"{name}:{data_type}" for name, data_type, _ in columns)
+        fingerprints[table] = hashlib.sha1(signature.encode()).hexdigest()[:16]
+    return fingerprints
+
+
+def _clean_sql(sql: str) -> str:
+    sql = (sql or "").strip()
+    if sql.startswith("```"):
+        sql = sql.strip("`").removeprefix("sql").strip()
+    return sql.rstrip(";").strip()
+
+
+class QueryEngine:
     """
-    1. Use LangChain SQLDatabaseChain to convert NL → SQL (given PostgreSQL).
-    2. Execute SQL and return results + simple viz hint.
+    Long-lived NL→SQL engine, created once per process. It keeps the schema
+    (tables, columns, dictionary descriptions) in a retrieval index and only
+    refreshes it after a new ingest or new descriptions, checked with one
+    cheap watermark query per question; each prompt then carries just the
+    tables relevant to the question. The LLM client, and with it the pooled
+    HTTP connections, is reused across questions.
+
+    Generated SQL goes through `query_cache` (exact or similar questions), and
+    identical questions arriving while one is with the LLM wait for its answer.
     """
-    # 1. Build SQLDatabase
-    #    We pass the sync connection string here; LangChain will use its own engine.
-    database_url = os.getenv("DATABASE_URL").replace("+psycopg2", "").replace("+asyncpg", "")
-    db = SQLDatabase.from_uri(database_url)
-
-    # 2. Create SQLDatabaseChain
-    #    We include the column_dictionary as context in the prompt.
-    #    For brevity, we use the default prompt from LangChain.
-    llm = openai.ChatCompletion  # using OpenAI via LangChain’s wrapper
-    db_chain = SQLDatabaseChain.from_llm(
-        llm=llm,
-        database=db,
-        verbose=False
-    )
-
-    # 3. Run the chain
-    #    result contains both the SQL and the “answer” (we only need SQL to execute ourselves)
-    chain_output = await asyncio.get_event_loop().run_in_executor(
-        None, lambda: db_chain.run(nl_query)
-    )
-    # LangChain returns a string with both SQL and text. We’ll parse out the SQL
-    # by looking for the first occurrence of “```sql\n…```”
-    sql_start = chain_output.find("```sql")
-    sql_end = chain_output.find("```", sql_start + 5)
-    if sql_start != -1 and sql_end != -1:
-        generated_sql = chain_output[sql_start + 5 : sql_end].strip()
-    else:
-        # fallback: assume entire output is SQL
-        generated_sql = chain_output.strip()
-
-    # 4. Execute generated_sql
-    async with SessionLocal() as session:
+
+    def __init__(self, client: LLMClient = None):
+        self._client = client
+        self.index = SchemaIndex()
+        self._watermark = None
+        self._lock = asyncio.Lock()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.table_schemas: dict[str, str] = {}
+        self.context_builds = 0
+
+    @property
+    def client(self) -> LLMClient:
+        if self._client is None:
+            self._client = get_llm_client()
+        return self._client
+
+    async def _current_watermark(self, session: AsyncSession) -> tuple:
+        # Ingests change tables; the dictionary stage fills in descriptions afterwards
+        result = await session.execute(
+            select(
+                select(func.max(IngestHistory.id)).scalar_subquery(),
+                select(func.max(ColumnDictionary.updated_at)).scalar_subquery(),
+            )
+        )
+        return tuple(result.one())
+
+    async def _load_schema(self, session: AsyncSession) -> dict[str, list[tuple]]:
+        result = await session.execute(
+            select(ColumnMeta.table_name, ColumnMeta.column_name, ColumnMeta.data_type,
+                   ColumnDictionary.description)
+            .outerjoin(ColumnDictionary, ColumnDictionary.column_id == ColumnMeta.id)
+            .order_by(ColumnMeta.table_name, ColumnMeta.ordinal_position)
+        )
+        tables = {}
+        for table_name, column_name, data_type, description in result.all():
+            tables.setdefault(table_name, []).append((column_name, data_type, description))
+        return tables
+
+    async def refresh(self, session: AsyncSession):
+        """Re-sync the schema index when the watermark moved; only changed tables are re-indexed."""
+        watermark = await self._current_watermark(session)
+        if watermark == self._watermark:
+            return
+        async with self._lock:
+            # Another question may have refreshed it while this one waited
+            if watermark != self._watermark:
+                tables = await self._load_schema(session)
+                self.index.sync(tables)
+                self.table_schemas = _schema_fingerprints(tables)
+                self._watermark = watermark
+                self.context_builds += 1
+
+    async def schema_context(self, session: AsyncSession, nl_query: str) -> str:
+        """Prompt-ready schema of the tables and columns relevant to `nl_query`."""
+        await self.refresh(session)
+        return _schema_prompt(self.index.relevant(nl_query))
+
+    async def start(self):
+        """Build the schema index, so the first question does not pay for it."""
+        async with InteractiveSession() as session:
+            await self.refresh(session)
+
+    async def to_sql(self, nl_query: str, context: str) -> str:
+        answer = await self.client.complete_json(SYSTEM_PROMPT, f"{context}\n\nQuestion: {nl_query}")
+        sql = _clean_sql(answer.get("sql"))
+        if not sql:
+            raise ValueError("The model did not return a SQL query")
+        return sql
+
+    def tables_in(self, sql: str) -> list[str]:
+        """Known tables named in `sql`, quoted or not."""
+        names = {quoted or bare for quoted, bare in re.findall(r'"([^"]+)"|\b(\w+)\b', sql)}
+        return sorted(table for table in self.table_schemas if table in names)
+
+    async def sql_for(self, nl_query: str, context: str) -> tuple[str, str]:
+        """(SQL, where it came from: "exact" / "similar" cache hit, "coalesced" or "llm")."""
+        model_id = self.client.model_id
+        sql, source = query_cache.get(model_id, nl_query, self.table_schemas)
+        if sql is not None:
+            return sql, source
+
+        key = (model_id, normalize(nl_query))
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            query_cache.stats.coalesced += 1
+            return await asyncio.shield(inflight), "coalesced"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
         try:
-            result = await session.execute(text(generated_sql))
-            rows = result.fetchall()
-            cols = result.keys()
-            data = [dict(zip(cols, r)) for r in rows]
+            sql = await self.to_sql(nl_query, context)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
         except Exception as e:
-            return {"error": str(e)}
+            future.set_exception(e)
+            future.exception()   # mark retrieved: nobody may be waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        tables = self.tables_in(sql)
+        query_cache.put(model_id, nl_query, sql, {table: self.table_schemas[table] for table in tables})
+        future.set_result(sql)
+        return sql, "llm"
+
+    async def _versions_key(self, session: AsyncSession, sql: str) -> str:
+        """Result cache key: the SQL plus the data version of every table it reads."""
+        tables = self.tables_in(sql)
+        if not tables:
+            return None   # nothing to invalidate on, e.g. SELECT now()
+        result = await session.execute(
+            select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(tables))
+        )
+        versions = dict(result.all())
+        return f"query:{sql_hash(sql)}:" + ",".join(f"{table}@v{versions.get(table, 0)}" for table in tables)
+
+    async def ask(self, nl_query: str, user: str = "anonymous", max_points: int = None,
+                  approximate: bool = False, sample_percent: float = None) -> dict:
+        """
+        Answer a question: SQL from the cache or the LLM given the cached schema
+        context, then at most RESULT_MAX_ROWS rows, reused until one of the tables
+        read gets new data, and downsampled for charting with max_points. With
+        approximate, simple aggregates over a large table are estimated from a
+        sample (see approximate.py); other SQL runs exactly.
+        """
+        if approximate:
+            sample_percent = check_sample_percent(sample_percent)
+        timings = {}
+        async with InteractiveSession() as session:
+            started = time.perf_counter()
+            context = await self.schema_context(session, nl_query)
+            timings["context"] = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            try:
+                generated_sql, sql_source = await self.sql_for(nl_query, context)
+            except Exception as e:
+                return {"error": str(e)}
+            timings["llm"] = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            key = await self._versions_key(session, generated_sql)
+            if key and approximate:
+                key += f":approx-{METHOD}-{sample_percent:g}"
+            result = await query_results.lookup(session, key) if key else None
+            rows_source = "cache" if result is not None else "query"
+            if result is None:
+                try:
+                    result = await run_approximate(session, generated_sql, sample_percent) if approximate else None
+                    if result is None:
+                        data, truncated = await fetch_rows(session, generated_sql)
+                        result = {"data": data, "truncated": truncated, "approximate": None}
+                except Exception as e:
+                    return {"sql": generated_sql, "error": str(e)}
+                # The viz is guessed from native values, before JSON encoding turns dates into strings
+                result["viz"] = guess_viz(result["data"])
+                if key:
+                    result = await query_results.store(key, None, None, result,
+                                                       (time.perf_counter() - started) * 1000)
+            timings["sql"] = (time.perf_counter() - started) * 1000
+
+        # The index advisor learns which columns questions filter on from this log
+        tables = self.tables_in(generated_sql)
+        columns = {table: {column for column, _, _ in self.index.tables.get(table, [])} for table in tables}
+        try:
+            await log_query(nl_query, generated_sql, tables, predicates(generated_sql, columns),
+                            sum(timings.values()), user)
+        except Exception:
+            pass   # a lost log entry must not fail the answer
+
+        data, viz, downsampled, approx = result["data"], result["viz"], None, result.get("approximate")
+        if max_points is not None and approx:
+            data, intervals, downsampled = downsample_approximate(result, viz, max_points)
+            approx = {**approx, "intervals": intervals}
+        elif max_points is not None:
+            data, downsampled = downsample(data, viz, max_points)
+
+        return {
+            "sql": generated_sql,
+            "data": data,
+            "viz": viz,
+            "truncated": result["truncated"],
+            "downsampled": downsampled,
+            "approximate": approx,
+            "cache": {"sql": sql_source, "rows": rows_source},
+            "timings_ms": {step: round(ms, 2) for step, ms in timings.items()},
+        }
+
+
+query_engine = QueryEngine()
+
 
-    # 5. Return: data + the SQL that was used
-    return {
-        "sql": generated_sql,
-        "data": data
-    }
+async def query_runner_agent(nl_query: str, user: str = "anonymous", max_points: int = None,
+                             approximate: bool = False, sample_percent: float = None):
+    """Convert a question to SQL with the shared QueryEngine and run it."""
+    return await query_engine.ask(nl_query, user, max_points, approximate, sample_percent)
@@ -0,0 +1,237 @@
+# backend/approximate.py
+"""
+Approximate execution for exploration on very large tables.
+
+An eligible statement — one table, no joins, subqueries, HAVING or DISTINCT
+aggregates, and only COUNT / SUM / AVG aggregates next to its group keys —
+is rewritten to read a TABLESAMPLE of its table (APPROX_METHOD at
+APPROX_SAMPLE_PERCENT) and to scale its results back up:
+
+    COUNT(x) → COUNT(x) / p            ± z·√((1−p)·n) / p
+    SUM(x)   → SUM(x) / p              ± z·√((1−p)·Σx²) / p
+    AVG(x)   → AVG(x)                  ± z·√(1−p)·s / √n
+
+where p is the sampled fraction, n the sampled rows and s their standard
+deviation; z follows APPROX_CONFIDENCE. Intervals are exact for BERNOULLI
+sampling; SYSTEM samples whole pages, so they are optimistic when values
+are clustered on disk (e.g. by load order), but it only reads p of the table.
+
+Tables whose planner estimate (pg_class.reltuples) is under APPROX_MIN_ROWS
+are always queried exactly: a sample would save little and cost accuracy.
+So are metrics that a time-bucket rollup answers, in O(days) anyway.
+"""
+import os
+import re
+import math
+from statistics import NormalDist
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Metric
+from result_cache import MetricResultCache, cache_key, table_version
+from result_transport import fetch_rows
+from downsample import downsample
+from rollups import routed_sql
+
+SAMPLE_PERCENT = float(os.getenv("APPROX_SAMPLE_PERCENT", "1"))
+METHOD = os.getenv("APPROX_METHOD", "SYSTEM").upper()   # SYSTEM or BERNOULLI
+CONFIDENCE = float(os.getenv("APPROX_CONFIDENCE", "0.95"))
+MIN_ROWS = int(os.getenv("APPROX_MIN_ROWS", "1000000"))
+if METHOD not in ("SYSTEM", "BERNOULLI"):
+    raise RuntimeError("APPROX_METHOD must be SYSTEM or BERNOULLI")
+
+_STATEMENT = re.compile(
+    r'^\s*select\s+(?P<select>.+?)\s+from\s+(?P<table>"[^"]+"|\w+)'
+    r'(?P<alias>\s+(?:as\s+)?(?!(?:where|group|order|limit)\b)\w+)?'
+    r'(?P<rest>\s+(?:where|group\s+by|order\s+by|limit)\b.*)?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL,
+)
+_AGGREGATE = re.compile(
+    r'^(?P<func>count|sum|avg)\s*\((?P<arg>.+)\)(?:\s+as\s+(?P<alias>"[^"]+"|\w+))?$',
+    re.IGNORECASE | re.DOTALL,
+)
+_INELIGIBLE = re.compile(r"\b(join|having|union|intersect|except|select|over|distinct|tablesample)\b", re.IGNORECASE)
+_ANY_AGGREGATE = re.compile(r"\b(count|sum|avg|min|max|stddev\w*|var\w*|percentile\w*|array_agg|string_agg)\s*\(",
+                            re.IGNORECASE)
+
+
+def _split_select(select_list: str) -> list[str]:
+    """Top-level comma-separated items of a select list."""
+    items, depth, quote, start = [], 0, None, 0
+    for i, ch in enumerate(select_list):
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            items.append(select_list[start:i].strip())
+            start = i + 1
+    items.append(select_list[start:].strip())
+    return items
+
+
+def _balanced(expr: str) -> bool:
+    depth = 0
+    for ch in expr:
+        depth += (ch == "(") - (ch == ")")
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+def sample_table(sql: str) -> str:
+    """The table an eligible statement reads, as written in it; None when it cannot be sampled."""
+    match = _STATEMENT.match(sql)
+    if match is None or _INELIGIBLE.search(match["select"]) or _INELIGIBLE.search(match["rest"] or ""):
+        return None
+    return match["table"]
+
+
+def approximate_sql(sql: str, percent: float = SAMPLE_PERCENT, method: str = METHOD):
+    """
+    (sampled and scaled SQL, [(func, output column), ...]) for an eligible
+    statement, else None. The rewritten statement returns the original
+    columns, then hidden "__n{i}" / "__q{i}" / "__sd{i}" columns per aggregate
+    that `finish` turns into confidence intervals and removes.
+    """
+    if sample_table(sql) is None:
+        return None
+    match = _STATEMENT.match(sql)
+    scale = repr(100.0 / percent)
+    columns, hidden, aggregates = [], [], []
+    for item in _split_select(match["select"]):
+        agg = _AGGREGATE.match(item)
+        if agg is None or not _balanced(agg["arg"]):
+            if _ANY_AGGREGATE.search(item):
+                return None   # an aggregate inside an expression, or one that does not scale
+            columns.append(item)
+            continue
+        func, arg, i = agg["func"].lower(), agg["arg"].strip(), len(aggregates)
+        alias = agg["alias"] or func
+        if func == "count":
+            columns.append(f"ROUND(COUNT({arg}) * {scale})::bigint AS {alias}")
+            hidden.append(f'COUNT({arg}) AS "__n{i}"')
+        elif func == "sum":
+            columns.append(f"SUM({arg}) * {scale} AS {alias}")
+            hidden.append(f'SUM(({arg})::float8 * ({arg})::float8) AS "__q{i}"')
+        else:
+            columns.append(f"AVG({arg}) AS {alias}")
+            hidden += [f'COUNT({arg}) AS "__n{i}"', f'STDDEV_SAMP({arg}) AS "__sd{i}"']
+        aggregates.append((func, alias.strip('"')))
+    if not aggregates:
+        return None
+
+    table = f'{match["table"]}{match["alias"] or ""} TABLESAMPLE {method} ({percent})'
+    rewritten = f'SELECT {", ".join(columns + hidden)} FROM {table}{match["rest"] or ""}'
+    return rewritten.rstrip().rstrip(";"), aggregates
+
+
+def finish(rows: list[dict], aggregates: list[tuple], percent: float = SAMPLE_PERCENT,
+           confidence: float = CONFIDENCE) -> tuple[list[dict], list[dict]]:
+    """(rows without the hidden columns, per row { output column: [low, high] })."""
+    p = percent / 100.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    data, intervals = [], []
+    for row in rows:
+        bounds = {}
+        for i, (func, column) in enumerate(aggregates):
+            estimate = row.get(column)
+            if estimate is None:
+                bounds[column] = None
+                continue
+            if func == "count":
+                error = z * math.sqrt((1 - p) * float(row[f"__n{i}"])) / p
+            elif func == "sum":
+                error = z * math.sqrt((1 - p) * float(row[f"__q{i}"] or 0)) / p
+            else:
+                n, sd = row[f"__n{i}"], row[f"__sd{i}"]
+                error = z * math.sqrt(1 - p) * float(sd) / math.sqrt(n) if sd is not None and n else 0.0
+            bounds[column] = [float(estimate) - error, float(estimate) + error]
+        data.append({key: value for key, value in row.items() if not key.startswith("__")})
+        intervals.append(bounds)
+    return data, intervals
+
+
+async def estimated_rows(session: AsyncSession, table: str) -> float:
+    """Planner row estimate of `table` (as written in SQL); -1 when unknown or never analyzed."""
+    result = await session.execute(
+        text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    )
+    reltuples = result.scalar()
+    return -1 if reltuples is None else reltuples
+
+
+def check_sample_percent(percent: float) -> float:
+    percent = SAMPLE_PERCENT if percent is None else percent
+    if not 0 < percent <= 100:
+        raise ValueError("sample_percent must be above 0 and at most 100")
+    return percent
+
+
+async def plan_approximate(session: AsyncSession, sql: str, percent: float):
+    """(sampled SQL, aggregates, table row estimate), or None when `sql` has to run exactly."""
+    rewritten = approximate_sql(sql, percent)
+    if rewritten is None:
+        return None
+    table_rows = await estimated_rows(session, sample_table(sql))
+    if table_rows < MIN_ROWS:
+        return None
+    return (*rewritten, table_rows)
+
+
+async def _run(session: AsyncSession, plan: tuple, percent: float, params: dict = None) -> dict:
+    sampled_sql, aggregates, table_rows = plan
+    rows, truncated = await fetch_rows(session, sampled_sql, params)
+    data, intervals = finish(rows, aggregates, percent)
+    return {
+        "data": data,
+        "truncated": truncated,
+        "approximate": {
+            "method": METHOD,
+            "sample_percent": percent,
+            "confidence": CONFIDENCE,
+            "estimated_rows": int(table_rows),
+            "intervals": intervals,
+        },
+    }
+
+
+async def run_approximate(session: AsyncSession, sql: str, percent: float = None, params: dict = None):
+    """
+    {"data", "truncated", "approximate": {method, sample_percent, confidence,
+    estimated_rows, intervals}} for `sql` run on a sample, or None when it has
+    to run exactly: not eligible, or its table is under APPROX_MIN_ROWS.
+    """
+    percent = check_sample_percent(percent)
+    plan = await plan_approximate(session, sql, percent)
+    return await _run(session, plan, percent, params) if plan else None
+
+
+async def approximate_metric(session: AsyncSession, metric: Metric, percent: float = None,
+                             cache: MetricResultCache = None):
+    """`run_approximate` for a metric's SQL, cached per sample rate until the table's next ingest."""
+    percent = check_sample_percent(percent)
+    if await routed_sql(session, metric) != metric.sql_definition:
+        return None
+    plan = await plan_approximate(session, metric.sql_definition, percent)
+    if plan is None:
+        return None
+    if cache is None or not metric.table_name:
+        return await _run(session, plan, percent)
+    version = await table_version(session, metric.table_name)
+    key = cache_key(f"approx-{METHOD}-{percent:g}", metric.id, metric.sql_definition, version)
+    return await cache.get_or_compute(
+        session, key, metric.table_name, version, lambda: _run(session, plan, percent)
+    )
+
+
+def downsample_approximate(result: dict, viz: dict, max_points: int) -> tuple[list[dict], list[dict], str]:
+    """(rows, their intervals, strategy): `downsample` with each interval kept beside its row."""
+    rows = [dict(row, __interval=interval) for row, interval in zip(result["data"], result["approximate"]["intervals"])]
+    rows, strategy = downsample(rows, viz, max_points)
+    # A synthesized "other" bar has no interval of its own
+    intervals = [row.pop("__interval", None) for row in rows]
+    return rows, intervals, strategy
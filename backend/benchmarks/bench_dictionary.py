@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# backend/benchmarks/bench_dictionary.py
+"""
+Compare per-column and batched column description against the stub LLM client.
+
+    cd backend && python benchmarks/bench_dictionary.py --columns 200 --latency 0.1
+
+Runs offline: the stub answers after `--latency` seconds per prompt, standing
+in for a network round-trip, so the numbers isolate prompt count and
+concurrency from model speed.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://offline/unused")  # never connected
+from llm import StubLLMClient                                          # noqa: E402
+from agents.dictionary_agent import describe_columns, BATCH_SIZE, LLM_CONCURRENCY  # noqa: E402
+
+TYPES = ["bigint", "double precision", "text", "timestamp", "boolean"]
+
+
+async def bench(columns: list[tuple[str, str]], latency: float, batch_size: int, concurrency: int):
+    client = StubLLMClient(latency=latency)
+    started = time.perf_counter()
+    descriptions = await describe_columns(client, "bench", columns, batch_size, concurrency)
+    elapsed = time.perf_counter() - started
+    assert len(descriptions) == len(columns)
+    return elapsed, client.calls
+
+
+async def main(n_columns: int, latency: float):
+    columns = [(f"col_{i}", TYPES[i % len(TYPES)]) for i in range(n_columns)]
+    modes = [
+        ("per-column, serial", 1, 1),
+        (f"per-column, {LLM_CONCURRENCY} concurrent", 1, LLM_CONCURRENCY),
+        (f"batched x{BATCH_SIZE}, {LLM_CONCURRENCY} concurrent", BATCH_SIZE, LLM_CONCURRENCY),
+    ]
+    for label, batch_size, concurrency in modes:
+        elapsed, calls = await bench(columns, latency, batch_size, concurrency)
+        print(f"{label:32s} {calls:>5d} prompts  {elapsed:7.2f}s  {n_columns / elapsed:>9,.1f} columns/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--columns", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1, help="simulated seconds per prompt")
+    args = parser.parse_args()
+    asyncio.run(main(args.columns, args.latency))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# backend/benchmarks/bench_loaders.py
+"""
+Compare the bulk loader backends (text CSV COPY vs binary record COPY).
+
+    cd backend && python benchmarks/bench_loaders.py --rows 1000000
+
+Loads a wide numeric table and a mixed-type table through every loader in
+INGEST_CSV_CHUNK_ROWS-sized chunks and prints rows/sec. Needs DATABASE_URL.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from db import engine                                   # noqa: E402
+from ingestor import CSV_CHUNK_ROWS                     # noqa: E402
+from loaders import LOADERS, fetch_column_types         # noqa: E402
+
+
+def numeric_frame(rows: int) -> tuple[pd.DataFrame, str]:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({f"f{i}": rng.normal(size=rows) for i in range(10)})
+    df["id"] = np.arange(rows, dtype="int64")
+    df["qty"] = rng.integers(0, 1000, size=rows)
+    ddl = ", ".join(f'"f{i}" DOUBLE PRECISION' for i in range(10)) + ', "id" BIGINT, "qty" BIGINT'
+    return df, ddl
+
+
+def mixed_frame(rows: int) -> tuple[pd.DataFrame, str]:
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "id": np.arange(rows, dtype="int64"),
+        "amount": rng.normal(100, 25, size=rows),
+        "country": rng.choice(["US", "DE", "FR", "IN", "BR"], size=rows),
+        "created_at": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 86400 * 365, size=rows), unit="s"),
+        "active": rng.integers(0, 2, size=rows).astype(bool),
+        "note": [f"order {i}" for i in range(rows)],
+    })
+    ddl = '"id" BIGINT, "amount" DOUBLE PRECISION, "country" TEXT, "created_at" TIMESTAMP, "active" BOOLEAN, "note" TEXT'
+    return df, ddl
+
+
+async def bench(name: str, df: pd.DataFrame, ddl: str, loader_name: str) -> float:
+    table = f"bench_{name}_{loader_name}"
+    loader = LOADERS[loader_name]()
+    async with engine.begin() as conn:
+        await conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+        await conn.execute(text(f'CREATE UNLOGGED TABLE "{table}" ({ddl})'))
+        pg_types = await fetch_column_types(conn, table)
+
+        started = time.perf_counter()
+        for start in range(0, len(df), CSV_CHUNK_ROWS):
+            chunk = df.iloc[start:start + CSV_CHUNK_ROWS].copy()
+            await loader.load(conn, table, chunk, pg_types)
+        elapsed = time.perf_counter() - started
+
+        await conn.execute(text(f'DROP TABLE "{table}"'))
+    return elapsed
+
+
+async def main(rows: int):
+    for name, build in [("numeric", numeric_frame), ("mixed", mixed_frame)]:
+        df, ddl = build(rows)
+        for loader_name in LOADERS:
+            elapsed = await bench(name, df, ddl, loader_name)
+            print(f"{name:8s} {loader_name:7s} {rows:>9,d} rows  {elapsed:7.2f}s  {rows / elapsed:>12,.0f} rows/s")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    asyncio.run(main(parser.parse_args().rows))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# backend/benchmarks/bench_schema_prompt.py
+"""
+Prompt size of the NL→SQL schema context: every table vs. the tables the
+schema index retrieves for the question.
+
+    cd backend && python benchmarks/bench_schema_prompt.py --tables 200
+
+The fixture catalogue mixes a few business domains with many auto-suffixed
+re-uploads (sheet1_2, sheet1_3, ...). Tokens are counted with tiktoken when
+it is installed, otherwise estimated at four characters per token. A
+question counts as a hit when the table it is about is among those retrieved.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://offline/unused")  # never connected
+from schema_index import SchemaIndex                          # noqa: E402
+from agents.query_runner import _schema_prompt                # noqa: E402
+
+DOMAINS = {
+    "orders": ["order_id", "customer_id", "order_date", "status", "total_amount", "currency", "ship_country"],
+    "customers": ["customer_id", "name", "email", "signup_date", "country", "segment", "lifetime_value"],
+    "inventory": ["sku", "warehouse", "quantity_on_hand", "reorder_level", "last_counted_at", "unit_cost"],
+    "web_sessions": ["session_id", "user_id", "started_at", "landing_page", "device", "bounce", "duration_s"],
+    "payroll": ["employee_id", "department", "pay_period", "gross_pay", "net_pay", "tax_withheld"],
+    "support_tickets": ["ticket_id", "opened_at", "closed_at", "priority", "channel", "satisfaction_score"],
+    "marketing_spend": ["campaign", "channel", "spend_date", "impressions", "clicks", "cost"],
+    "shipments": ["shipment_id", "order_id", "carrier", "shipped_at", "delivered_at", "freight_cost"],
+}
+TYPES = {"_id": "bigint", "_at": "timestamp", "date": "date", "amount": "numeric", "cost": "numeric"}
+QUESTIONS = [
+    ("total order amount by ship country last month", "orders"),
+    ("average satisfaction score of support tickets per channel", "support_tickets"),
+    ("which campaigns had the most clicks", "marketing_spend"),
+    ("net pay by department", "payroll"),
+    ("median freight cost per carrier", "shipments"),
+    ("bounce rate by device for web sessions", "web_sessions"),
+]
+
+
+def _type(column: str) -> str:
+    return next((t for suffix, t in TYPES.items() if column.endswith(suffix)), "text")
+
+
+def fixture(n_tables: int) -> dict[str, list[tuple]]:
+    """Domain tables, then generic spreadsheet uploads, up to n_tables."""
+    tables = {
+        name: [(col, _type(col), f"{col.replace('_', ' ').capitalize()} of the {name.replace('_', ' ')} record.")
+               for col in columns]
+        for name, columns in DOMAINS.items()
+    }
+    generic = [f"col_{i}" for i in range(12)]
+    for i in range(n_tables - len(tables)):
+        tables[f"sheet1_{i + 2}"] = [(col, "text", f"Column {col} of an uploaded spreadsheet.") for col in generic]
+    return tables
+
+
+def count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+    except ImportError:
+        return len(text) // 4
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+
+def main(n_tables: int):
+    tables = fixture(n_tables)
+    index = SchemaIndex()
+    started = time.perf_counter()
+    index.sync(tables)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    full = count_tokens(_schema_prompt(tables))
+    print(f"{n_tables} tables, {sum(map(len, tables.values()))} columns; index built in {build_ms:.1f} ms")
+    print(f"{'question':56s} {'all tables':>10s} {'retrieved':>10s}  hit  lookup")
+    hits = 0
+    for question, expected in QUESTIONS:
+        started = time.perf_counter()
+        relevant = index.relevant(question)
+        lookup_ms = (time.perf_counter() - started) * 1000
+        tokens = count_tokens(_schema_prompt(relevant))
+        hit = expected in relevant
+        hits += hit
+        print(f"{question:56s} {full:>10,d} {tokens:>10,d}  {'yes' if hit else 'NO ':3s}  {lookup_ms:5.2f} ms")
+    print(f"{hits}/{len(QUESTIONS)} questions retrieved their table")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=200)
+    args = parser.parse_args()
+    main(args.tables)
@@ -1,41 +1,151 @@
 # backend/db.py
 
 import os
+import time
+from dataclasses import dataclass
 from dotenv import load_dotenv
-import trio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeout
 
 # 1. Load environment variables from .env
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL not set in .env")
+# Optional hot standby for interactive reads (/metric, batches, NL queries)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 
 # 2. Detect if we’re running inside Alembic migrations
 #    (we’ll set ALEMBIC_CONTEXT=1 in migrations/env.py)
 _IS_MIGRATING = os.getenv("ALEMBIC_CONTEXT") == "1"
 
-# 3. Only create the async engine & sessionmaker when not migrating
-if not _IS_MIGRATING:
-    engine = create_async_engine(
-        DATABASE_URL,
+# 3. One pool per workload, so a big ingest cannot starve dashboards of connections:
+#      default     → scheduler bookkeeping, the event listener, shared cache writes
+#      ingest      → COPY loads and merges
+#      agents      → extractor / dictionary / analyst / index advisor / materializer
+#      interactive → API reads; on DATABASE_REPLICA_URL when set
+#    Each is tunable with DB_POOL_<NAME>_SIZE / _MAX_OVERFLOW / _TIMEOUT (seconds) /
+#    _STATEMENT_CACHE_SIZE (asyncpg prepared statements per connection, 0 = off)
+POOL_DEFAULTS = {
+    "default": {"size": 5, "max_overflow": 10, "timeout": 30.0, "statement_cache_size": 100},
+    # Mostly one-off DDL and COPY: prepared statements would rarely be reused
+    "ingest": {"size": 4, "max_overflow": 4, "timeout": 60.0, "statement_cache_size": 0},
+    "agents": {"size": 5, "max_overflow": 5, "timeout": 30.0, "statement_cache_size": 100},
+    # Fail fast rather than leave a dashboard hanging on a saturated pool
+    "interactive": {"size": 10, "max_overflow": 10, "timeout": 10.0, "statement_cache_size": 500},
+}
+
+
+def pool_settings(name: str) -> dict:
+    settings = dict(POOL_DEFAULTS[name])
+    for key, default in settings.items():
+        settings[key] = type(default)(os.getenv(f"DB_POOL_{name.upper()}_{key.upper()}", default))
+    return settings
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_ms: float = 0.0
+    max_wait_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 3),
+        }
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+    stats: PoolStats = None   # set per pool by _pool_class; survives pool re-creation
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            self.stats.timeouts += 1
+            raise
+        waited = (time.perf_counter() - started) * 1000
+        self.stats.checkouts += 1
+        self.stats.wait_ms += waited
+        self.stats.max_wait_ms = max(self.stats.max_wait_ms, waited)
+        return connection
+
+
+def _pool_class(name: str) -> type:
+    return type(f"{name.capitalize()}Pool", (TimedPool,), {"stats": PoolStats()})
+
+
+def _create_engine(name: str, url: str = DATABASE_URL):
+    settings = pool_settings(name)
+    return create_async_engine(
+        url,
         echo=False,
-        future=True
+        future=True,
+        poolclass=_pool_class(name),
+        pool_size=settings["size"],
+        max_overflow=settings["max_overflow"],
+        pool_timeout=settings["timeout"],
+        connect_args={"prepared_statement_cache_size": settings["statement_cache_size"]},
     )
-    SessionLocal = sessionmaker(
-        bind=engine,
+
+
+def _session_factory(bind):
+    return sessionmaker(
+        bind=bind,
         class_=AsyncSession,
         expire_on_commit=False,
         autoflush=False,
         autocommit=False
     )
+
+
+# 4. Only create the async engines & sessionmakers when not migrating
+if not _IS_MIGRATING:
+    engines = {
+        "default": _create_engine("default"),
+        "ingest": _create_engine("ingest"),
+        "agents": _create_engine("agents"),
+        "interactive": _create_engine("interactive", DATABASE_REPLICA_URL or DATABASE_URL),
+    }
+    engine = engines["default"]
+    ingest_engine = engines["ingest"]
+    agents_engine = engines["agents"]
+    SessionLocal = _session_factory(engine)
+    AgentSession = _session_factory(agents_engine)
+    InteractiveSession = _session_factory(engines["interactive"])
 else:
-    engine = None
-    SessionLocal = None
+    engines = {}
+    engine = ingest_engine = agents_engine = None
+    SessionLocal = AgentSession = InteractiveSession = None
+
+
+def pool_stats() -> dict:
+    """{ pool: checkout counts and wait times since start-up, plus current usage }."""
+    stats = {}
+    for name, pool_engine in engines.items():
+        pool = pool_engine.sync_engine.pool
+        stats[name] = {
+            **pool.stats.as_dict(),
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "replica": name == "interactive" and bool(DATABASE_REPLICA_URL),
+        }
+    return stats
+
+
+async def dispose_engines():
+    for pool_engine in engines.values():
+        await pool_engine.dispose()
 
-# 4. Concurrency limiter for LangGraph runs (max 3 concurrent pipelines)
-langgraph_semaphore = trio.CapacityLimiter(3)
 
 # 5. Base model for SQLAlchemy
 Base = declarative_base()
@@ -0,0 +1,133 @@
+# backend/description_cache.py
+"""
+Persistent cache of LLM column descriptions.
+
+Entries are keyed by a content fingerprint — model, table, column, data type
+and optionally a hash of sample values — so re-ingesting an unchanged schema
+(replace, append, a re-upload) reuses yesterday's descriptions without a
+model call. Entries expire after a TTL and the table is trimmed to its size
+cap by least recent use.
+"""
+import os
+import hashlib
+import datetime
+from dataclasses import dataclass
+from sqlalchemy import text, select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+from models import DescriptionCacheEntry
+
+CACHE_TTL_DAYS = float(os.getenv("DICTIONARY_CACHE_TTL_DAYS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("DICTIONARY_CACHE_MAX_ENTRIES", "100000"))
+# Rows whose values feed the fingerprint; 0 keys on the schema alone
+CACHE_SAMPLE_ROWS = int(os.getenv("DICTIONARY_CACHE_SAMPLE_ROWS", "0"))
+
+
+def fingerprint(model_id: str, table_name: str, column_name: str, data_type: str,
+                sample_hash: str = None) -> str:
+    key = "\x1f".join([model_id, table_name, column_name, data_type, sample_hash or ""])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+async def sample_hashes(conn: AsyncConnection, table_name: str, columns: list[str],
+                        rows: int = CACHE_SAMPLE_ROWS) -> dict[str, str]:
+    """
+    { column: hash of its sorted distinct values in the first `rows` rows }.
+    Heap order is stable for a table loaded from the same file, so an
+    unchanged re-upload hashes the same.
+    """
+    if rows <= 0 or not columns:
+        return {}
+    aggs = ", ".join(
+        f'array_agg(DISTINCT "{col}"::text ORDER BY "{col}"::text) AS "{col}"' for col in columns
+    )
+    result = await conn.execute(text(f'SELECT {aggs} FROM (SELECT * FROM "{table_name}" LIMIT :n) s'), {"n": rows})
+    row = result.mappings().first()
+    return {
+        col: hashlib.sha256("\x1f".join(v for v in row[col] or [] if v is not None).encode()).hexdigest()
+        for col in columns
+    }
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hit_rate, 4)}
+
+
+class DescriptionCache:
+    def __init__(self, ttl_days: float = CACHE_TTL_DAYS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = datetime.timedelta(days=ttl_days)
+        self.max_entries = max_entries
+        self.stats = CacheStats()   # per process, since start-up
+
+    async def get_many(self, conn: AsyncConnection, fingerprints: list[str]) -> dict[str, str]:
+        """{ fingerprint: description } for the live entries; hits are touched for LRU."""
+        if not fingerprints:
+            return {}
+        now = datetime.datetime.utcnow()
+        result = await conn.execute(
+            select(DescriptionCacheEntry.fingerprint, DescriptionCacheEntry.description)
+            .where(DescriptionCacheEntry.fingerprint.in_(fingerprints))
+            .where(DescriptionCacheEntry.created_at > now - self.ttl)
+        )
+        found = dict(result.all())
+        if found:
+            await conn.execute(
+                update(DescriptionCacheEntry)
+                .where(DescriptionCacheEntry.fingerprint.in_(list(found)))
+                .values(last_used_at=now, hits=DescriptionCacheEntry.hits + 1)
+            )
+        self.stats.hits += len(found)
+        self.stats.misses += len(set(fingerprints)) - len(found)
+        return found
+
+    async def put_many(self, conn: AsyncConnection, entries: dict[str, str], model_id: str):
+        """Store { fingerprint: description }, then evict expired and least recently used entries."""
+        if not entries:
+            return
+        now = datetime.datetime.utcnow()
+        stmt = insert(DescriptionCacheEntry).values([
+            {"fingerprint": fp, "description": desc, "model": model_id,
+             "created_at": now, "last_used_at": now, "hits": 0}
+            for fp, desc in entries.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DescriptionCacheEntry.fingerprint],
+            set_={"description": stmt.excluded.description, "model": stmt.excluded.model,
+                  "created_at": now, "last_used_at": now, "hits": 0},
+        )
+        await conn.execute(stmt)
+        await self.evict(conn)
+
+    async def evict(self, conn: AsyncConnection) -> int:
+        now = datetime.datetime.utcnow()
+        expired = await conn.execute(
+            delete(DescriptionCacheEntry).where(DescriptionCacheEntry.created_at <= now - self.ttl)
+        )
+        overflow = await conn.execute(
+            text("""
+            DELETE FROM description_cache WHERE fingerprint IN (
+                SELECT fingerprint FROM description_cache
+                ORDER BY last_used_at DESC
+                OFFSET :keep
+            )
+            """),
+            {"keep": self.max_entries}
+        )
+        evicted = expired.rowcount + overflow.rowcount
+        self.stats.evictions += evicted
+        return evicted
+
+
+description_cache = DescriptionCache()
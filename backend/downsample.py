@@ -0,0 +1,227 @@
+# backend/downsample.py
+"""
+Bounded chart payloads (`max_points`).
+
+The strategy follows the result's viz hint:
+  • line    → daily-count metrics are re-bucketed in SQL (day → week → month →
+              quarter → year) to the finest unit that fits; whatever is still
+              too long is thinned with LTTB (Largest-Triangle-Three-Buckets),
+              which keeps the visual peaks and troughs of the series. The
+              buckets are summed from the column's rollup when it has one
+  • bar     → top-K categories plus one "other" bar holding the remainder. Its
+              category is NULL and rows carry an `is_other` flag, so neither a
+              real "other" value nor a real NULL one is merged into it
+  • other   → evenly spaced rows
+"""
+import decimal
+import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Metric, ColumnMeta
+from agents.analyst_agent import TOP_CATEGORIES
+from metric_batch import classify
+from metric_runner import evaluate_metric
+from result_cache import MetricResultCache, cache_key, table_version
+from result_transport import fetch_rows
+from rollups import table_rollups, bucket_sql
+
+# Date buckets from finest to coarsest, with their width in days
+BUCKETS = (("day", 1), ("week", 7), ("month", 30.44), ("quarter", 91.31), ("year", 365.25))
+
+
+def bucket_count_sql(table_name: str, col: str, unit: str) -> str:
+    """Row counts of `col` per `unit`; the same columns as the analyst's daily counts."""
+    return (
+        f"SELECT DATE_TRUNC('{unit}', \"{col}\")::date AS day, COUNT(*) AS count "
+        f"FROM \"{table_name}\" GROUP BY 1 ORDER BY day"
+    )
+
+
+def top_k_other_sql(table_name: str, col: str, k: int) -> str:
+    """The k-1 most frequent values of `col`, plus the count of all the others (flagged is_other)."""
+    return (
+        f"SELECT CASE WHEN rank < {k} THEN category END AS category, "
+        f"SUM(count) AS count, rank >= {k} AS is_other FROM ("
+        f"SELECT \"{col}\"::text AS category, COUNT(*) AS count, "
+        f"ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC) AS rank "
+        f"FROM \"{table_name}\" GROUP BY \"{col}\") ranked "
+        f"GROUP BY 1, 3 ORDER BY MIN(rank)"
+    )
+
+
+def pick_bucket(first: datetime.date, last: datetime.date, max_points: int) -> str:
+    """Finest date bucket that spans first..last in at most max_points buckets."""
+    span = (last - first).days
+    for unit, width in BUCKETS:
+        if span / width + 1 <= max_points:
+            return unit
+    return BUCKETS[-1][0]
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _as_number(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return float(value.toordinal())
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return float(value)
+    try:
+        return datetime.datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def lttb(rows: list[dict], x: str, y: str, max_points: int) -> list[dict]:
+    """Largest-Triangle-Three-Buckets: max_points rows that preserve the shape of y over x."""
+    n = len(rows)
+    if n <= max_points:
+        return rows
+    if max_points < 3:
+        return [rows[0], rows[-1]][:max_points]
+
+    xs = [_as_number(row.get(x)) for row in rows] if x else [None]
+    if None in xs:
+        xs = [float(i) for i in range(n)]   # no usable x axis: rows are equally spaced
+    ys = [float(_as_number(row.get(y)) or 0.0) for row in rows]
+
+    sampled, a = [rows[0]], 0
+    every = (n - 2) / (max_points - 2)
+    for i in range(max_points - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        span = max(next_end - next_start, 1)
+        avg_x = sum(xs[next_start:next_end]) / span if next_end > next_start else xs[-1]
+        avg_y = sum(ys[next_start:next_end]) / span if next_end > next_start else ys[-1]
+
+        best, best_area = start, -1.0
+        for j in range(start, min(end, n)):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(rows[best])
+        a = best
+    sampled.append(rows[-1])
+    return sampled
+
+
+def top_k_other(rows: list[dict], x: str, y: str, max_points: int) -> list[dict]:
+    """The max_points-1 largest bars, plus one bar summing the rest; like top_k_other_sql's rows."""
+    if len(rows) <= max_points:
+        return rows
+    ranked = sorted(rows, key=lambda row: _as_number(row.get(y)) or 0, reverse=True)
+    rest = ranked[max_points - 1:]
+    other = {x: None, y: sum(_as_number(row.get(y)) or 0 for row in rest), "is_other": True}
+    return [{**row, "is_other": False} for row in ranked[:max_points - 1]] + [other]
+
+
+def evenly_spaced(rows: list[dict], max_points: int) -> list[dict]:
+    if len(rows) <= max_points:
+        return rows
+    step = len(rows) / max_points
+    return [rows[int(i * step)] for i in range(max_points)]
+
+
+def downsample(rows: list[dict], viz: dict, max_points: int) -> tuple[list[dict], str]:
+    """(at most max_points rows, strategy used) for in-memory rows, following the viz hint."""
+    if len(rows) <= max_points:
+        return rows, "none"
+    viz = viz or {}
+    x, y = viz.get("x"), viz.get("y")
+    if viz.get("type") == "line" and y:
+        return lttb(rows, x, y, max_points), "lttb"
+    if viz.get("type") == "bar" and x and y:
+        return top_k_other(rows, x, y, max_points), "top_k_other"
+    return evenly_spaced(rows, max_points), "evenly_spaced"
+
+
+def guess_viz(rows: list[dict]) -> dict:
+    """Viz hint for ad-hoc results from their first two columns: time → line, label + number → bar."""
+    if not rows:
+        return {"x": None, "y": None, "type": None}
+    columns = list(rows[0].items())
+    if len(columns) < 2:
+        return {"x": None, "y": columns[0][0], "type": "numeric"}
+    (x, first), (y, second) = columns[:2]
+    if isinstance(second, (int, float, decimal.Decimal)) and not isinstance(second, bool):
+        if isinstance(first, (datetime.date, datetime.datetime)):
+            return {"x": x, "y": y, "type": "line"}
+        if isinstance(first, str):
+            return {"x": x, "y": y, "type": "bar"}
+    return {"x": x, "y": y, "type": "scatter"}
+
+
+async def _fetch(session: AsyncSession, sql: str) -> list[dict]:
+    rows, _ = await fetch_rows(session, sql)
+    return rows
+
+
+async def _cached_rows(session: AsyncSession, cache: MetricResultCache, kind: str, metric: Metric,
+                       sql: str, version: int) -> list[dict]:
+    key = cache_key(kind, metric.id, sql, version)
+    return await cache.get_or_compute(session, key, metric.table_name, version, lambda: _fetch(session, sql))
+
+
+async def _date_range(session: AsyncSession, table_name: str, col: str):
+    """Approximate (first, last) date of `col` from its pg_stats profile, if known."""
+    result = await session.execute(
+        select(ColumnMeta.min_value, ColumnMeta.max_value)
+        .where(ColumnMeta.table_name == table_name)
+        .where(ColumnMeta.column_name == col)
+    )
+    row = result.first()
+    if row is None:
+        return None, None
+    return _as_date(row.min_value), _as_date(row.max_value)
+
+
+async def downsample_metric(session: AsyncSession, metric: Metric, max_points: int,
+                            cache: MetricResultCache = None) -> tuple[list[dict], str]:
+    """
+    (at most max_points rows, strategy) for a metric. Analyst daily counts are
+    coarsened in SQL and top-K category counts get an exact "other" bar;
+    everything else is evaluated as usual and reduced in memory.
+    """
+    kind, *args = classify(metric) if metric.table_name else ("standalone",)
+
+    if kind == "daily":
+        col = args[0]
+        first, last = await _date_range(session, metric.table_name, col)
+        if first is None or last is None:
+            # No profile: the daily series itself tells the span
+            rows = await evaluate_metric(session, metric, cache=cache)
+            if len(rows) <= max_points:
+                return rows, "none"
+            days = [d for d in (_as_date(row["day"]) for row in rows) if d is not None]
+            first, last = (min(days), max(days)) if days else (None, None)
+        unit = pick_bucket(first, last, max_points) if first and last else "day"
+        if unit != "day":
+            rollup = (await table_rollups(session, metric.table_name)).get(col)
+            sql = bucket_sql(rollup, unit) if rollup else bucket_count_sql(metric.table_name, col, unit)
+            if cache is not None:
+                version = await table_version(session, metric.table_name)
+                rows = await _cached_rows(session, cache, f"bucket-{unit}", metric, sql, version)
+            else:
+                rows = await _fetch(session, sql)
+            rows, strategy = downsample(rows, metric.viz_hint, max_points)
+            return rows, f"{unit}_buckets" + ("" if strategy == "none" else f"+{strategy}")
+
+    if kind == "category" and max_points < TOP_CATEGORIES:
+        sql = top_k_other_sql(metric.table_name, args[0], max_points)
+        if cache is not None:
+            version = await table_version(session, metric.table_name)
+            return await _cached_rows(session, cache, "top-k", metric, sql, version), "top_k_other"
+        return await _fetch(session, sql), "top_k_other"
+
+    rows = await evaluate_metric(session, metric, cache=cache)
+    return downsample(rows, metric.viz_hint, max_points)
@@ -0,0 +1,99 @@
+# backend/events.py
+"""
+Push notifications for pipeline runs.
+
+The scheduler sends every job transition with pg_notify in the transaction
+that makes it, so an event is only ever seen once it is committed. Each
+backend process keeps one LISTEN connection and fans the events out to the
+in-process subscribers of that run (the SSE streams), whichever worker ran
+the job.
+"""
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from db import engine
+
+EVENTS_CHANNEL = "pipeline_events"
+# Streams re-read the run this often, covering notifications missed while the
+# listener was down, and send a keep-alive to idle clients
+RESYNC_SECONDS = float(os.getenv("PIPELINE_EVENTS_RESYNC_SECONDS", "15"))
+
+# Columns a job UPDATE must RETURN to be published
+EVENT_COLUMNS = "run_id, table_name, stage, status, attempts, started_at, finished_at, error"
+
+TERMINAL_STATES = {"done", "failed", "skipped", "cancelled"}
+# pg_notify payloads are capped at 8000 bytes, and SQLAlchemy errors carry the whole
+# statement; events keep the head of the error, the job row keeps all of it
+EVENT_ERROR_CHARS = 500
+
+
+def job_event(row) -> dict:
+    """Serializable view of one pipeline_jobs row, with the stage duration."""
+    started_at, finished_at = row["started_at"], row["finished_at"]
+    duration_ms = None
+    if started_at and finished_at:
+        duration_ms = int((finished_at - started_at).total_seconds() * 1000)
+    return {
+        "run_id": row["run_id"],
+        "table": row["table_name"],
+        "stage": row["stage"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "started_at": started_at.isoformat() if started_at else None,
+        "finished_at": finished_at.isoformat() if finished_at else None,
+        "duration_ms": duration_ms,
+        "error": row["error"],
+    }
+
+
+async def publish(conn: AsyncConnection, rows):
+    """Queue a notification per job row; delivered when `conn` commits."""
+    for row in rows:
+        event = job_event(row)
+        if event["error"] and len(event["error"]) > EVENT_ERROR_CHARS:
+            event["error"] = event["error"][:EVENT_ERROR_CHARS] + "…"
+        await conn.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": EVENTS_CHANNEL, "payload": json.dumps(event)}
+        )
+
+
+class RunEventBus:
+    def __init__(self, channel: str = EVENTS_CHANNEL):
+        self.channel = channel
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._conn: AsyncConnection = None
+
+    async def start(self):
+        self._conn = await engine.connect()
+        raw = await self._conn.get_raw_connection()
+        await raw.driver_connection.add_listener(self.channel, self._on_notify)
+
+    async def stop(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def _on_notify(self, _connection, _pid, _channel, payload: str):
+        event = json.loads(payload)
+        for queue in self._subscribers.get(event["run_id"], ()):
+            queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(self, run_id: str):
+        """Queue receiving every job event of `run_id` while the block is open."""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(run_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(run_id)
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[run_id]
+
+
+run_events = RunEventBus()
@@ -1,11 +1,52 @@
 # backend/ingestor.py
 import io
-import pandas as pd
+import os
 import re
+import time
+import asyncio
+import datetime
+import itertools
+import collections
+import resource
+import pandas as pd
 from sqlalchemy import text
-from db import engine
+from db import ingest_engine
+from loaders import fetch_column_types, get_loader
+import parsing
+import staging
+import partitions
+from rollups import refresh_rollups, trim_rollups
+from type_inference import infer_schema, coerce_frame, widen, with_headroom
+from result_cache import bump_table_version
+from parsing import run_in_parse_pool, PARSE_WORKERS, SHEET_CONCURRENCY
 from sqlalchemy.ext.asyncio import AsyncConnection
 
+# Rows per DataFrame chunk when streaming a CSV upload. Peak memory is bounded
+# by the chunks being parsed ahead (INGEST_PARSE_WORKERS) plus one COPY buffer,
+# regardless of the file size.
+CSV_CHUNK_ROWS = int(os.getenv("INGEST_CSV_CHUNK_ROWS", "50000"))
+
+
+def _current_rss_mb() -> float:
+    """Resident set size of this process in MB (falls back to the lifetime peak)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is reported in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PartialIngestError(Exception):
+    """Some sheets of a workbook failed after others were committed; `tables` are the loaded ones."""
+
+    def __init__(self, tables: list[str], errors: dict[str, str]):
+        super().__init__("; ".join(f"sheet '{sheet}': {error}" for sheet, error in errors.items()))
+        self.tables = tables
+        self.errors = errors   # { sheet: error message }
+
+
 class Ingestor:
     """
     Ingest CSV or Excel file into Postgres as a new table / replace / append.
@@ -19,90 +60,324 @@ class Ingestor:
         return sanitized
 
     @staticmethod
-    async def ingest_file(file_bytes: bytes, filename: str, mode: str, target_table: str = None, user: str = "anonymous"):
+    async def _widen_columns(conn: AsyncConnection, table_name: str, types: dict, profiles: dict) -> bool:
+        """
+        Widen table columns that a later chunk no longer fits (e.g. SMALLINT -> BIGINT,
+        DATE -> TIMESTAMP, anything -> TEXT). `types` is updated in place.
+        """
+        altered = False
+        for col, profile in profiles.items():
+            merged = widen(types[col], profile.pg_type)
+            if merged == types[col]:
+                continue
+            new_type = with_headroom(merged)
+            if new_type != (types[col] or "TEXT"):
+                await conn.execute(text(
+                    f'ALTER TABLE "{table_name}" ALTER COLUMN "{col}" TYPE {new_type} USING "{col}"::{new_type};'
+                ))
+                altered = True
+            types[col] = new_type
+        return altered
+
+    @staticmethod
+    async def _register_partitioning(conn: AsyncConnection, table_name: str, partitioner):
+        """Record how a created / replaced table is partitioned, or that it no longer is."""
+        if partitioner is None:
+            await partitions.unregister(conn, table_name)
+            return
+        if partitioner.table_name != table_name:
+            await partitioner.adopt(conn, table_name)
+        await partitioner.register(conn)
+
+    @staticmethod
+    async def drop_partitions(table_name: str, before: datetime.datetime) -> list[str]:
+        """
+        Retention for a partitioned table: drop the partitions holding only values
+        before `before`, with a new data version and trimmed rollups in the same
+        transaction. Returns the dropped partitions.
+        """
+        async with ingest_engine.begin() as conn:
+            dropped, until = await partitions.drop_partitions(conn, table_name, before)
+            if dropped:
+                await bump_table_version(conn, table_name)
+                if until is not None:
+                    part = await partitions.partitioner(conn, table_name)
+                    await trim_rollups(conn, table_name, part.column, until)
+                else:
+                    await refresh_rollups(conn, table_name)
+        return dropped
+
+    @staticmethod
+    async def _resolve_table_names(sheet_names: list[str], mode: str, target_table: str = None) -> dict[str, str]:
+        """Pick a free table name per sheet up front, so sheets can load in parallel."""
+        if mode != "create":
+            if not target_table:
+                raise ValueError("target_table required for replace/append")
+            return {sheet: target_table for sheet in sheet_names}
+
+        names, taken = {}, set()
+        async with ingest_engine.connect() as conn:
+            for sheet in sheet_names:
+                base_name = sheet.lower()
+                table_name = base_name
+                suffix = 0
+                while True:
+                    if table_name not in taken:
+                        exists = await conn.execute(text("SELECT to_regclass(:tbl)"), {"tbl": table_name})
+                        if exists.scalar() is None:
+                            break
+                    suffix += 1
+                    table_name = f"{base_name}_{suffix}"
+                taken.add(table_name)
+                names[sheet] = table_name
+        return names
+
+    @staticmethod
+    def _read_csv_rows(fileobj, lines: int) -> bytes:
+        """The next `lines` lines of a binary CSV, extended until no quoted field is cut in two."""
+        block = list(itertools.islice(fileobj, lines))
+        # Quotes inside a quoted field are doubled, so an odd count means the cut fell inside one
+        quotes = sum(line.count(b'"') for line in block)
+        while quotes % 2:
+            line = fileobj.readline()
+            if not line:
+                break   # unbalanced to the end: left for the parser to report
+            block.append(line)
+            quotes += line.count(b'"')
+        return b"".join(block)
+
+    @staticmethod
+    async def _csv_chunks(fileobj, chunk_rows: int):
+        """
+        Yield DataFrame chunks of a CSV. Whole rows are cut off the file here and
+        parsed in the process pool, up to INGEST_PARSE_WORKERS chunks ahead.
+        """
+        header = await asyncio.to_thread(Ingestor._read_csv_rows, fileobj, 1)
+        pending, eof, first = collections.deque(), False, True
+        try:
+            while True:
+                while not eof and len(pending) < PARSE_WORKERS:
+                    body = await asyncio.to_thread(Ingestor._read_csv_rows, fileobj, chunk_rows)
+                    eof = not body
+                    # A file without rows is still parsed once, for its columns (or its error)
+                    if body or first:
+                        pending.append(asyncio.ensure_future(run_in_parse_pool(parsing.read_csv_chunk, header, body)))
+                        first = False
+                if not pending:
+                    return
+                yield await pending.popleft()
+        finally:
+            for parse in pending:
+                parse.cancel()
+
+    @staticmethod
+    async def _excel_sheet_chunks(frame: pd.DataFrame):
+        """Excel has no streaming reader; each parsed sheet is one chunk."""
+        yield frame
+
+    @staticmethod
+    async def ingest_file(file_bytes: bytes, filename: str, mode: str, target_table: str = None,
+                          user: str = "anonymous", loader: str = None,
+                          key_columns: list[str] = None, on_conflict: str = "update",
+                          partition_by: str = None, partition_interval: str = None):
         """
         file_bytes: raw bytes of CSV or Excel
         filename: original filename
         mode: "create", "replace", or "append"
         target_table: required for replace/append
+        loader: bulk loader backend ("binary" / "csv"); defaults to INGEST_LOADER
+        key_columns: append only — dedupe / upsert on these columns
+        on_conflict: append with key_columns — "update" (upsert) or "ignore" (keep existing rows)
+        partition_by: create/replace — range-partition on this date / timestamp column, or on
+                      the first one with "auto"; defaults to INGEST_PARTITION_BY ("" = off)
+        partition_interval: "day", "week", "month", "quarter" or "year" per partition;
+                            defaults to INGEST_PARTITION_INTERVAL
         """
-        # 1. Load into pandas DataFrame(s)
-        if filename.lower().endswith((".xlsx", ".xls")):
-            xls = pd.read_excel(io.BytesIO(file_bytes), sheet_name=None, engine="openpyxl")
-            tables = {sheet: df for sheet, df in xls.items()}
-        else:
-            df = pd.read_csv(io.BytesIO(file_bytes))
-            tables = {"sheet1": df}
-
-        loaded_tables = []
-        async with engine.begin() as conn:  # type: AsyncConnection
-            for sheet_name, df in tables.items():
-                # 2. Sanitize column names
-                df.columns = [Ingestor._sanitize_col(c) for c in df.columns]
-
-                # 3. Determine new table name
-                if mode == "create":
-                    base_name = sheet_name.lower()
-                    table_name = base_name
-                    suffix = 0
-                    while True:
-                        exists = await conn.execute(text("SELECT to_regclass(:tbl)"), {"tbl": table_name})
-                        if exists.scalar() is None:
-                            break
-                        suffix += 1
-                        table_name = f"{base_name}_{suffix}"
-                else:
-                    if not target_table:
-                        raise ValueError("target_table required for replace/append")
-                    table_name = target_table
-
-                # 4. Replace vs Append logic
-                if mode == "replace":
-                    await conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}" CASCADE;'))
-
-                # 5. Create if needed
-                if mode == "create":
-                    col_types = []
-                    sample = df.head(1000)
-                    for col, ser in sample.items():
-                        dtype = "TEXT"
-                        if pd.api.types.is_integer_dtype(ser.dropna()):
-                            dtype = "BIGINT"
-                        elif pd.api.types.is_float_dtype(ser.dropna()):
-                            dtype = "DOUBLE PRECISION"
-                        elif pd.api.types.is_datetime64_any_dtype(ser.dropna()):
-                            dtype = "TIMESTAMP"
-                        col_types.append(f'"{col}" {dtype}')
-                    cols_ddl = ", ".join(col_types)
-                    create_sql = f'CREATE TABLE "{table_name}" ({cols_ddl});'
-                    await conn.execute(text(create_sql))
-
-                # 6. COPY data
-                tmp_buffer = io.StringIO()
-                df.to_csv(tmp_buffer, index=False, header=True)
-                tmp_buffer.seek(0)
-                copy_sql = f'COPY "{table_name}" FROM STDIN WITH (FORMAT csv, HEADER true);'
-                await conn.connection.copy_expert(copy_sql, tmp_buffer)
-
-                # 7. ANALYZE table
-                await conn.execute(text(f'ANALYZE "{table_name}";'))
+        if not filename.lower().endswith((".xlsx", ".xls")):
+            return await Ingestor.ingest_stream(
+                io.BytesIO(file_bytes), filename, mode, target_table, user,
+                loader=loader, key_columns=key_columns, on_conflict=on_conflict,
+                partition_by=partition_by, partition_interval=partition_interval
+            )
+
+        # One worker opens the workbook once for all its sheets, rather than each sheet
+        # shipping the whole file to a worker and re-reading its shared parts
+        frames = await run_in_parse_pool(parsing.read_excel_sheets, file_bytes)
+        sheets = {sheet: Ingestor._excel_sheet_chunks(frame) for sheet, frame in frames.items()}
+        return await Ingestor._ingest_sheets(sheets, filename, mode, target_table, user, loader, key_columns, on_conflict,
+                                             partition_by, partition_interval)
 
-                # 8. Record ingestion history
-                row_count = len(df)
-                await conn.execute(
-                    text("""
-                    INSERT INTO ingest_history (table_name, mode, file_name, row_count, loaded_by)
-                    VALUES (:tbl, :mode, :fname, :rows, :user)
-                    """),
-                    {
-                        "tbl": table_name,
-                        "mode": mode,
-                        "fname": filename,
-                        "rows": row_count,
-                        "user": user
-                    }
+    @staticmethod
+    async def ingest_stream(fileobj, filename: str, mode: str, target_table: str = None,
+                            user: str = "anonymous", chunk_rows: int = CSV_CHUNK_ROWS, loader: str = None,
+                            key_columns: list[str] = None, on_conflict: str = "update",
+                            partition_by: str = None, partition_interval: str = None):
+        """
+        Stream a CSV file object into Postgres in chunks of `chunk_rows` rows.
+        The schema is inferred from the first chunk; every chunk is COPYed as it is read.
+        """
+        chunks = Ingestor._csv_chunks(fileobj, chunk_rows)
+        return await Ingestor._ingest_sheets(
+            {"sheet1": chunks}, filename, mode, target_table, user, loader, key_columns, on_conflict,
+            partition_by, partition_interval
+        )
+
+    @staticmethod
+    async def _ingest_sheets(sheets: dict, filename: str, mode: str, target_table: str, user: str,
+                             loader: str = None, key_columns: list[str] = None, on_conflict: str = "update",
+                             partition_by: str = None, partition_interval: str = None):
+        """
+        sheets: { sheet_name: async iterator of DataFrame chunks }
+
+        In create mode every sheet gets its own table and is loaded concurrently
+        (up to INGEST_SHEET_CONCURRENCY) on its own connection and transaction.
+        Replace/append target a single table, so their sheets load one at a time.
+        Each sheet commits on its own: when some fail after others loaded,
+        PartialIngestError reports both; when none loaded, the first error is raised.
+        """
+        bulk_loader = get_loader(loader)
+        partition_interval = partitions.check_interval(partition_interval)
+        table_names = await Ingestor._resolve_table_names(list(sheets), mode, target_table)
+        limiter = asyncio.Semaphore(SHEET_CONCURRENCY if mode == "create" else 1)
+
+        async def load(sheet_name: str):
+            async with limiter:
+                return await Ingestor._load_sheet(
+                    sheets[sheet_name], table_names[sheet_name], filename, mode, user, bulk_loader,
+                    key_columns, on_conflict, partition_by, partition_interval
                 )
 
-                loaded_tables.append(table_name)
+        results = await asyncio.gather(*(load(sheet) for sheet in sheets), return_exceptions=True)
+        loaded, errors = [], {}
+        for sheet, res in zip(sheets, results):
+            if isinstance(res, BaseException):
+                if not isinstance(res, Exception):
+                    raise res   # cancellation
+                errors[sheet] = res
+            elif res:
+                loaded.append(res)
+        if errors and not loaded:
+            raise next(iter(errors.values()))
+        if errors:
+            raise PartialIngestError(loaded, {sheet: str(e) for sheet, e in errors.items()})
+        return loaded
+
+    @staticmethod
+    async def _load_sheet(chunks, table_name: str, filename: str, mode: str, user: str, bulk_loader,
+                          key_columns: list[str] = None, on_conflict: str = "update",
+                          partition_by: str = None, partition_interval: str = None) -> str:
+        """
+        Load one sheet's chunks in a single transaction.
+
+        create  → COPY straight into the new table.
+        replace → COPY into a staging table, then swap it in by rename.
+        append  → COPY into an unlogged staging table, then reconcile columns and
+                  merge (optionally deduplicated / upserted on `key_columns`).
+
+        With `partition_by`, create / replace build a range-partitioned table
+        and add partitions as chunks arrive; appends to such a table add the
+        partitions their rows need before the merge.
+        """
+        started = time.perf_counter()
+        peak_rss = _current_rss_mb()
+
+        # 1. Pull the first chunk; it drives the DDL
+        first = await anext(chunks, None)
+        if first is None:
+            return None
+
+        # 2. Sanitize column names
+        columns = [Ingestor._sanitize_col(c) for c in first.columns]
+        first.columns = columns
+        key_columns = [Ingestor._sanitize_col(k) for k in key_columns or []]
+        partition_by = partitions.PARTITION_BY if partition_by is None else partition_by
+        if partition_by and partition_by != "auto":
+            partition_by = Ingestor._sanitize_col(partition_by)
+
+        async with ingest_engine.begin() as conn:  # type: AsyncConnection
+            # 3. Create the load table, typed from a full profile of the first chunk;
+            #    partitioned on its key column when asked to
+            load_table = table_name if mode == "create" else staging.staging_name()
+            profiles = infer_schema(first)
+            partitioner = None
+            column = partitions.pick_column(profiles, partition_by) if partition_by and mode != "append" else None
+            if column:
+                partitioner = partitions.Partitioner(load_table, column, partitions.check_interval(partition_interval),
+                                                     tz=profiles[column].pg_type == "TIMESTAMPTZ")
+                profiles[column].pg_type = partitioner.key_type
+            types = {col: profile.pg_type for col, profile in profiles.items()}
+            cols_ddl = ", ".join(f'"{col}" {profile.ddl_type}' for col, profile in profiles.items())
+            # Only an append's staging table, dropped after the merge, skips the WAL;
+            # partitions are created logged, so a partitioned staging table is too
+            unlogged = "UNLOGGED " if mode == "append" and not partitioner else ""
+            partition_clause = f' PARTITION BY RANGE ("{column}")' if partitioner else ""
+            await conn.execute(text(f'CREATE {unlogged}TABLE "{load_table}" ({cols_ddl}){partition_clause};'))
+            pg_types = await fetch_column_types(conn, load_table)
+            await bulk_loader.schema_changed(conn)
+
+            # 4. Bulk load data chunk by chunk; every later chunk is profiled too
+            #    and widens the columns it does not fit
+            row_count = 0
+            chunk = first
+            while chunk is not None:
+                chunk.columns = columns
+                if chunk is not first:
+                    profiles = infer_schema(chunk)
+                    if await Ingestor._widen_columns(conn, load_table, types, profiles):
+                        pg_types = await fetch_column_types(conn, load_table)
+                        await bulk_loader.schema_changed(conn)
+                coerce_frame(chunk, profiles)
+                if partitioner:
+                    await partitioner.for_frame(conn, chunk)
+                await bulk_loader.load(conn, load_table, chunk, pg_types)
+                row_count += len(chunk)
+                peak_rss = max(peak_rss, _current_rss_mb())
+                chunk = await anext(chunks, None)
+
+            # 5. Publish the rows, refresh planner statistics and the time-bucket
+            #    rollups; a plain append only adds its staging rows to them
+            if mode == "create":
+                await conn.execute(text(f'ANALYZE "{table_name}";'))
+                await Ingestor._register_partitioning(conn, table_name, partitioner)
+                await refresh_rollups(conn, table_name)
+            elif mode == "replace" or not await staging.table_exists(conn, table_name):
+                await staging.swap_in(conn, load_table, table_name)
+                await Ingestor._register_partitioning(conn, table_name, partitioner)
+                await refresh_rollups(conn, table_name)
+            else:
+                target_partitioner = await partitions.partitioner(conn, table_name)
+                if target_partitioner:
+                    if key_columns and target_partitioner.column not in key_columns:
+                        raise ValueError(f"key_columns of partitioned table '{table_name}' must include "
+                                         f"its partition column '{target_partitioner.column}'")
+                    await target_partitioner.for_table(conn, load_table)
+                await staging.merge_into(conn, load_table, table_name, key_columns, on_conflict)
+                await refresh_rollups(conn, table_name, staging=None if key_columns else load_table)
+                await conn.execute(text(f'DROP TABLE "{load_table}";'))
+                await staging.analyze_if_needed(conn, table_name, row_count)
+
+            # 6. New data version: cached metric results of the table go stale
+            #    the moment this transaction commits
+            await bump_table_version(conn, table_name)
+
+            # 7. Record ingestion history
+            elapsed = time.perf_counter() - started
+            await conn.execute(
+                text("""
+                INSERT INTO ingest_history
+                    (table_name, mode, file_name, row_count, loaded_by, duration_ms, rows_per_sec, peak_rss_mb)
+                VALUES (:tbl, :mode, :fname, :rows, :user, :ms, :rps, :rss)
+                """),
+                {
+                    "tbl": table_name,
+                    "mode": mode,
+                    "fname": filename,
+                    "rows": row_count,
+                    "user": user,
+                    "ms": int(elapsed * 1000),
+                    "rps": row_count / elapsed if elapsed > 0 else None,
+                    "rss": round(peak_rss, 1),
+                }
+            )
 
-        return loaded_tables
+        return table_name
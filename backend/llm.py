@@ -0,0 +1,94 @@
+# backend/llm.py
+import os
+import json
+import asyncio
+import hashlib
+
+# LLM backend used by the agents: "openai" or "stub" (deterministic, offline)
+DEFAULT_LLM_CLIENT = os.getenv("LLM_CLIENT", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+
+class LLMClient:
+    """Async chat completion returning a parsed JSON object."""
+
+    name = "base"
+
+    @property
+    def model_id(self) -> str:
+        """Identifies the model behind the answers, e.g. for caching them."""
+        return self.name
+
+    async def complete_json(self, system: str, prompt: str) -> dict:
+        raise NotImplementedError
+
+
+class OpenAIClient(LLMClient):
+    name = "openai"
+
+    def __init__(self, model: str = None, temperature: float = 0.2):
+        from openai import AsyncOpenAI
+        self.model = model or LLM_MODEL
+        self.temperature = temperature
+        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model}"
+
+    async def complete_json(self, system, prompt):
+        resp = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=self.temperature,
+            response_format={"type": "json_object"},
+        )
+        return json.loads(resp.choices[0].message.content)
+
+
+class StubLLMClient(LLMClient):
+    """
+    Offline stand-in: answers instantly (or after `latency` seconds, to mimic a
+    network round-trip) with descriptions, or SQL, derived only from the
+    prompt, so the same prompt always gets the same answer.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency: float = None):
+        self.latency = float(os.getenv("LLM_STUB_LATENCY", "0")) if latency is None else latency
+        self.calls = 0
+
+    async def complete_json(self, system, prompt):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if '"sql"' in system:
+            # NL→SQL prompts list tables as "Table name:"; answer with a peek at the first
+            tables = [line[6:-1] for line in prompt.splitlines() if line.startswith("Table ") and line.endswith(":")]
+            return {"sql": f'SELECT * FROM "{tables[0]}" LIMIT 100' if tables else "SELECT 1 AS answer"}
+
+        # Prompts list one column per line as "- name (type)"
+        answer = {}
+        for line in prompt.splitlines():
+            if line.startswith("- ") and line.endswith(")") and " (" in line:
+                name, data_type = line[2:-1].rsplit(" (", 1)
+                digest = hashlib.sha1(f"{name}:{data_type}".encode()).hexdigest()[:8]
+                answer[name] = f"Column {name} of type {data_type} [{digest}]."
+        return answer
+
+
+LLM_CLIENTS = {
+    OpenAIClient.name: OpenAIClient,
+    StubLLMClient.name: StubLLMClient,
+}
+
+
+def get_llm_client(name: str = None) -> LLMClient:
+    name = name or DEFAULT_LLM_CLIENT
+    if name not in LLM_CLIENTS:
+        raise ValueError(f"Unknown LLM client '{name}'; expected one of {sorted(LLM_CLIENTS)}")
+    return LLM_CLIENTS[name]()
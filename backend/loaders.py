@@ -0,0 +1,150 @@
+# backend/loaders.py
+import io
+import os
+import decimal
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# Default bulk loader backend: "binary" (typed records) or "csv" (text COPY)
+DEFAULT_LOADER = os.getenv("INGEST_LOADER", "binary")
+
+INTEGER_TYPES = {"smallint", "integer", "bigint"}
+FLOAT_TYPES = {"real", "double precision"}
+
+
+async def fetch_column_types(conn: AsyncConnection, table_name: str) -> dict[str, str]:
+    """Return { column: formatted Postgres type } for a table, in ordinal order."""
+    result = await conn.execute(
+        text("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(:tbl)
+          AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+        """),
+        {"tbl": f'"{table_name}"'}
+    )
+    return {name: pg_type for name, pg_type in result.all()}
+
+
+async def _driver_connection(conn: AsyncConnection):
+    """The asyncpg connection underneath a SQLAlchemy AsyncConnection (same transaction)."""
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+def _decimal(value) -> decimal.Decimal:
+    # repr of a float is its shortest round-trip form: the text the CSV loader would write
+    return decimal.Decimal(repr(value) if isinstance(value, float) else str(value))
+
+
+def _base_type(pg_type: str) -> str:
+    """'numeric(12,2)' -> 'numeric', 'timestamp(3) without time zone' -> 'timestamp without time zone'."""
+    return " ".join(part.split("(")[0] for part in pg_type.split())
+
+
+class BulkLoader:
+    """Moves one DataFrame chunk into an existing table inside the caller's transaction."""
+
+    name = "base"
+
+    async def load(self, conn: AsyncConnection, table_name: str, df: pd.DataFrame, pg_types: dict[str, str]):
+        raise NotImplementedError
+
+    async def schema_changed(self, conn: AsyncConnection):
+        """Called whenever the target table was (re)created or altered."""
+
+
+class CsvCopyLoader(BulkLoader):
+    """Text COPY: the DataFrame is rendered as CSV and parsed again by Postgres."""
+
+    name = "csv"
+
+    async def load(self, conn, table_name, df, pg_types):
+        # Integer columns read back as float when a chunk has NULLs; "3.0" is
+        # not a valid BIGINT literal, so render them through the nullable Int64
+        for col in df.columns:
+            if _base_type(pg_types.get(col, "text")) in INTEGER_TYPES and pd.api.types.is_float_dtype(df[col]):
+                df[col] = df[col].astype("Int64")
+
+        buf = io.BytesIO()
+        df.to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        driver = await _driver_connection(conn)
+        await driver.copy_to_table(table_name, source=buf, columns=list(df.columns), format="csv")
+
+
+class BinaryCopyLoader(BulkLoader):
+    """
+    Binary COPY through asyncpg's copy_records_to_table. Each column is converted
+    once into a typed array of Python values, so no number or timestamp is ever
+    formatted to text and parsed again. NUMERIC values are sent as Decimals,
+    never through float64.
+    """
+
+    name = "binary"
+
+    SUPPORTED_TYPES = INTEGER_TYPES | FLOAT_TYPES | {
+        "numeric", "boolean", "text", "character varying", "character",
+        "date", "timestamp without time zone", "timestamp with time zone",
+    }
+
+    def __init__(self, fallback: BulkLoader = None):
+        self.fallback = fallback or CsvCopyLoader()
+
+    @staticmethod
+    def _column_values(ser: pd.Series, base_type: str) -> list:
+        """Convert a Series into a list of Python values matching `base_type`, NULLs as None."""
+        if base_type in INTEGER_TYPES:
+            ser = ser.astype("Int64") if not pd.api.types.is_integer_dtype(ser) else ser
+        elif base_type in FLOAT_TYPES:
+            ser = pd.to_numeric(ser).astype("float64")
+        elif base_type == "numeric":
+            return [None if pd.isna(value) else _decimal(value) for value in ser.tolist()]
+        elif base_type == "boolean":
+            ser = ser.astype("boolean")
+        elif base_type == "date":
+            ser = pd.to_datetime(ser).dt.date
+        elif base_type.startswith("timestamp"):
+            ser = pd.to_datetime(ser, utc=base_type.endswith("with time zone"))
+            values = ser.array.to_pydatetime()
+            values[ser.isna().to_numpy()] = None
+            return values.tolist()
+        else:
+            mask = ser.notna()
+            return ser.astype(str).where(mask, None).tolist()
+
+        mask = ser.notna()
+        if mask.all():
+            return ser.tolist()
+        return ser.astype(object).where(mask, None).tolist()
+
+    async def schema_changed(self, conn):
+        # copy_records_to_table caches the column codecs of the target per
+        # connection; a pooled connection may still hold them for a table that
+        # has since been replaced or altered
+        driver = await _driver_connection(conn)
+        await driver.reload_schema_state()
+
+    async def load(self, conn, table_name, df, pg_types):
+        base_types = {col: _base_type(pg_types.get(col, "text")) for col in df.columns}
+        if not set(base_types.values()) <= self.SUPPORTED_TYPES:
+            return await self.fallback.load(conn, table_name, df, pg_types)
+
+        arrays = [self._column_values(df[col], base_types[col]) for col in df.columns]
+        driver = await _driver_connection(conn)
+        await driver.copy_records_to_table(table_name, records=zip(*arrays), columns=list(df.columns))
+
+
+LOADERS = {
+    CsvCopyLoader.name: CsvCopyLoader,
+    BinaryCopyLoader.name: BinaryCopyLoader,
+}
+
+
+def get_loader(name: str = None) -> BulkLoader:
+    name = name or DEFAULT_LOADER
+    if name not in LOADERS:
+        raise ValueError(f"Unknown loader '{name}'; expected one of {sorted(LOADERS)}")
+    return LOADERS[name]()
@@ -1,20 +1,37 @@
 # backend/main.py
 
 import uuid
-import datetime
+import json
+import time
 import asyncio
+from datetime import datetime
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Body, Query, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy import select, text
-from db import langgraph_semaphore, SessionLocal
-from ingestor import Ingestor
-from agents.extractor import extractor_agent
-from agents.dictionary_agent import dictionary_agent
-from agents.analyst_agent import analyst_agent
-from models import Metric  # SQLAlchemy ORM model for metrics :contentReference[oaicite:0]{index=0}
+from sqlalchemy import select, func, table, column
+from db import InteractiveSession, pool_stats, dispose_engines
+from ingestor import Ingestor, PartialIngestError
+from parsing import shutdown_parse_pool
+from scheduler import scheduler
+from agents.query_runner import query_engine
+from query_cache import query_cache, query_results
+from events import run_events, RESYNC_SECONDS, TERMINAL_STATES
+from description_cache import description_cache
+from metric_runner import evaluate_metric, cached_result
+from metric_batch import evaluate_metrics
+from downsample import downsample, downsample_metric
+from approximate import approximate_metric, downsample_approximate
+from result_cache import metric_cache, cache_key, table_version
+from rollups import routed_sql
+from partitions import check_interval, list_partitions
+from sql_guard import guard_stats
+from result_transport import (
+    MAX_ROWS, FORMATS, NDJSON_MEDIA_TYPE, ARROW_MEDIA_TYPE,
+    open_detached_rows, fetch_rows, memory_rows, encode_ndjson, encode_arrow,
+)
+from models import Metric, DescriptionCacheEntry, AdvisedIndex, TablePartitioning  # SQLAlchemy ORM model for metrics :contentReference[oaicite:0]{index=0}
 
 app = FastAPI(title="Autonomous Analytics MVP")
 
@@ -26,34 +43,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ————————————————————————————————————————————————
-# In-memory status store: { run_id: { table: { agent: status_dict } } }
-# ————————————————————————————————————————————————
-ingest_runs: dict[str, dict[str, dict[str, dict]]] = {}
-
-def _now_iso() -> str:
-    return datetime.datetime.utcnow().isoformat()
-
-def init_run(run_id: str, tables: list[str]):
-    """Initialize all statuses to 'pending'."""
-    agents = ["extractor", "dictionary", "analyst"]
-    ingest_runs[run_id] = {
-        tbl: {
-            ag: {"status": "pending", "started_at": None, "finished_at": None, "error": None}
-            for ag in agents
-        }
-        for tbl in tables
-    }
+@app.on_event("startup")
+async def _startup():
+    await run_events.start()
+    await scheduler.start()
+    await query_engine.start()
 
-def update_status(run_id: str, table: str, agent: str, status: str, error: str = None):
-    rec = ingest_runs[run_id][table][agent]
-    rec["status"] = status
-    if status == "running":
-        rec["started_at"] = _now_iso()
-    if status in ("done", "failed"):
-        rec["finished_at"] = _now_iso()
-    if error:
-        rec["error"] = error
+@app.on_event("shutdown")
+async def _shutdown():
+    await scheduler.stop()
+    await run_events.stop()
+    shutdown_parse_pool()
+    await dispose_engines()
 
 # ————————————————————————————————————————————————
 # 1. Ingest endpoint with run_id
@@ -63,45 +64,125 @@ async def ingest_endpoint(
     mode: str = Form(...),                      # "create" / "replace" / "append"
     table_name: str = Form(None),               # existing table name
     file: UploadFile = File(...),
-    user: str = Form("anonymous")
+    user: str = Form("anonymous"),
+    key_columns: str = Form(None),              # append: comma-separated dedupe / upsert key
+    on_conflict: str = Form("update"),          # append with key: "update" or "ignore"
+    partition_by: str = Form(None),             # create / replace: timestamp column to range-partition on, or "auto"
+    partition_interval: str = Form(None),       # "day" / "week" / "month" / "quarter" / "year"
+    priority: int = Form(0),                    # higher runs the agent chain first
 ):
-    # 1. Ingest file
-    content = await file.read()
-    tables = await Ingestor.ingest_file(content, file.filename, mode, target_table=table_name, user=user)
+    if on_conflict not in ("update", "ignore"):
+        raise HTTPException(status_code=400, detail="on_conflict must be 'update' or 'ignore'")
+    try:
+        check_interval(partition_interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    keys = [k.strip() for k in key_columns.split(",") if k.strip()] if key_columns else None
+    options = {"target_table": table_name, "user": user, "key_columns": keys, "on_conflict": on_conflict,
+               "partition_by": partition_by, "partition_interval": partition_interval}
 
-    # 2. Create a new run_id and init statuses
-    run_id = str(uuid.uuid4())
-    init_run(run_id, tables)
-
-    # 3. Launch the agents chain for each table
-    async def run_pipeline(tbl: str):
-        async with langgraph_semaphore:
-            for agent_name, agent_func in [
-                ("extractor", extractor_agent),
-                ("dictionary", dictionary_agent),
-                ("analyst", analyst_agent),
-            ]:
-                update_status(run_id, tbl, agent_name, "running")
-                try:
-                    await agent_func(tbl)
-                    update_status(run_id, tbl, agent_name, "done")
-                except Exception as e:
-                    update_status(run_id, tbl, agent_name, "failed", str(e))
-                    break
+    # 1. Ingest file (CSV is streamed from the spooled upload in bounded chunks)
+    #    Sheets that failed after others were committed are reported; the loaded ones still run
+    errors = {}
+    try:
+        if file.filename.lower().endswith((".xlsx", ".xls")):
+            content = await file.read()
+            tables = await Ingestor.ingest_file(content, file.filename, mode, **options)
+        else:
+            tables = await Ingestor.ingest_stream(file.file, file.filename, mode, **options)
+    except PartialIngestError as e:
+        tables, errors = e.tables, e.errors
 
-    for t in tables:
-        asyncio.create_task(run_pipeline(t))
+    # 2. Create a new run_id and queue the agent chain (extractor → dictionary → analyst)
+    #    for each table; jobs are persisted, so the run survives a worker restart.
+    #    Every sheet of a replace / append reports the same target, which is queued once
+    tables = list(dict.fromkeys(tables))
+    run_id = str(uuid.uuid4())
+    await scheduler.submit(run_id, tables, priority=priority)
 
-    return JSONResponse({"status": "started", "run_id": run_id, "tables": tables})
+    return JSONResponse({"status": "started", "run_id": run_id, "tables": tables, "errors": errors})
 
 # ————————————————————————————————————————————————
-# 2. Status endpoint
+# 2. Status / progress stream / cancel endpoints
 # ————————————————————————————————————————————————
 @app.get("/ingest/{run_id}/status")
 async def ingest_status(run_id: str):
-    if run_id not in ingest_runs:
+    status = await scheduler.run_status(run_id)
+    if not status:
         raise HTTPException(status_code=404, detail="Run ID not found")
-    return {"run_id": run_id, "status": ingest_runs[run_id]}
+    return {"run_id": run_id, "status": status}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _run_finished(status: dict) -> bool:
+    return all(s["status"] in TERMINAL_STATES for stages in status.values() for s in stages.values())
+
+def _table_timings(status: dict) -> dict:
+    """Wall-clock ms from a table's first stage start to its last stage end."""
+    timings = {}
+    for tbl, stages in status.items():
+        started = [s["started_at"] for s in stages.values() if s["started_at"]]
+        finished = [s["finished_at"] for s in stages.values() if s["finished_at"]]
+        if started and finished:
+            delta = datetime.fromisoformat(max(finished)) - datetime.fromisoformat(min(started))
+            timings[tbl] = int(delta.total_seconds() * 1000)
+        else:
+            timings[tbl] = None
+    return timings
+
+@app.get("/ingest/{run_id}/events")
+async def ingest_events(run_id: str):
+    """
+    Server-sent events for a run: a `snapshot` of every table and stage, then a
+    `stage` event per transition as it is committed, and a final `end` event
+    with per-table timings once every job reached a terminal state.
+    """
+    if not await scheduler.run_status(run_id):
+        raise HTTPException(status_code=404, detail="Run ID not found")
+
+    async def stream():
+        async with run_events.subscribe(run_id) as queue:
+            # Snapshot after subscribing, so no transition can fall in between
+            status = await scheduler.run_status(run_id)
+            yield _sse("snapshot", {"run_id": run_id, "status": status})
+
+            while not _run_finished(status):
+                try:
+                    event = await asyncio.wait_for(queue.get(), RESYNC_SECONDS)
+                    changes = [event]
+                except asyncio.TimeoutError:
+                    # Nothing heard for a while: re-read the run and send what differs
+                    fresh = await scheduler.run_status(run_id)
+                    changes = [
+                        {"run_id": run_id, "table": tbl, "stage": stage, **state}
+                        for tbl, stages in fresh.items()
+                        for stage, state in stages.items()
+                        if status.get(tbl, {}).get(stage) != state
+                    ]
+                    if not changes:
+                        yield ": keep-alive\n\n"
+                        continue
+
+                for change in changes:
+                    status.setdefault(change["table"], {})[change["stage"]] = {
+                        key: change[key]
+                        for key in ("status", "attempts", "started_at", "finished_at", "duration_ms", "error")
+                    }
+                    yield _sse("stage", change)
+
+            yield _sse("end", {"run_id": run_id, "status": status, "table_duration_ms": _table_timings(status)})
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/ingest/{run_id}/cancel")
+async def ingest_cancel(run_id: str):
+    cancelled = await scheduler.cancel(run_id)
+    return {"run_id": run_id, "cancelled_jobs": cancelled}
 
 # ————————————————————————————————————————————————
 # 3. Metrics endpoints
@@ -110,7 +191,7 @@ async def ingest_status(run_id: str):
 @app.get("/metrics/")
 async def list_metrics():
     """Return a list of all defined metrics (id, name, viz hint, etc.)."""
-    async with SessionLocal() as session:
+    async with InteractiveSession() as session:
         result = await session.execute(select(Metric))
         metrics = result.scalars().all()
 
@@ -127,26 +208,293 @@ async def list_metrics():
         for m in metrics
     ]
 
+def _check_transport(fmt: str, limit: int):
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if not 0 < limit <= MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_ROWS}")
+
+
+def _check_max_points(max_points: int):
+    if max_points is not None and max_points < 2:
+        raise HTTPException(status_code=400, detail="max_points must be at least 2")
+
+
+def _check_sample_percent(sample_percent: float):
+    if sample_percent is not None and not 0 < sample_percent <= 100:
+        raise HTTPException(status_code=400, detail="sample_percent must be above 0 and at most 100")
+
+
+def _encode(fmt: str, rows, metadata: dict):
+    return encode_ndjson(rows) if fmt == "ndjson" else encode_arrow(rows, metadata)
+
+
+def _stream_response(fmt: str, chunks) -> StreamingResponse:
+    return StreamingResponse(chunks, media_type=NDJSON_MEDIA_TYPE if fmt == "ndjson" else ARROW_MEDIA_TYPE)
+
+
 @app.get("/metric/{metric_id}")
-async def run_metric(metric_id: int):
+async def run_metric(
+    metric_id: int,
+    fmt: str = Query("json", alias="format"),   # "json" / "ndjson" / "arrow"
+    limit: int = MAX_ROWS,                       # row cap; `truncated` tells if rows were left out
+    offset: int = 0,                             # json only: page start
+    max_points: int = None,                      # chart-sized result: downsampled per the viz hint
+    approximate: bool = False,                   # estimate from a TABLESAMPLE, with confidence intervals
+    sample_percent: float = None,                # approximate only: defaults to APPROX_SAMPLE_PERCENT
+):
     """
     Execute the SQL for a specific metric and return its data and viz hint.
+    ndjson and arrow stream the rows from a server-side cursor instead of
+    building the whole result in memory; a streamed result that fits under
+    `limit` is cached like a json one; arrow is always read from the query,
+    so its column types do not depend on the cache. With approximate, COUNT/SUM/AVG
+    metrics of large tables are estimated from a sample; the response then
+    carries an `approximate` block with the sample and per-row intervals.
     """
-    async with SessionLocal() as session:
+    _check_transport(fmt, limit)
+    _check_max_points(max_points)
+    _check_sample_percent(sample_percent)
+    async with InteractiveSession() as session:
         metric = await session.get(Metric, metric_id)
         if not metric:
             raise HTTPException(status_code=404, detail="Metric not found")
 
-        try:
-            # Run the metric's SQL definition
-            result = await session.execute(text(metric.sql_definition))
-            rows = result.fetchall()
-            cols = result.keys()
-            data = [dict(zip(cols, row)) for row in rows]
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error executing metric SQL: {e}")
+        if approximate:
+            try:
+                result = await approximate_metric(session, metric, sample_percent, cache=metric_cache)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Error executing metric SQL: {e}")
+            # None: not an eligible aggregate, a table small enough to query exactly,
+            # or a metric its table's rollup answers exactly
+            if result is not None:
+                return _approximate_response(fmt, result, metric.viz_hint, max_points)
+
+        if max_points is not None:
+            try:
+                data, strategy = await downsample_metric(session, metric, max_points, cache=metric_cache)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Error executing metric SQL: {e}")
+            if fmt == "json":
+                return {"data": data, "viz": metric.viz_hint, "truncated": False, "downsampled": strategy,
+                        **({"approximate": None} if approximate else {})}
+            return _stream_response(fmt, _encode(fmt, memory_rows(data), {"viz": metric.viz_hint, "downsampled": strategy}))
+
+        # Results already at hand (cache hits, materialized snapshots) are served from memory.
+        # Not to arrow: cached rows went through jsonable_encoder (dates are strings by then),
+        # and arrow types its columns from the values, so it always reads the query's own rows
+        version = await table_version(session, metric.table_name) if metric.table_name else None
+        rows = (await cached_result(session, metric, metric_cache, version)
+                if version is not None and fmt != "arrow" else None)
+
+        if fmt == "json":
+            end = min(offset + limit, MAX_ROWS)
+            try:
+                if rows is None and 0 < offset < end:
+                    # A later page whose full result is no longer cached: only that page is read
+                    data, more = await fetch_rows(
+                        session, _page_sql(await routed_sql(session, metric), offset), max_rows=end - offset
+                    )
+                    return {
+                        "data": data,
+                        "viz": metric.viz_hint,
+                        "truncated": more,
+                        "next_offset": end if more and end < MAX_ROWS else None,
+                        **({"approximate": None} if approximate else {}),
+                    }
+                # Scalar metrics are projected from their table's fused scan when it is
+                # cached; results are cached until the next ingest into the metric's table
+                data = rows if rows is not None else await evaluate_metric(session, metric, cache=metric_cache)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Error executing metric SQL: {e}")
+
+            # evaluate_metric reads one row past MAX_ROWS, so the flag is exact at the cap
+            return {
+                "data": data[offset:end],
+                "viz": metric.viz_hint,
+                "truncated": len(data) > end,
+                "next_offset": end if len(data) > end and end < MAX_ROWS else None,
+                **({"approximate": None} if approximate else {}),
+            }
 
+        if rows is None and metric.scan_key and fmt != "arrow":
+            rows = await evaluate_metric(session, metric, cache=metric_cache)
+        viz = metric.viz_hint
+        # Streamed rows come from the table's rollup when it answers the metric
+        sql = await routed_sql(session, metric) if rows is None else None
+        key = cache_key("metric", metric.id, metric.sql_definition, version) if version is not None else None
+        table_name = metric.table_name
+
+    if rows is not None:
+        return _stream_response(fmt, _encode(fmt, memory_rows(rows, limit), {"viz": viz}))
+
+    try:
+        cursor, stream = await open_detached_rows(sql, max_rows=limit)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error executing metric SQL: {e}")
+
+    async def chunks():
+        started = time.perf_counter()
+        if key is not None:
+            stream.kept = []
+        async with cursor:
+            async for chunk in _encode(fmt, stream, {"viz": viz}):
+                yield chunk
+        # A complete result is what evaluate_metric would have cached; a truncated one is not
+        if key is not None and not stream.truncated:
+            data = [dict(zip(stream.columns, row)) for row in stream.kept]
+            await metric_cache.store(key, table_name, version, data, (time.perf_counter() - started) * 1000)
+
+    return _stream_response(fmt, chunks())
+
+
+def _page_sql(sql: str, offset: int) -> str:
+    """`sql` from row `offset` on; the guard adds the LIMIT. Postgres keeps the subquery's ORDER BY."""
+    # On their own lines, so a trailing "-- comment" in `sql` cannot swallow them
+    return f"SELECT * FROM (\n{sql.strip().rstrip(';')}\n) AS page\nOFFSET {int(offset)}"
+
+def _approximate_response(fmt: str, result: dict, viz: dict, max_points: int):
+    data, approx, downsampled = result["data"], result["approximate"], None
+    if max_points is not None:
+        data, intervals, downsampled = downsample_approximate(result, viz, max_points)
+        approx = {**approx, "intervals": intervals}
+    if fmt == "json":
+        return {"data": data, "viz": viz, "truncated": result["truncated"], "downsampled": downsampled,
+                "approximate": approx}
+    return _stream_response(fmt, _encode(fmt, memory_rows(data), {"viz": viz, "downsampled": downsampled,
+                                                               "approximate": approx}))
+
+@app.post("/metrics/batch")
+async def run_metrics_batch(metric_ids: list[int] = Body(..., embed=True), max_points: int = Body(None)):
+    """
+    Evaluate many metrics at once (e.g. a dashboard). Metrics are grouped by table
+    and each table's compatible aggregates share a single GROUPING SETS scan.
+    With max_points, each result is downsampled in memory per its viz hint.
+    Returns { results: {id: {data, viz, truncated}}, errors: {id: message}, missing, queries }.
+    """
+    if not metric_ids:
+        raise HTTPException(status_code=400, detail="metric_ids must not be empty")
+    _check_max_points(max_points)
+    batch = await evaluate_metrics(list(dict.fromkeys(metric_ids)), cache=metric_cache)
+    if max_points is not None:
+        for result in batch["results"].values():
+            result["data"], result["downsampled"] = downsample(result["data"], result["viz"], max_points)
+    return batch
+
+# ————————————————————————————————————————————————
+# 4. Natural-language query endpoint
+# ————————————————————————————————————————————————
+@app.post("/query/")
+async def query_endpoint(
+    nl_query: str = Form(...),
+    user: str = Form("anonymous"),
+    max_points: int = Form(None),               # chart-sized result: downsampled per the guessed viz
+    approximate: bool = Form(False),            # estimate simple aggregates from a TABLESAMPLE
+    sample_percent: float = Form(None),
+):
+    """
+    Translate a question into SQL with the long-lived query engine and run it.
+    Returns { sql, data, viz, truncated, downsampled, approximate, cache, timings_ms }.
+    """
+    if not nl_query.strip():
+        raise HTTPException(status_code=400, detail="nl_query must not be empty")
+    _check_max_points(max_points)
+    _check_sample_percent(sample_percent)
+    result = await query_engine.ask(nl_query, user, max_points, approximate, sample_percent)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+# ————————————————————————————————————————————————
+# 5. Cache statistics
+# ————————————————————————————————————————————————
+@app.get("/metrics/cache/stats")
+async def metric_cache_stats():
+    """Hit rates and average lookup latency of this worker's metric result cache."""
+    return {**metric_cache.stats.as_dict(), "memory_bytes": metric_cache.memory_bytes, "shared": metric_cache.shared}
+
+@app.get("/query/cache/stats")
+async def query_cache_stats():
+    """Question → SQL cache counters of this worker, plus its query result cache."""
+    return {
+        **query_cache.stats.as_dict(),
+        "entries": len(query_cache),
+        "results": {**query_results.stats.as_dict(), "memory_bytes": query_results.memory_bytes},
+    }
+
+@app.get("/dictionary/cache/stats")
+async def dictionary_cache_stats():
+    """Hit/miss counters of this worker since start-up, plus the size of the shared cache."""
+    async with InteractiveSession() as session:
+        entries = await session.scalar(select(func.count()).select_from(DescriptionCacheEntry))
+    return {**description_cache.stats.as_dict(), "entries": entries}
+
+@app.get("/sql/guard/stats")
+async def sql_guard_stats():
+    """Admission counters of this worker: statements checked, rejected, downgraded, timed out, queued."""
+    return guard_stats.as_dict()
+
+@app.get("/db/pools/stats")
+async def db_pool_stats():
+    """Per connection pool of this worker: checkouts and wait times since start-up, and current usage."""
+    return pool_stats()
+
+# ————————————————————————————————————————————————
+# 6. Index advisor
+# ————————————————————————————————————————————————
+@app.get("/indexes/")
+async def advised_indexes(table_name: str = None):
+    """Indexes built (or dropped) by the index advisor, with scans since creation and metric latencies."""
+    stats = table("pg_stat_user_indexes", column("indexrelname"), column("idx_scan"))
+    query = (
+        select(AdvisedIndex, stats.c.idx_scan)
+        .outerjoin(stats, stats.c.indexrelname == AdvisedIndex.index_name)
+        .order_by(AdvisedIndex.created_at.desc())
+    )
+    if table_name:
+        query = query.where(AdvisedIndex.table_name == table_name)
+    async with InteractiveSession() as session:
+        rows = (await session.execute(query)).all()
+    return [
+        {
+            "index_name": index.index_name,
+            "table_name": index.table_name,
+            "column_name": index.column_name,
+            "method": index.method,
+            "reason": index.reason,
+            "status": index.status,
+            "build_ms": index.build_ms,
+            "scans": scans,
+            "latency": index.latency,
+            "created_at": index.created_at,
+            "dropped_at": index.dropped_at,
+        }
+        for index, scans in rows
+    ]
+
+# ————————————————————————————————————————————————
+# 7. Partitions and retention
+# ————————————————————————————————————————————————
+@app.get("/tables/{table_name}/partitions")
+async def table_partitions(table_name: str):
+    """How a table is range-partitioned, with its partitions oldest first."""
+    async with InteractiveSession() as session:
+        scheme = await session.get(TablePartitioning, table_name)
+        if scheme is None:
+            raise HTTPException(status_code=404, detail="Table is not partitioned")
+        parts = await list_partitions(await session.connection(), table_name)
     return {
-        "data": data,
-        "viz": metric.viz_hint
+        "table_name": table_name,
+        "column_name": scheme.column_name,
+        "interval": scheme.interval,
+        "partitions": parts,
     }
+
+@app.delete("/tables/{table_name}/partitions")
+async def drop_table_partitions(table_name: str, before: datetime = Query(...)):
+    """Retention: drop every partition whose values all precede `before`, instead of DELETEing rows."""
+    try:
+        dropped = await Ingestor.drop_partitions(table_name, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"table_name": table_name, "dropped": dropped}
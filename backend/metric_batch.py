@@ -0,0 +1,239 @@
+# backend/metric_batch.py
+"""
+Batch metric evaluation with shared-scan planning.
+
+Metrics are grouped by source table. Within a table, every metric of a
+family the analyst generates — scalar SUM/AVG, top-N counts per category,
+counts per day — is answered from ONE query:
+
+    SELECT GROUPING(...) flags, <group keys>, COUNT(*), <scalar aggregates>
+    FROM t
+    GROUP BY GROUPING SETS ((col_a), (DATE(col_b)), ())
+
+and each metric is projected from the rows of its grouping set. Anything
+else (hand-edited SQL, very high-cardinality categories) runs standalone.
+Daily counts and scalars that a time-bucket rollup answers read the rollup
+instead, which leaves the shared scan to the category counts.
+Tables are evaluated concurrently, each on its own pooled connection, and
+every result goes through the metric result cache.
+"""
+import os
+import time
+import asyncio
+from collections import defaultdict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import InteractiveSession
+from models import Metric, ColumnMeta
+from agents.analyst_agent import category_count_sql, daily_count_sql, TOP_CATEGORIES
+from metric_runner import evaluate_metric, cached_result
+from result_cache import MetricResultCache, cache_key, table_version
+from result_transport import MAX_ROWS, fetch_rows
+from rollups import table_rollups, rollup_sql, scalar_sql
+
+BATCH_CONCURRENCY = int(os.getenv("METRIC_BATCH_CONCURRENCY", "4"))
+# Categorical columns estimated above this many distinct values are not folded
+# into the shared scan: their groups would dwarf the other sets' output
+GROUPING_MAX_DISTINCT = int(os.getenv("METRIC_BATCH_GROUPING_MAX_DISTINCT", "10000"))
+
+
+def classify(metric: Metric) -> tuple:
+    """("scalar", select expression), ("category", col), ("daily", col) or ("standalone",)."""
+    table, sql = metric.table_name, metric.sql_definition
+    tags = metric.tags or []
+    col = tags[1] if len(tags) > 1 else None
+    suffix = f' FROM "{table}"'
+    if metric.scan_column and sql.startswith("SELECT ") and sql.endswith(suffix):
+        expr = sql[len("SELECT "):-len(suffix)]
+        if expr.endswith(f' AS "{metric.scan_column}"'):
+            return ("scalar", expr)
+    if col and sql == category_count_sql(table, col):
+        return ("category", col)
+    if col and sql == daily_count_sql(table, col):
+        return ("daily", col)
+    return ("standalone",)
+
+
+def build_shared_scan(table_name: str, group_exprs: list[str], scalar_exprs: list[str]) -> str:
+    """One query over `table_name` computing every grouping set plus the scalar aggregates."""
+    if not group_exprs:
+        return f'SELECT {", ".join(scalar_exprs)} FROM "{table_name}"'
+    select_list = [f'GROUPING({expr}) AS "__g{i}"' for i, expr in enumerate(group_exprs)]
+    select_list += [f'{expr} AS "__k{i}"' for i, expr in enumerate(group_exprs)]
+    select_list.append('COUNT(*) AS "__count"')
+    select_list += scalar_exprs
+    sets = [f"({expr})" for expr in group_exprs] + (["()"] if scalar_exprs else [])
+    return (
+        f'SELECT {", ".join(select_list)} FROM "{table_name}" '
+        f'GROUP BY GROUPING SETS ({", ".join(sets)})'
+    )
+
+
+def _set_rows(rows: list[dict], n_groups: int, index: int = None) -> list[dict]:
+    """Rows of grouping set `index` (None → the grand-total set)."""
+    wanted = [0 if i == index else 1 for i in range(n_groups)]
+    return [row for row in rows if [row[f"__g{i}"] for i in range(n_groups)] == wanted]
+
+
+async def _run_sql(session: AsyncSession, sql: str) -> list[dict]:
+    rows, truncated = await fetch_rows(session, sql)
+    if truncated:
+        # Missing groups would make wrong results; the metrics run standalone instead
+        raise ValueError(f"Shared scan returned more than {MAX_ROWS} rows")
+    return rows
+
+
+async def _evaluate_table(table_name: str, metrics: list[Metric], cache: MetricResultCache) -> dict:
+    results, errors, queries = {}, {}, 0
+    async with InteractiveSession() as session:
+        version = await table_version(session, table_name)
+
+        # 1. Cache tiers and materialized snapshots first
+        pending = []
+        for metric in metrics:
+            payload = await cached_result(session, metric, cache, version)
+            if payload is not None:
+                results[metric.id] = payload
+            else:
+                pending.append(metric)
+        if not pending:
+            return {"results": results, "errors": errors, "queries": queries}
+
+        # 2. Plan: fold every recognised metric into the shared scan
+        result = await session.execute(
+            select(ColumnMeta.column_name, ColumnMeta.n_distinct).where(ColumnMeta.table_name == table_name)
+        )
+        n_distinct = dict(result.all())
+        rollups = await table_rollups(session, table_name)
+        group_exprs, scalar_exprs, planned, standalone = [], [], [], []
+        for metric in pending:
+            kind, *args = classify(metric)
+            if kind == "category" and (n_distinct.get(args[0]) or 0) > GROUPING_MAX_DISTINCT:
+                kind = "standalone"
+            if kind == "daily" and args[0] in rollups:
+                kind = "standalone"
+            if kind == "scalar":
+                if args[0] not in scalar_exprs:
+                    scalar_exprs.append(args[0])
+                planned.append((metric, kind, None))
+            elif kind in ("category", "daily"):
+                expr = f'"{args[0]}"' if kind == "category" else f'DATE("{args[0]}")'
+                if expr not in group_exprs:
+                    group_exprs.append(expr)
+                planned.append((metric, kind, group_exprs.index(expr)))
+            else:
+                standalone.append(metric)
+
+        # Scalars are summed from a rollup's days when it has every column
+        rolled_up = scalar_sql(rollups, f'SELECT {", ".join(scalar_exprs)} FROM "{table_name}"') \
+            if scalar_exprs else None
+        if rolled_up:
+            scalar_exprs = []
+
+        # 3. Execute: one shared scan, then the leftovers one by one
+        computed = {}
+        if planned:
+            started = time.perf_counter()
+            try:
+                rows, totals = [], None
+                if group_exprs or scalar_exprs:
+                    rows = await _run_sql(session, build_shared_scan(table_name, group_exprs, scalar_exprs))
+                    queries += 1
+                if rolled_up:
+                    totals = await _run_sql(session, rolled_up)
+                    queries += 1
+            except Exception:
+                # The guard rolled back to its savepoint: the session and the rollups stay usable
+                standalone.extend(metric for metric, _, _ in planned)
+                planned = []
+            if totals is None:
+                totals = _set_rows(rows, len(group_exprs)) if group_exprs else rows
+            for metric, kind, index in planned:
+                if kind == "scalar":
+                    computed[metric.id] = [{metric.scan_column: totals[0][metric.scan_column] if totals else None}]
+                elif kind == "category":
+                    groups = _set_rows(rows, len(group_exprs), index)
+                    groups.sort(key=lambda row: row["__count"], reverse=True)
+                    computed[metric.id] = [
+                        {"category": row[f"__k{index}"], "count": row["__count"]}
+                        for row in groups[:TOP_CATEGORIES]
+                    ]
+                else:
+                    groups = _set_rows(rows, len(group_exprs), index)
+                    # ORDER BY day: NULL days sort last
+                    groups.sort(key=lambda row: (row[f"__k{index}"] is None, row[f"__k{index}"] or 0))
+                    computed[metric.id] = [{"day": row[f"__k{index}"], "count": row["__count"]} for row in groups]
+            elapsed_ms = (time.perf_counter() - started) * 1000 / max(len(planned), 1)
+            for metric, _, _ in planned:
+                key = cache_key("metric", metric.id, metric.sql_definition, version)
+                results[metric.id] = await cache.store(key, table_name, version, computed[metric.id], elapsed_ms)
+
+        for metric in standalone:
+            started = time.perf_counter()
+            try:
+                sql = rollup_sql(metric, rollups) or metric.sql_definition
+                rows, _ = await fetch_rows(session, sql, max_rows=MAX_ROWS + 1)
+                queries += 1
+            except Exception as e:
+                errors[metric.id] = str(e)
+                continue
+            key = cache_key("metric", metric.id, metric.sql_definition, version)
+            results[metric.id] = await cache.store(
+                key, table_name, version, rows, (time.perf_counter() - started) * 1000
+            )
+
+    return {"results": results, "errors": errors, "queries": queries}
+
+
+async def evaluate_metrics(metric_ids: list[int], cache: MetricResultCache) -> dict:
+    """
+    Evaluate many metrics at once. Returns { results: {id: {data, viz, truncated}},
+    errors: {id: message}, missing: [ids], queries: statements run against data tables }.
+    """
+    async with InteractiveSession() as session:
+        result = await session.execute(select(Metric).where(Metric.id.in_(metric_ids)))
+        metrics = result.scalars().all()
+        by_id = {m.id: m for m in metrics}
+
+        # Metrics from before table tracking cannot be planned or cached
+        untracked = [m for m in metrics if not m.table_name]
+        results, errors, queries = {}, {}, 0
+        for metric in untracked:
+            try:
+                results[metric.id] = await evaluate_metric(session, metric)
+                queries += 1
+            except Exception as e:
+                # The guard rolled back to its savepoint; a session rollback would expire `metrics`
+                errors[metric.id] = str(e)
+
+    by_table = defaultdict(list)
+    for metric in metrics:
+        if metric.table_name:
+            by_table[metric.table_name].append(metric)
+
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(table_name, table_metrics):
+        async with limit:
+            return await _evaluate_table(table_name, table_metrics, cache)
+
+    outcomes = await asyncio.gather(
+        *(run(tbl, table_metrics) for tbl, table_metrics in by_table.items()), return_exceptions=True
+    )
+    for (tbl, table_metrics), outcome in zip(by_table.items(), outcomes):
+        if isinstance(outcome, Exception):
+            errors.update({m.id: str(outcome) for m in table_metrics})
+            continue
+        results.update(outcome["results"])
+        errors.update(outcome["errors"])
+        queries += outcome["queries"]
+
+    return {
+        "results": {
+            metric_id: {"data": rows[:MAX_ROWS], "viz": by_id[metric_id].viz_hint, "truncated": len(rows) > MAX_ROWS}
+            for metric_id, rows in results.items()
+        },
+        "errors": errors,
+        "missing": [mid for mid in metric_ids if mid not in by_id],
+        "queries": queries,
+    }
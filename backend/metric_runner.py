@@ -0,0 +1,119 @@
+# backend/metric_runner.py
+"""
+Evaluate catalogue metrics. Scalar metrics evaluated together (`fused`, or
+evaluate_table_scalars) are projected from their table's fused scan, so all
+of a table's SUM/AVG metrics cost one pass over it; a single one reads a
+cached scan result when there is one, and otherwise runs its own SQL rather
+than every aggregate of the table. With a result cache, a pass is only
+repeated after the table's data changed.
+Lookup order with a cache: memory → shared tier → materialized snapshot → query.
+Queries that a time-bucket rollup of the table answers read the rollup instead.
+Queries read through a server-side cursor and stop one row past RESULT_MAX_ROWS,
+so callers can tell a truncated result from one that just fits.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Metric, MetricScan, MetricSnapshot
+from result_cache import MetricResultCache, cache_key, sql_hash, table_version
+from result_transport import MAX_ROWS, fetch_rows
+from rollups import table_rollups, scalar_sql, routed_sql
+
+
+async def run_scan(session: AsyncSession, scan: MetricScan) -> dict:
+    """Execute a fused scan, over a rollup of its table if there is one; returns { output column: value }."""
+    sql = scalar_sql(await table_rollups(session, scan.table_name), scan.sql_definition) or scan.sql_definition
+    rows, _ = await fetch_rows(session, sql, max_rows=1)
+    return rows[0] if rows else {}
+
+
+async def _run_sql(session: AsyncSession, sql: str) -> list[dict]:
+    rows, _ = await fetch_rows(session, sql, max_rows=MAX_ROWS + 1)
+    return rows
+
+
+async def _scan_values(session: AsyncSession, scan: MetricScan, cache: MetricResultCache = None,
+                       version: int = None) -> dict:
+    if cache is None:
+        return await run_scan(session, scan)
+    key = cache_key("scan", scan.scan_key, scan.sql_definition, version)
+    return await cache.get_or_compute(session, key, scan.table_name, version, lambda: run_scan(session, scan))
+
+
+async def load_snapshot(session: AsyncSession, metric: Metric, version: int):
+    """Materialized rows of `metric`, if computed from this table version and SQL; else None."""
+    snapshot = await session.get(MetricSnapshot, metric.id)
+    if snapshot and snapshot.version == version and snapshot.sql_hash == sql_hash(metric.sql_definition):
+        return snapshot.payload
+    return None
+
+
+async def cached_result(session: AsyncSession, metric: Metric, cache: MetricResultCache, version: int):
+    """Rows of `metric` from the cache tiers or its materialized snapshot, without querying; else None."""
+    key = cache_key("metric", metric.id, metric.sql_definition, version)
+    rows = await cache.lookup(session, key)
+    if rows is None:
+        rows = await load_snapshot(session, metric, version)
+        if rows is not None:
+            cache.stats.snapshot_hits += 1
+            cache.put(key, rows)
+    return rows
+
+
+async def _compute(session: AsyncSession, metric: Metric, cache: MetricResultCache = None,
+                   version: int = None, fused: bool = False) -> list[dict]:
+    if cache is not None:
+        rows = await load_snapshot(session, metric, version)
+        if rows is not None:
+            cache.stats.snapshot_hits += 1
+            return rows
+
+    if metric.scan_key:
+        scan = await session.get(MetricScan, metric.scan_key)
+        if scan is not None:
+            if fused:
+                values = await _scan_values(session, scan, cache, version)
+            elif cache is not None:
+                values = await cache.lookup(session, cache_key("scan", scan.scan_key, scan.sql_definition, version))
+            else:
+                values = None
+            if values and metric.scan_column in values:
+                return [{metric.scan_column: values[metric.scan_column]}]
+
+    return await _run_sql(session, await routed_sql(session, metric))
+
+
+async def evaluate_metric(session: AsyncSession, metric: Metric, cache: MetricResultCache = None,
+                          fused: bool = False) -> list[dict]:
+    """
+    Rows of one metric, in the shape its standalone SQL would return. With a
+    cache, results are reused until the metric's table gets a new data version.
+    `fused`: the caller evaluates the table's other scalar metrics too, so
+    running their shared scan pays off.
+    """
+    if cache is None or not metric.table_name:
+        # Metrics from before table tracking have no data version to cache on
+        return await _compute(session, metric, fused=fused)
+
+    version = await table_version(session, metric.table_name)
+    key = cache_key("metric", metric.id, metric.sql_definition, version)
+    return await cache.get_or_compute(
+        session, key, metric.table_name, version, lambda: _compute(session, metric, cache, version, fused)
+    )
+
+
+async def evaluate_table_scalars(session: AsyncSession, table_name: str,
+                                 cache: MetricResultCache = None) -> dict[str, object]:
+    """{ metric name: value } for every scalar metric of a table, from one scan per fused query."""
+    result = await session.execute(
+        select(Metric.metric_name, Metric.scan_column, MetricScan)
+        .join(MetricScan, Metric.scan_key == MetricScan.scan_key)
+        .where(MetricScan.table_name == table_name)
+    )
+    rows = result.all()
+    version = await table_version(session, table_name) if cache is not None else None
+    values_by_scan, values = {}, {}
+    for name, column, scan in rows:
+        if scan.scan_key not in values_by_scan:
+            values_by_scan[scan.scan_key] = await _scan_values(session, scan, cache, version)
+        values[name] = values_by_scan[scan.scan_key].get(column)
+    return values
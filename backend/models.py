@@ -1,6 +1,6 @@
 # backend/models.py
 from sqlalchemy import (
-    Column, Integer, String, Text, Boolean, TIMESTAMP,
+    Column, Integer, String, Text, Boolean, TIMESTAMP, Float,
     JSON, UniqueConstraint, ForeignKey
 )
 from sqlalchemy.orm import relationship
@@ -15,6 +15,14 @@ class ColumnMeta(Base):
     data_type = Column(String)
     is_numeric = Column(Boolean)
     is_datetime = Column(Boolean)
+    ordinal_position = Column(Integer)
+    # Profile from pg_stats as of the last ANALYZE; NULL until the table was analyzed
+    null_fraction = Column(Float)
+    n_distinct = Column(Float)           # estimated distinct values (absolute, not pg's negative ratio)
+    min_value = Column(Text)
+    max_value = Column(Text)
+    histogram_bounds = Column(JSON)      # equi-depth bucket bounds, as text
+    most_common_values = Column(JSON)    # [[value, frequency], ...]
 
     __table_args__ = (UniqueConstraint("table_name", "column_name", name="uq_table_column"),)
 
@@ -32,6 +40,19 @@ class Metric(Base):
     viz_hint = Column(JSON)       # e.g. { "x": "order_date", "y": "SUM(total)", "type": "bar" }
     importance_score = Column(Integer, default=0)
     tags = Column(JSON)           # e.g. ["table", "column", "sum"]
+    table_name = Column(String, index=True)
+    # Scalar metrics are projected from their table's fused scan: one query
+    # computing every scalar aggregate of the table at once
+    scan_key = Column(String, ForeignKey("metric_scans.scan_key", ondelete="SET NULL"))
+    scan_column = Column(String)  # output column of this metric in the fused scan
+
+class MetricScan(Base):
+    """Single-scan query computing all scalar metrics of one table."""
+    __tablename__ = "metric_scans"
+    scan_key = Column(String, primary_key=True)     # e.g. "orders.scalars"
+    table_name = Column(String, index=True)
+    sql_definition = Column(Text)
+    updated_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
 
 class IngestHistory(Base):
     __tablename__ = "ingest_history"
@@ -42,3 +63,111 @@ class IngestHistory(Base):
     row_count = Column(Integer)
     loaded_by = Column(String)
     loaded_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+    duration_ms = Column(Integer)
+    rows_per_sec = Column(Float)
+    peak_rss_mb = Column(Float)          # process RSS high-water mark during the load
+
+class PipelineJob(Base):
+    """One stage of the post-ingest agent chain for one table of one run."""
+    __tablename__ = "pipeline_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, index=True)
+    table_name = Column(String)
+    stage = Column(String)               # 'extractor', 'dictionary', 'analyst', 'indexes', 'materialize'
+    stage_order = Column(Integer)
+    status = Column(String, index=True)  # pending / queued / running / done / failed / skipped / cancelled
+    priority = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    next_attempt_at = Column(TIMESTAMP)  # retry backoff: not claimable before this
+    worker_id = Column(String)           # scheduler instance holding the lease
+    heartbeat_at = Column(TIMESTAMP)     # lease renewal; stale leases are requeued
+    started_at = Column(TIMESTAMP)
+    finished_at = Column(TIMESTAMP)
+    error = Column(Text)
+    created_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint("run_id", "table_name", "stage", name="uq_job_run_table_stage"),)
+
+class DescriptionCacheEntry(Base):
+    """LLM column description, keyed by a fingerprint of the column it describes."""
+    __tablename__ = "description_cache"
+    fingerprint = Column(String, primary_key=True)   # sha256 of model, table, column, type (+ samples)
+    description = Column(Text)
+    model = Column(String)
+    created_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)       # TTL is measured from here
+    last_used_at = Column(TIMESTAMP, default=datetime.datetime.utcnow, index=True)  # LRU eviction order
+    hits = Column(Integer, default=0)
+
+class TableVersion(Base):
+    """Data version of an ingested table, bumped by every load that changes it."""
+    __tablename__ = "table_versions"
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, default=0)
+    updated_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+
+class MetricResult(Base):
+    """Shared (cross-worker) tier of the metric result cache."""
+    __tablename__ = "metric_results"
+    cache_key = Column(String, primary_key=True)    # metric or fused scan + table version + SQL hash
+    table_name = Column(String, index=True)
+    version = Column(Integer)
+    payload = Column(JSON)
+    created_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+
+class MetricSnapshot(Base):
+    """Precomputed result of a metric for one data version of its table."""
+    __tablename__ = "metric_snapshots"
+    metric_id = Column(Integer, ForeignKey("metrics.id", ondelete="CASCADE"), primary_key=True)
+    table_name = Column(String, index=True)
+    version = Column(Integer)            # table_versions.version the rows were computed from
+    sql_hash = Column(String)            # snapshot is only valid for the SQL it was computed with
+    payload = Column(JSON)
+    row_count = Column(Integer)
+    duration_ms = Column(Integer)
+    computed_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+
+class QueryLog(Base):
+    """One answered NL question: its SQL and the column predicates the SQL filters on."""
+    __tablename__ = "query_log"
+    id = Column(Integer, primary_key=True, index=True)
+    question = Column(Text)
+    sql = Column(Text)
+    tables = Column(JSON)                # tables the SQL reads
+    predicates = Column(JSON)            # [[table, column, "equality" | "range" | "other"], ...]
+    duration_ms = Column(Integer)
+    asked_by = Column(String)
+    created_at = Column(TIMESTAMP, default=datetime.datetime.utcnow, index=True)
+
+class AdvisedIndex(Base):
+    """Index created by the index advisor, with the latency of the metrics it was meant to help."""
+    __tablename__ = "advised_indexes"
+    index_name = Column(String, primary_key=True)
+    table_name = Column(String, index=True)
+    column_name = Column(String)
+    method = Column(String)              # 'brin' or 'btree'
+    reason = Column(Text)
+    status = Column(String)              # active / dropped / failed
+    build_ms = Column(Integer)
+    latency = Column(JSON)               # { metric id: {"before_ms": .., "after_ms": ..} }
+    created_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+    dropped_at = Column(TIMESTAMP)
+
+class Rollup(Base):
+    """Per-day rollup of a table's datetime column, updated by the loads of the table."""
+    __tablename__ = "rollups"
+    rollup_table = Column(String, primary_key=True)
+    table_name = Column(String, index=True)
+    column_name = Column(String)
+    sums = Column(JSON)                  # { numeric column: type }, summed per day as sum_<col> / n_<col>
+    buckets = Column(Integer)            # days in the rollup
+    refresh = Column(String)             # 'full' or 'incremental': how the last load updated it
+    refreshed_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+
+class TablePartitioning(Base):
+    """Range partitioning of an ingested table; its partitions are created as loads need them."""
+    __tablename__ = "table_partitioning"
+    table_name = Column(String, primary_key=True)
+    column_name = Column(String)         # partition key, a TIMESTAMP / TIMESTAMPTZ column
+    interval = Column(String)            # day / week / month / quarter / year per partition
+    created_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
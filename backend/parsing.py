@@ -0,0 +1,53 @@
+# backend/parsing.py
+import io
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+# Worker processes that parse uploads (workbooks, CSV chunks) off the event loop
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "2"))
+# Sheets of one workbook that are loaded at the same time
+SHEET_CONCURRENCY = int(os.getenv("INGEST_SHEET_CONCURRENCY", "4"))
+
+_pool: ProcessPoolExecutor = None
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Lazily start the parse pool. Workers are spawned, not forked, so they never
+    inherit the server's event loop or open database connections."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_parse_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def run_in_parse_pool(func, *args):
+    """Run a module-level parse function in the process pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_parse_pool(), func, *args)
+
+
+# ————————————————————————————————————————————————
+# Parse functions (executed inside the worker processes)
+# ————————————————————————————————————————————————
+
+def read_excel_sheets(file_bytes: bytes) -> dict[str, pd.DataFrame]:
+    """{ sheet name: DataFrame } of every sheet, in workbook order, from one pass over the workbook."""
+    return pd.read_excel(io.BytesIO(file_bytes), sheet_name=None, engine="openpyxl")
+
+
+def read_csv_chunk(header: bytes, body: bytes) -> pd.DataFrame:
+    """DataFrame of a run of whole CSV rows, parsed under the file's header line."""
+    return pd.read_csv(io.BytesIO(header + body))
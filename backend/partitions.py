@@ -0,0 +1,219 @@
+# backend/partitions.py
+"""
+Range partitioning of ingested tables on a timestamp column.
+
+A create or replace with `partition_by` makes the table PARTITION BY RANGE on
+that column ("auto": its first date / timestamp column), one partition per
+`partition_interval` (day, week, month, quarter or year). Partitions are
+created on demand: before each COPY chunk for the intervals its rows fall in,
+and before an append's merge for those of the staging rows. Rows without a
+value land in a DEFAULT partition.
+
+Queries bounded on the column then only read the partitions they need
+(partition pruning), and old data is retired by dropping whole partitions
+(`drop_partitions`) rather than a DELETE that writes every row and leaves
+the table to VACUUM.
+
+A DATE column is partitioned as TIMESTAMP: Postgres cannot retype a partition
+key, so a later file with times of day must already fit.
+"""
+import os
+import hashlib
+import datetime
+from dataclasses import dataclass, field
+import pandas as pd
+from sqlalchemy import text, select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+from models import TablePartitioning
+from loaders import fetch_column_types
+
+INTERVALS = ("day", "week", "month", "quarter", "year")
+# Defaults of Ingestor.ingest_file; PARTITION_BY is "" (off), "auto" or a column name
+PARTITION_BY = os.getenv("INGEST_PARTITION_BY", "")
+PARTITION_INTERVAL = os.getenv("INGEST_PARTITION_INTERVAL", "month")
+
+_DATETIME_TYPES = ("DATE", "TIMESTAMP", "TIMESTAMPTZ")
+
+CHILDREN_SQL = text("""
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(:tbl)
+""")
+
+
+def check_interval(interval: str) -> str:
+    interval = (interval or PARTITION_INTERVAL).lower()
+    if interval not in INTERVALS:
+        raise ValueError(f"partition_interval must be one of {', '.join(INTERVALS)}")
+    return interval
+
+
+def interval_start(day: datetime.date, interval: str) -> datetime.date:
+    """First day of the interval `day` falls in; weeks start on Monday, like DATE_TRUNC."""
+    if interval == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    if interval == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if interval == "year":
+        return day.replace(month=1, day=1)
+    return day
+
+
+def interval_end(start: datetime.date, interval: str) -> datetime.date:
+    if interval in ("day", "week"):
+        return start + datetime.timedelta(days=1 if interval == "day" else 7)
+    months = {"month": 1, "quarter": 3, "year": 12}[interval]
+    month = start.month - 1 + months
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(table_name: str, start: datetime.date = None) -> str:
+    """`<table>_p<first day>`, or `<table>_default` for the rows without a value."""
+    name = f"{table_name}_default" if start is None else f"{table_name}_p{start:%Y%m%d}"
+    if len(name) > 63:   # Postgres truncates identifiers; keep names unique instead
+        name = f"{name[:54]}_{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+    return name
+
+
+def pick_column(profiles: dict, partition_by: str) -> str:
+    """The column to partition on: `partition_by`, or the first date / timestamp column for "auto"."""
+    if partition_by == "auto":
+        return next((col for col, p in profiles.items() if p.pg_type in _DATETIME_TYPES), None)
+    profile = profiles.get(partition_by)
+    if profile is None or profile.pg_type not in _DATETIME_TYPES:
+        raise ValueError(f"Partition column '{partition_by}' is not a date / timestamp column of the file")
+    return partition_by
+
+
+@dataclass
+class Partitioner:
+    """Creates the partitions of one table as rows for new intervals arrive."""
+    table_name: str
+    column: str
+    interval: str
+    tz: bool = False                     # key is TIMESTAMPTZ: intervals are cut in UTC
+    created: set = field(default_factory=set)   # interval starts known to exist (None: DEFAULT)
+
+    @property
+    def key_type(self) -> str:
+        return "TIMESTAMPTZ" if self.tz else "TIMESTAMP"
+
+    def _bound(self, day: datetime.date) -> str:
+        return f"'{day:%Y-%m-%d} 00:00:00{'+00' if self.tz else ''}'"
+
+    async def ensure(self, conn: AsyncConnection, days, nulls: bool = False) -> list[str]:
+        """Create the partitions missing for `days` (and the DEFAULT one for NULLs); returns their names."""
+        starts = {interval_start(day, self.interval) for day in days}
+        if nulls:
+            starts.add(None)
+        made = []
+        for start in sorted(starts - self.created, key=lambda s: (s is None, s)):
+            name = partition_name(self.table_name, start)
+            if start is None:
+                bounds = "DEFAULT"
+            else:
+                bounds = f"FOR VALUES FROM ({self._bound(start)}) TO ({self._bound(interval_end(start, self.interval))})"
+            await conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{self.table_name}" {bounds};'
+            ))
+            self.created.add(start)
+            made.append(name)
+        return made
+
+    async def for_frame(self, conn: AsyncConnection, df: pd.DataFrame) -> list[str]:
+        """Partitions for a coerced DataFrame chunk, before it is COPYed."""
+        values = pd.to_datetime(df[self.column], utc=True).dt.tz_localize(None)
+        days = values.dropna().dt.normalize().unique()
+        return await self.ensure(conn, [pd.Timestamp(day).date() for day in days], bool(values.isna().any()))
+
+    async def for_table(self, conn: AsyncConnection, source: str) -> list[str]:
+        """Partitions for the rows of `source` (an append's staging table), cast like `merge_into` casts them."""
+        value = f'CAST(s."{self.column}" AS {self.key_type})'
+        day = f"({value} AT TIME ZONE 'UTC')::date" if self.tz else f"{value}::date"
+        result = await conn.execute(text(f'SELECT DISTINCT {day} FROM "{source}" s'))
+        days = result.scalars().all()
+        return await self.ensure(conn, [d for d in days if d is not None], None in days)
+
+    async def adopt(self, conn: AsyncConnection, table_name: str):
+        """After a replace swapped the load table in as `table_name`: rename its partitions to match."""
+        for start in self.created:
+            await conn.execute(text(
+                f'ALTER TABLE "{partition_name(self.table_name, start)}" RENAME TO "{partition_name(table_name, start)}";'
+            ))
+        self.table_name = table_name
+
+    async def register(self, conn: AsyncConnection):
+        row = {
+            "table_name": self.table_name,
+            "column_name": self.column,
+            "interval": self.interval,
+            "created_at": datetime.datetime.utcnow(),
+        }
+        stmt = insert(TablePartitioning).values(row)
+        await conn.execute(stmt.on_conflict_do_update(
+            index_elements=[TablePartitioning.table_name],
+            set_={key: stmt.excluded[key] for key in row if key != "table_name"},
+        ))
+
+
+async def unregister(conn: AsyncConnection, table_name: str):
+    await conn.execute(delete(TablePartitioning).where(TablePartitioning.table_name == table_name))
+
+
+async def partitioner(conn: AsyncConnection, table_name: str) -> Partitioner:
+    """The Partitioner of an existing partitioned table; None for a plain one."""
+    result = await conn.execute(select(TablePartitioning).where(TablePartitioning.table_name == table_name))
+    scheme = result.first()
+    if scheme is None:
+        return None
+    key_type = (await fetch_column_types(conn, table_name)).get(scheme.column_name, "")
+    return Partitioner(table_name, scheme.column_name, scheme.interval, tz=key_type.endswith("with time zone"))
+
+
+async def list_partitions(conn: AsyncConnection, table_name: str) -> list[dict]:
+    """[{name, bounds}] of a partitioned table, oldest first; the DEFAULT partition last."""
+    rows = (await conn.execute(CHILDREN_SQL, {"tbl": f'"{table_name}"'})).all()
+    rows.sort(key=lambda row: (row[1] == "DEFAULT", row[1]))
+    return [{"name": name, "bounds": bounds} for name, bounds in rows]
+
+
+async def drop_partitions(conn: AsyncConnection, table_name: str,
+                          before: datetime.datetime) -> tuple[list[str], datetime.date]:
+    """
+    Drop the partitions of `table_name` holding only values before `before`:
+    retention in a catalog update, however many rows they hold. Returns the
+    dropped partitions and the day before which no row is left — None when
+    none were dropped, or when that bound is not a midnight in the session's
+    time zone (a TIMESTAMPTZ key cut in UTC), so a day straddles it. The caller
+    bumps the table version and updates the rollups in the same transaction.
+    """
+    part = await partitioner(conn, table_name)
+    if part is None:
+        raise ValueError(f"Table '{table_name}' is not partitioned")
+    # Bounds read back in the session's time zone, so they are compared as the key's own type
+    result = await conn.execute(
+        text(f"""
+        SELECT relname, DATE(upper), upper = DATE(upper)
+        FROM (
+            SELECT c.relname,
+                   substring(pg_get_expr(c.relpartbound, c.oid) from 'TO \\(''([^'']+)''\\)')::{part.key_type} AS upper
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:tbl)
+              AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+        ) bounds
+        WHERE upper <= CAST(:before AS {part.key_type})
+        ORDER BY upper
+        """),
+        {"tbl": f'"{table_name}"', "before": before}
+    )
+    rows = result.all()
+    for name, _, _ in rows:
+        await conn.execute(text(f'DROP TABLE "{name}";'))
+    # Partitions do not overlap and NULLs go to DEFAULT: no row left is before the last upper bound
+    until = rows[-1][1] if rows and rows[-1][2] else None
+    return [name for name, _, _ in rows], until
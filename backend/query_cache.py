@@ -0,0 +1,195 @@
+# backend/query_cache.py
+"""
+Question → SQL cache for the NL query engine.
+
+Questions are normalized (case, punctuation, filler words) and matched
+exactly first, then by similarity: each question is reduced to a MinHash
+signature over its word and word-pair shingles, LSH bands narrow the
+candidates, and the best candidate whose estimated Jaccard similarity
+reaches QUERY_CACHE_SIMILARITY is reused. Numbers, quoted literals and
+words that change the SQL's meaning (aggregates, rankings, comparisons,
+negations, periods) must match exactly, so "revenue in 2023" never answers
+"revenue in 2024" and "average revenue by region" never answers "total
+revenue by region".
+
+Each entry remembers the schema fingerprint of the tables its SQL reads and
+is dropped as soon as one of them changes. Entries live in process memory,
+least recently used first out beyond QUERY_CACHE_MAX_ENTRIES.
+
+Rows of the generated SQL are kept in `query_results`, keyed by the SQL and
+the data versions of the tables it reads, so they are reused until an ingest.
+"""
+import os
+import re
+import random
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from result_cache import MetricResultCache
+
+CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0.8"))
+CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+RESULTS_MAX_MB = float(os.getenv("QUERY_RESULT_CACHE_MAX_MB", "32"))
+# Signature length = bands × rows per band; more rows per band → fewer, closer candidates
+LSH_BANDS, LSH_ROWS = 16, 4
+
+FILLER_WORDS = {
+    "a", "an", "the", "please", "show", "me", "give", "tell", "list", "what", "whats",
+    "is", "are", "was", "were", "can", "could", "you", "i", "want", "to", "see", "get",
+}
+# Words that change what the SQL computes however similar the rest of the question is
+MEANING_WORDS = {
+    "sum", "total", "average", "avg", "mean", "median", "count", "many", "number", "distinct", "unique",
+    "min", "minimum", "max", "maximum", "lowest", "highest", "smallest", "largest", "top", "bottom",
+    "first", "last", "most", "least", "best", "worst", "ascending", "descending",
+    "more", "less", "fewer", "greater", "above", "below", "over", "under", "between",
+    "before", "after", "since", "until", "not", "no", "without", "excluding", "except", "only",
+    "this", "next", "previous", "current", "daily", "weekly", "monthly", "quarterly", "yearly",
+    "day", "week", "month", "quarter", "year", "growth", "change", "increase", "decrease",
+}
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)   # fixed, so signatures are comparable across restarts
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(LSH_BANDS * LSH_ROWS)]
+
+
+def normalize(question: str) -> str:
+    """Lower-case words and literals of `question`, without punctuation or filler words."""
+    tokens = re.findall(r"'[^']*'|\"[^\"]*\"|[\w.]+", question.lower())
+    tokens = [token.strip(".") if token[0] not in "'\"" else token for token in tokens]
+    return " ".join(token for token in tokens if token and token not in FILLER_WORDS)
+
+
+def literals(normalized: str) -> frozenset:
+    """Numbers, quoted strings and MEANING_WORDS: these must be identical for a similar question to match."""
+    values = re.findall(r"'[^']*'|\"[^\"]*\"|\b\d[\d.]*\b", normalized)
+    return frozenset(values) | (set(normalized.split()) & MEANING_WORDS)
+
+
+def shingles(normalized: str) -> set[str]:
+    words = normalized.split()
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def minhash(normalized: str) -> tuple[int, ...]:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for shingle in shingles(normalized)
+    ] or [0]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a: tuple, sig_b: tuple) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+
+def _bands(signature: tuple) -> list[tuple]:
+    return [(i, signature[i * LSH_ROWS:(i + 1) * LSH_ROWS]) for i in range(LSH_BANDS)]
+
+
+@dataclass
+class CachedQuery:
+    sql: str
+    signature: tuple
+    literals: frozenset
+    schemas: dict            # { table read by the SQL: its schema fingerprint when cached }
+    hits: int = 0
+
+
+@dataclass
+class CacheStats:
+    exact_hits: int = 0
+    similar_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0       # questions that waited on an identical in-flight one
+    invalidations: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class QueryCache:
+    def __init__(self, threshold: float = CACHE_SIMILARITY, max_entries: int = CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.stats = CacheStats()   # per process, since start-up
+        # Keys are (model id, normalized question); buckets map (model id, LSH band) → keys
+        self._entries: OrderedDict[tuple, CachedQuery] = OrderedDict()
+        self._buckets: dict[tuple, set] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _valid(self, key: tuple, entry: CachedQuery, schemas: dict) -> bool:
+        if all(schemas.get(table) == fp for table, fp in entry.schemas.items()):
+            return True
+        self._remove(key)
+        self.stats.invalidations += 1
+        return False
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key)
+        for band in _bands(entry.signature):
+            bucket = self._buckets.get((key[0], band))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[(key[0], band)]
+
+    def get(self, model_id: str, question: str, schemas: dict) -> tuple[str, str]:
+        """(sql, "exact" | "similar") for a cached equivalent of `question`, else (None, None)."""
+        normalized = normalize(question)
+        key = (model_id, normalized)
+        entry = self._entries.get(key)
+        if entry is not None and self._valid(key, entry, schemas):
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.stats.exact_hits += 1
+            return entry.sql, "exact"
+
+        signature, wanted = minhash(normalized), literals(normalized)
+        candidates = set()
+        for band in _bands(signature):
+            candidates |= self._buckets.get((model_id, band), set())
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            entry = self._entries[candidate]
+            score = similarity(signature, entry.signature)
+            if score >= best_score and entry.literals == wanted:
+                best, best_score = candidate, score
+        if best is not None and self._valid(best, self._entries[best], schemas):
+            self._entries.move_to_end(best)
+            self._entries[best].hits += 1
+            self.stats.similar_hits += 1
+            return self._entries[best].sql, "similar"
+
+        self.stats.misses += 1
+        return None, None
+
+    def put(self, model_id: str, question: str, sql: str, schemas: dict):
+        """Cache `sql` for `question`; `schemas` holds the fingerprints of the tables it reads."""
+        normalized = normalize(question)
+        key = (model_id, normalized)
+        if key in self._entries:
+            self._remove(key)
+        entry = CachedQuery(sql, minhash(normalized), literals(normalized), schemas)
+        self._entries[key] = entry
+        for band in _bands(entry.signature):
+            self._buckets.setdefault((model_id, band), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+
+query_cache = QueryCache()
+query_results = MetricResultCache(max_mb=RESULTS_MAX_MB, shared=False)
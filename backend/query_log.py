@@ -0,0 +1,50 @@
+# backend/query_log.py
+"""
+Log of answered NL questions, for the index advisor.
+
+Each entry keeps the generated SQL and the predicates it filters on, as
+(table, column, kind) triples: "range" for <, <=, >, >=, BETWEEN; "equality"
+for =, IN; "other" for LIKE, IS, <> and the like. Only columns of the
+tables the SQL reads are recognised, so aliases and literals are ignored.
+"""
+import re
+import datetime
+from sqlalchemy import insert
+from db import engine
+from models import QueryLog
+
+_CLAUSE = re.compile(r"\b(?:where|on|having)\b(.*?)(?=\b(?:group\s+by|order\s+by|limit|offset|union|join)\b|$)",
+                     re.IGNORECASE | re.DOTALL)
+_PREDICATE = re.compile(
+    r'(?:"([^"]+)"|\b([A-Za-z_]\w*))\s*(<=|>=|<>|!=|=|<|>|\bnot\s+in\b|\bin\b|\bbetween\b|\bnot\s+i?like\b|\bi?like\b|\bis\b)',
+    re.IGNORECASE,
+)
+_KINDS = {"<": "range", "<=": "range", ">": "range", ">=": "range", "between": "range", "=": "equality", "in": "equality"}
+
+
+def predicates(sql: str, columns_by_table: dict[str, set]) -> list[list[str]]:
+    """[[table, column, kind], ...] for the filters of `sql` on known columns, in order, without repeats."""
+    found = []
+    for clause in _CLAUSE.findall(sql):
+        for quoted, bare, op in _PREDICATE.findall(clause):
+            column = quoted or bare
+            kind = _KINDS.get(" ".join(op.lower().split()), "other")
+            for table, columns in columns_by_table.items():
+                if column in columns and [table, column, kind] not in found:
+                    found.append([table, column, kind])
+    return found
+
+
+async def log_query(question: str, sql: str, tables: list[str], found: list, duration_ms: float,
+                    asked_by: str = None):
+    """Record an answered question; on the primary, as interactive sessions may read from a replica."""
+    async with engine.begin() as conn:
+        await conn.execute(insert(QueryLog).values(
+            question=question,
+            sql=sql,
+            tables=tables,
+            predicates=found,
+            duration_ms=int(duration_ms),
+            asked_by=asked_by,
+            created_at=datetime.datetime.utcnow(),
+        ))
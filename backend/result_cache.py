@@ -0,0 +1,171 @@
+# backend/result_cache.py
+"""
+Metric result cache.
+
+Results are keyed by what they were computed from — the metric (or fused
+scan) id, a hash of its SQL, and the data version of its table — so they
+never need explicit invalidation: every ingest bumps the table's version in
+`table_versions` inside its own transaction, and older entries simply stop
+being asked for. Two tiers:
+  • memory → per worker, LRU-evicted beyond METRIC_CACHE_MAX_MB
+  • shared → optional `metric_results` table, so all uvicorn workers reuse
+    each other's results (METRIC_CACHE_SHARED=1)
+"""
+import os
+import json
+import time
+import hashlib
+import datetime
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text, select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from db import engine
+from models import MetricResult, TableVersion
+
+CACHE_MAX_MB = float(os.getenv("METRIC_CACHE_MAX_MB", "64"))
+CACHE_SHARED = os.getenv("METRIC_CACHE_SHARED", "0") == "1"
+
+
+async def table_version(session: AsyncSession, table_name: str) -> int:
+    version = await session.scalar(select(TableVersion.version).where(TableVersion.table_name == table_name))
+    return version or 0
+
+
+async def bump_table_version(conn: AsyncConnection, table_name: str) -> int:
+    """Advance a table's data version; call inside the transaction that changes the table."""
+    result = await conn.execute(
+        text("""
+        INSERT INTO table_versions (table_name, version, updated_at)
+        VALUES (:tbl, 1, now() AT TIME ZONE 'utc')
+        ON CONFLICT (table_name) DO UPDATE
+            SET version = table_versions.version + 1, updated_at = EXCLUDED.updated_at
+        RETURNING version
+        """),
+        {"tbl": table_name}
+    )
+    return result.scalar()
+
+
+def sql_hash(sql: str) -> str:
+    return hashlib.sha1(sql.encode()).hexdigest()[:12]
+
+
+def cache_key(kind: str, ident, sql: str, version: int) -> str:
+    return f"{kind}:{ident}:v{version}:{sql_hash(sql)}"
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    shared_hits: int = 0
+    misses: int = 0
+    snapshot_hits: int = 0   # misses answered from a materialized snapshot instead of a query
+    evictions: int = 0
+    # Cumulative milliseconds spent answering each kind of lookup
+    latency_ms: dict = field(default_factory=lambda: {"memory": 0.0, "shared": 0.0, "miss": 0.0})
+
+    def record(self, outcome: str, elapsed_ms: float):
+        self.latency_ms[outcome] += elapsed_ms
+
+    def as_dict(self) -> dict:
+        lookups = self.memory_hits + self.shared_hits + self.misses
+        counts = {"memory": self.memory_hits, "shared": self.shared_hits, "miss": self.misses}
+        return {
+            "memory_hits": self.memory_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "snapshot_hits": self.snapshot_hits,
+            "evictions": self.evictions,
+            "hit_rate": round((self.memory_hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            "avg_latency_ms": {
+                outcome: round(total / counts[outcome], 3) if counts[outcome] else None
+                for outcome, total in self.latency_ms.items()
+            },
+        }
+
+
+class MetricResultCache:
+    def __init__(self, max_mb: float = CACHE_MAX_MB, shared: bool = CACHE_SHARED):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.shared = shared
+        self._entries: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self._bytes = 0
+        self.stats = CacheStats()
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def _remember(self, key: str, payload):
+        size = len(json.dumps(payload))
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (payload, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self.stats.evictions += 1
+
+    def put(self, key: str, payload):
+        """Warm the memory tier with an already computed result."""
+        self._remember(key, jsonable_encoder(payload))
+
+    async def lookup(self, session: AsyncSession, key: str):
+        """Cached payload for `key` from the memory or shared tier, else None."""
+        started = time.perf_counter()
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.stats.memory_hits += 1
+            self.stats.record("memory", (time.perf_counter() - started) * 1000)
+            return self._entries[key][0]
+
+        if self.shared:
+            payload = await session.scalar(select(MetricResult.payload).where(MetricResult.cache_key == key))
+            if payload is not None:
+                self._remember(key, payload)
+                self.stats.shared_hits += 1
+                self.stats.record("shared", (time.perf_counter() - started) * 1000)
+                return payload
+        return None
+
+    async def store(self, key: str, table_name: str, version: int, payload, elapsed_ms: float = 0.0):
+        """Record a result computed after a miss; returns its JSON-ready form."""
+        payload = jsonable_encoder(payload)
+        self._remember(key, payload)
+        if self.shared:
+            await self._store_shared(key, table_name, version, payload)
+        self.stats.misses += 1
+        self.stats.record("miss", elapsed_ms)
+        return payload
+
+    async def get_or_compute(self, session: AsyncSession, key: str, table_name: str, version: int, compute):
+        """
+        Cached JSON-ready payload for `key`, computing it with `await compute()` on a miss.
+        Payloads go through jsonable_encoder first, so hits and misses return identical values.
+        """
+        started = time.perf_counter()
+        payload = await self.lookup(session, key)
+        if payload is not None:
+            return payload
+        computed = await compute()
+        return await self.store(key, table_name, version, computed, (time.perf_counter() - started) * 1000)
+
+    async def _store_shared(self, key: str, table_name: str, version: int, payload):
+        # Own transaction: the caller's session may be mid-transaction or read-only
+        async with engine.begin() as conn:
+            # Results of older versions of the table can never be hit again
+            await conn.execute(
+                delete(MetricResult).where(MetricResult.table_name == table_name).where(MetricResult.version < version)
+            )
+            stmt = insert(MetricResult).values(
+                cache_key=key, table_name=table_name, version=version,
+                payload=payload, created_at=datetime.datetime.utcnow(),
+            )
+            await conn.execute(stmt.on_conflict_do_nothing(index_elements=[MetricResult.cache_key]))
+
+
+metric_cache = MetricResultCache()
@@ -0,0 +1,200 @@
+# backend/result_transport.py
+"""
+Transport of metric and query result rows.
+
+Rows are read through a server-side cursor, FETCH_ROWS at a time, and never
+beyond a row cap (RESULT_MAX_ROWS), so a 500k-row answer costs one batch of
+memory instead of the whole result. Every statement is admitted by
+`sql_guard` first (EXPLAIN cost check, read-only, statement timeout, LIMIT).
+Three response formats:
+  • json   → {"data": [...], "truncated": bool, ...} (the default)
+  • ndjson → one JSON object per line, then a {"_meta": {"row_count", "truncated"}} line
+  • arrow  → Arrow IPC stream, one record batch per fetch; `viz` travels in the
+    schema metadata, and a final empty batch carries row_count / truncated
+"""
+import os
+import io
+import json
+import decimal
+import datetime
+from contextlib import asynccontextmanager, AsyncExitStack
+import pyarrow as pa
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import InteractiveSession
+from sql_guard import guarded
+
+MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "100000"))
+FETCH_ROWS = int(os.getenv("RESULT_FETCH_ROWS", "5000"))
+FORMATS = ("json", "ndjson", "arrow")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class RowStream:
+    """Column names plus batches of row tuples from `source`, stopping at `max_rows`."""
+
+    def __init__(self, columns: list[str], source, max_rows: int = MAX_ROWS):
+        self.columns = columns
+        self.max_rows = max_rows
+        self.row_count = 0
+        self.truncated = False
+        self.kept = None          # set to a list to also collect the rows passed on
+        self._source = source
+
+    async def batches(self):
+        async for batch in self._source:
+            room = self.max_rows - self.row_count
+            if len(batch) > room:
+                batch, self.truncated = batch[:room], True
+            if batch:
+                self.row_count += len(batch)
+                if self.kept is not None:
+                    self.kept.extend(batch)
+                yield batch
+            if self.truncated:
+                return
+
+
+async def _cursor_batches(result):
+    async for partition in result.partitions(FETCH_ROWS):
+        yield [tuple(row) for row in partition]
+
+
+async def _list_batches(rows: list[dict]):
+    for start in range(0, len(rows), FETCH_ROWS):
+        yield [tuple(row.values()) for row in rows[start:start + FETCH_ROWS]]
+
+
+def memory_rows(rows: list[dict], max_rows: int = MAX_ROWS) -> RowStream:
+    """Rows already at hand (cache hits, fused-scan projections) as a RowStream."""
+    return RowStream(list(rows[0]) if rows else [], _list_batches(rows), max_rows)
+
+
+@asynccontextmanager
+async def open_rows(session: AsyncSession, sql: str, params: dict = None, max_rows: int = MAX_ROWS):
+    """Execute `sql` under the SQL guardrails on a server-side cursor; yields a RowStream over its result."""
+    async with guarded(session, sql, params, max_rows) as safe_sql:
+        result = await session.stream(text(safe_sql), params or {}, execution_options={"yield_per": FETCH_ROWS})
+        try:
+            yield RowStream(list(result.keys()), _cursor_batches(result), max_rows)
+        finally:
+            await result.close()
+
+
+async def open_detached_rows(sql: str, params: dict = None,
+                             max_rows: int = MAX_ROWS) -> tuple[AsyncExitStack, RowStream]:
+    """
+    A RowStream on its own session, for a response body that outlives the
+    request handler; the caller closes the returned stack once it is consumed.
+    Errors in `sql` surface here, before any response has been sent.
+    """
+    stack = AsyncExitStack()
+    try:
+        session = await stack.enter_async_context(InteractiveSession())
+        rows = await stack.enter_async_context(open_rows(session, sql, params, max_rows))
+    except BaseException:
+        await stack.aclose()
+        raise
+    return stack, rows
+
+
+async def fetch_rows(session: AsyncSession, sql: str, params: dict = None,
+                     max_rows: int = MAX_ROWS) -> tuple[list[dict], bool]:
+    """Up to `max_rows` rows of `sql` as dicts, and whether any were left out."""
+    async with open_rows(session, sql, params, max_rows) as rows:
+        data = [dict(zip(rows.columns, row)) async for batch in rows.batches() for row in batch]
+        return data, rows.truncated
+
+
+# ————————————————————————————————————————————————
+# Encoders: async iterators of bytes for StreamingResponse
+# ————————————————————————————————————————————————
+
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+async def encode_ndjson(rows: RowStream):
+    async for batch in rows.batches():
+        yield "".join(
+            json.dumps(dict(zip(rows.columns, row)), default=_json_default) + "\n" for row in batch
+        ).encode()
+    meta = {"row_count": rows.row_count, "truncated": rows.truncated}
+    yield (json.dumps({"_meta": meta}) + "\n").encode()
+
+
+def _arrow_type(values: list):
+    value = next((v for v in values if v is not None), None)
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, int):
+        return pa.int64()
+    if isinstance(value, (float, decimal.Decimal)):
+        return pa.float64()
+    if isinstance(value, datetime.datetime):
+        return pa.timestamp("us", tz="UTC" if value.tzinfo else None)
+    if isinstance(value, datetime.date):
+        return pa.date32()
+    if isinstance(value, (bytes, memoryview)):
+        return pa.binary()
+    # Strings, JSON, and columns that are all NULL in the first batch
+    return pa.string()
+
+
+def _arrow_array(values: list, arrow_type):
+    if pa.types.is_floating(arrow_type):
+        values = [None if v is None else float(v) for v in values]
+    elif pa.types.is_string(arrow_type):
+        values = [
+            v if v is None or isinstance(v, str)
+            else json.dumps(v, default=_json_default) if isinstance(v, (dict, list))
+            else str(v)
+            for v in values
+        ]
+    return pa.array(values, type=arrow_type)
+
+
+async def encode_arrow(rows: RowStream, metadata: dict = None):
+    """
+    Arrow IPC stream of `rows`. Column types are inferred from the first batch's
+    Python values; a column that is entirely NULL there is sent as strings.
+    """
+    sink = io.BytesIO()
+    writer, schema = None, None
+
+    def drain() -> bytes:
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    def infer_schema(first_batch: list):
+        columns = list(zip(*first_batch)) if first_batch else [[] for _ in rows.columns]
+        fields = [pa.field(name, _arrow_type(list(values))) for name, values in zip(rows.columns, columns)]
+        meta = {key: json.dumps(value) for key, value in (metadata or {}).items()}
+        return pa.schema(fields, metadata=meta)
+
+    async for batch in rows.batches():
+        if writer is None:
+            schema = infer_schema(batch)
+            writer = pa.ipc.new_stream(sink, schema)
+        arrays = [_arrow_array(list(values), field.type) for values, field in zip(zip(*batch), schema)]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield drain()
+
+    if writer is None:
+        schema = infer_schema([])
+        writer = pa.ipc.new_stream(sink, schema)
+    empty = pa.record_batch([pa.array([], type=field.type) for field in schema], schema=schema)
+    writer.write_batch(empty, custom_metadata={
+        "row_count": str(rows.row_count), "truncated": json.dumps(rows.truncated),
+    })
+    writer.close()
+    yield drain()
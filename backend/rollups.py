@@ -0,0 +1,244 @@
+# backend/rollups.py
+"""
+Time-bucket rollups of ingested tables.
+
+For every datetime column, the ingestor keeps a rollup table with one row per
+day, in the same transaction as each load:
+
+    day | count | sum_<x> | n_<x> | ...      (SUM and COUNT of every numeric column x)
+
+A create or replace rebuilds it from the table. A plain append aggregates
+only the staging rows and adds them to their days, so its cost follows the
+rows loaded rather than the table; appends that upsert on key columns may
+change existing rows, and rebuild.
+
+Metrics a rollup answers read it instead of their table:
+  • the analyst's daily counts of the column → its rows as they are
+  • week / month / ... buckets (downsampling) → its days, re-bucketed
+  • SUM / AVG of numeric columns, alone or in a fused scan → totals of the day sums
+so these tiles cost O(days), however many rows the table grows to.
+"""
+import os
+import re
+import hashlib
+import datetime
+from sqlalchemy import text, select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from models import Metric, Rollup
+from loaders import fetch_column_types
+from agents.analyst_agent import daily_count_sql
+
+ENABLED = os.getenv("INGEST_ROLLUPS", "1") == "1"
+
+# Same categories as the extractor's is_numeric / is_datetime
+COLUMNS_SQL = text("""
+    SELECT a.attname, format_type(a.atttypid, a.atttypmod), t.typcategory::text
+    FROM pg_attribute a
+    JOIN pg_type t ON t.oid = a.atttypid
+    WHERE a.attrelid = to_regclass(:tbl)
+      AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum
+""")
+# SUM of these returns bigint, but a SUM of their bigint day sums would be numeric
+_INTEGER_TYPES = ("smallint", "integer")
+_FLOAT_TYPES = ("real", "double precision")
+
+_SCALAR = re.compile(r'^SELECT (?P<items>.+) FROM "(?P<table>[^"]+)"$', re.DOTALL)
+_SCALAR_ITEM = re.compile(r'^(?P<func>SUM|AVG)\("(?P<col>[^"]+)"\) AS "(?P<alias>[^"]+)"$')
+
+
+def rollup_name(table_name: str, column: str) -> str:
+    name = f"__rollup_{table_name}_{column}"
+    if len(name) > 63:   # Postgres truncates identifiers; keep names unique instead
+        name = f"{name[:54]}_{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+    return name
+
+
+async def _columns(conn: AsyncConnection, table_name: str) -> tuple[list[str], dict[str, str]]:
+    """(datetime columns, { numeric column: type }) of a table."""
+    datetimes, numerics = [], {}
+    for name, pg_type, category in (await conn.execute(COLUMNS_SQL, {"tbl": f'"{table_name}"'})).all():
+        if category == "D":
+            datetimes.append(name)
+        elif category == "N":
+            numerics[name] = pg_type
+    return datetimes, numerics
+
+
+def _select_list(day_expr: str, numeric_exprs: dict[str, str]) -> str:
+    items = [f"DATE({day_expr}) AS day", 'COUNT(*) AS "count"']
+    for col, expr in numeric_exprs.items():
+        items += [f'SUM({expr}) AS "sum_{col}"', f'COUNT({expr}) AS "n_{col}"']
+    return ", ".join(items)
+
+
+async def _rebuild(conn: AsyncConnection, name: str, table_name: str, column: str, numerics: dict):
+    select_list = _select_list(f'"{column}"', {col: f'"{col}"' for col in numerics})
+    await conn.execute(text(f'DROP TABLE IF EXISTS "{name}";'))
+    await conn.execute(text(f'CREATE TABLE "{name}" AS SELECT {select_list} FROM "{table_name}" GROUP BY 1;'))
+
+
+async def _merge(conn: AsyncConnection, name: str, staging: str, column: str, numerics: dict, day_type: str):
+    """Add the per-day aggregates of the staging rows, cast like `merge_into` casts them, to the rollup."""
+    stage_columns = await fetch_column_types(conn, staging)
+
+    def source(col, pg_type):
+        # Columns missing from the file were loaded as NULLs
+        return f'CAST(s."{col}" AS {pg_type})' if col in stage_columns else f"NULL::{pg_type}"
+
+    select_list = _select_list(source(column, day_type), {col: source(col, t) for col, t in numerics.items()})
+    columns = ["day", "count"] + [f"{prefix}_{col}" for col in numerics for prefix in ("sum", "n")]
+    sets = ['"count" = r."count" + d."count"']
+    for col in numerics:
+        # SUM is NULL for a day without values; a NULL side must not blank out the other
+        sets.append(f'"sum_{col}" = COALESCE(r."sum_{col}" + d."sum_{col}", r."sum_{col}", d."sum_{col}")')
+        sets.append(f'"n_{col}" = r."n_{col}" + d."n_{col}"')
+    # Days have no unique key (one is NULL), so two appends merging at once could
+    # both insert a new day; this lock mode conflicts with itself but not with readers
+    await conn.execute(text(f'LOCK TABLE "{name}" IN SHARE ROW EXCLUSIVE MODE;'))
+    await conn.execute(text(f"""
+        WITH d AS (SELECT {select_list} FROM "{staging}" s GROUP BY 1),
+        updated AS (
+            UPDATE "{name}" r SET {", ".join(sets)}
+            FROM d WHERE r.day IS NOT DISTINCT FROM d.day
+            RETURNING r.day
+        )
+        INSERT INTO "{name}" ({", ".join(f'"{c}"' for c in columns)})
+        SELECT {", ".join(f'd."{c}"' for c in columns)} FROM d
+        WHERE NOT EXISTS (SELECT 1 FROM updated u WHERE u.day IS NOT DISTINCT FROM d.day);
+    """))
+
+
+async def refresh_rollups(conn: AsyncConnection, table_name: str, staging: str = None) -> dict[str, str]:
+    """
+    Bring the rollups of `table_name` in line with its rows, inside the load's
+    transaction. `staging` names the rows a plain append just inserted: rollups
+    over the same columns only get those added. Rollups of columns that are
+    gone (or all of them, with INGEST_ROLLUPS=0) are dropped.
+    Returns { column: "full" | "incremental" }.
+    """
+    result = await conn.execute(select(Rollup).where(Rollup.table_name == table_name))
+    existing = {rollup.column_name: rollup for rollup in result.all()}
+    datetimes, numerics = await _columns(conn, table_name) if ENABLED else ([], {})
+
+    for col, rollup in existing.items():
+        if col not in datetimes:
+            await conn.execute(text(f'DROP TABLE IF EXISTS "{rollup.rollup_table}";'))
+            await conn.execute(delete(Rollup).where(Rollup.rollup_table == rollup.rollup_table))
+    if not datetimes:
+        return {}
+
+    table_types = await fetch_column_types(conn, table_name)
+    refreshed = {}
+    for col in datetimes:
+        name = rollup_name(table_name, col)
+        rollup = existing.get(col)
+        if staging and rollup is not None and rollup.rollup_table == name and rollup.sums == numerics:
+            await _merge(conn, name, staging, col, numerics, table_types[col])
+            refreshed[col] = "incremental"
+        else:
+            await _rebuild(conn, name, table_name, col, numerics)
+            refreshed[col] = "full"
+        await _register(conn, name, table_name, col, numerics, refreshed[col])
+    return refreshed
+
+
+async def trim_rollups(conn: AsyncConnection, table_name: str, column: str, before: datetime.date) -> dict[str, str]:
+    """
+    After retention removed the rows of `table_name` with `column` before the
+    day `before`: delete those days from the rollup of `column`, with no scan
+    of the table. Rollups of its other datetime columns cannot tell the removed
+    rows apart, and are rebuilt. Returns { column: "full" | "incremental" }.
+    """
+    result = await conn.execute(select(Rollup).where(Rollup.table_name == table_name))
+    refreshed = {}
+    for rollup in result.all():
+        name = rollup.rollup_table
+        if rollup.column_name == column:
+            await conn.execute(text(f'DELETE FROM "{name}" WHERE day < :before'), {"before": before})
+            refreshed[rollup.column_name] = "incremental"
+        else:
+            await _rebuild(conn, name, table_name, rollup.column_name, rollup.sums)
+            refreshed[rollup.column_name] = "full"
+        await _register(conn, name, table_name, rollup.column_name, rollup.sums, refreshed[rollup.column_name])
+    return refreshed
+
+
+async def _register(conn: AsyncConnection, name: str, table_name: str, column: str, numerics: dict, refresh: str):
+    row = {
+        "rollup_table": name,
+        "table_name": table_name,
+        "column_name": column,
+        "sums": numerics,
+        "buckets": (await conn.execute(text(f'SELECT COUNT(*) FROM "{name}"'))).scalar(),
+        "refresh": refresh,
+        "refreshed_at": datetime.datetime.utcnow(),
+    }
+    stmt = insert(Rollup).values(row)
+    await conn.execute(stmt.on_conflict_do_update(
+        index_elements=[Rollup.rollup_table],
+        set_={key: stmt.excluded[key] for key in row if key != "rollup_table"},
+    ))
+
+
+async def table_rollups(session: AsyncSession, table_name: str) -> dict[str, Rollup]:
+    """{ datetime column: rollup } of a table."""
+    result = await session.execute(select(Rollup).where(Rollup.table_name == table_name))
+    return {rollup.column_name: rollup for rollup in result.scalars()}
+
+
+def daily_sql(rollup: Rollup) -> str:
+    """The analyst's daily counts of the rollup's column, from the rollup."""
+    return f'SELECT day, "count" AS count FROM "{rollup.rollup_table}" ORDER BY day'
+
+
+def bucket_sql(rollup: Rollup, unit: str) -> str:
+    """Row counts per `unit` from the rollup; the same columns as `downsample.bucket_count_sql`."""
+    return (
+        f"SELECT DATE_TRUNC('{unit}', day)::date AS day, SUM(\"count\")::bigint AS count "
+        f"FROM \"{rollup.rollup_table}\" GROUP BY 1 ORDER BY day"
+    )
+
+
+def scalar_sql(rollups: dict[str, Rollup], sql: str) -> str:
+    """
+    `sql` — SUM / AVG of numeric columns over a whole table, as the analyst
+    writes scalar metrics and fused scans — over one of the table's rollups,
+    with the same output columns and types; None when it cannot be.
+    """
+    match = _SCALAR.match(sql)
+    rollup = next(iter(rollups.values()), None)
+    if match is None or rollup is None or match["table"] != rollup.table_name:
+        return None
+    items = []
+    for item in match["items"].split(", "):
+        agg = _SCALAR_ITEM.match(item)
+        if agg is None or agg["col"] not in rollup.sums:
+            return None
+        col, alias, pg_type = agg["col"], agg["alias"], rollup.sums[agg["col"]]
+        if agg["func"] == "SUM":
+            cast = "::bigint" if pg_type in _INTEGER_TYPES else ""
+            items.append(f'SUM("sum_{col}"){cast} AS "{alias}"')
+        else:
+            cast = "::float8" if pg_type in _FLOAT_TYPES else "::numeric"
+            items.append(f'SUM("sum_{col}"){cast} / NULLIF(SUM("n_{col}"), 0){cast} AS "{alias}"')
+    return f'SELECT {", ".join(items)} FROM "{rollup.rollup_table}"'
+
+
+def rollup_sql(metric: Metric, rollups: dict[str, Rollup]) -> str:
+    """SQL answering `metric` from one of its table's rollups; None when none does."""
+    if not rollups or not metric.table_name:
+        return None
+    tags = metric.tags or []
+    col = tags[1] if len(tags) > 1 else None
+    if col in rollups and metric.sql_definition == daily_count_sql(metric.table_name, col):
+        return daily_sql(rollups[col])
+    return scalar_sql(rollups, metric.sql_definition)
+
+
+async def routed_sql(session: AsyncSession, metric: Metric) -> str:
+    """The SQL to evaluate `metric` with: over a rollup when one answers it, else its own."""
+    if not metric.table_name:
+        return metric.sql_definition
+    return rollup_sql(metric, await table_rollups(session, metric.table_name)) or metric.sql_definition
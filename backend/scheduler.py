@@ -0,0 +1,377 @@
+# backend/scheduler.py
+"""
+Durable, asyncio-native scheduler for the post-ingest agent chain
+(extractor → dictionary → analyst [→ indexes] [→ materialize]).
+
+Every (run, table, stage) is a row in `pipeline_jobs`; the first stage of a
+table is queued on submit and each finished stage queues the next one. Workers
+claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, hold them under a lease
+that is renewed while the agent runs, and put jobs whose lease expired (a
+crashed or restarted worker) back in the queue, so runs survive restarts and
+several uvicorn workers can share the queue.
+
+Each stage has its own concurrency limit per worker — the LLM-bound dictionary
+stage is much narrower than the DB-bound ones — so throughput under many
+concurrent uploads is bounded by the slowest stage instead of piling up.
+"""
+import os
+import uuid
+import socket
+import asyncio
+from sqlalchemy import text
+from db import engine
+from events import EVENT_COLUMNS, job_event, publish
+from sql_guard import sql_lane
+from agents.extractor import extractor_agent
+from agents.dictionary_agent import dictionary_agent
+from agents.analyst_agent import analyst_agent
+from agents.materializer import materializer_agent
+from agents.index_advisor import index_advisor_agent
+
+# Ordered stages of the chain: (name, async agent function taking a table name)
+PIPELINE_STAGES = [
+    ("extractor", extractor_agent),
+    ("dictionary", dictionary_agent),
+    ("analyst", analyst_agent),
+]
+# Optional: index the columns metrics and questions filter on, before anything is precomputed
+if os.getenv("PIPELINE_INDEX_ADVISOR", "0") == "1":
+    PIPELINE_STAGES.append(("indexes", index_advisor_agent))
+# Optional: precompute metric results right after the analyst
+if os.getenv("PIPELINE_MATERIALIZE", "0") == "1":
+    PIPELINE_STAGES.append(("materialize", materializer_agent))
+
+# Concurrent jobs per stage and worker, overridable with PIPELINE_<STAGE>_CONCURRENCY
+DEFAULT_STAGE_CONCURRENCY = {"dictionary": 2, "indexes": 1}
+DEFAULT_CONCURRENCY = 4
+
+MAX_ATTEMPTS = int(os.getenv("PIPELINE_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("PIPELINE_RETRY_BACKOFF_SECONDS", "5"))  # doubled per attempt
+POLL_SECONDS = float(os.getenv("PIPELINE_POLL_SECONDS", "1"))
+LEASE_SECONDS = float(os.getenv("PIPELINE_LEASE_SECONDS", "60"))
+
+# pipeline_jobs timestamps are naive UTC, like the rest of the schema
+_NOW = "(now() AT TIME ZONE 'utc')"
+
+
+def stage_concurrency(stage: str) -> int:
+    default = DEFAULT_STAGE_CONCURRENCY.get(stage, DEFAULT_CONCURRENCY)
+    return int(os.getenv(f"PIPELINE_{stage.upper()}_CONCURRENCY", default))
+
+
+class PipelineScheduler:
+    def __init__(self, stages: list):
+        self.stages = stages
+        self.stage_funcs = dict(stages)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._limits: dict[str, asyncio.Semaphore] = {}
+        self._wakeups: dict[str, asyncio.Event] = {}
+        self._running: dict[int, asyncio.Task] = {}
+        self._loops: list[asyncio.Task] = []
+        self._stopping = False
+
+    # ————————————————————————————————————————————————
+    # Lifecycle
+    # ————————————————————————————————————————————————
+
+    async def start(self):
+        self._stopping = False
+        for stage, _ in self.stages:
+            self._limits[stage] = asyncio.Semaphore(stage_concurrency(stage))
+            self._wakeups[stage] = asyncio.Event()
+            self._loops.append(asyncio.create_task(self._dispatch(stage)))
+        self._loops.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self):
+        # The flag ends the loops even if a cancellation races with a wakeup
+        self._stopping = True
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+        tasks = self._loops + list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loops.clear()
+
+        # Hand interrupted jobs back to the queue right away; a shutdown is not
+        # the job's fault, so it does not count as an attempt
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(f"""
+                UPDATE pipeline_jobs
+                SET status = 'queued', worker_id = NULL, attempts = GREATEST(attempts - 1, 0)
+                WHERE worker_id = :wid AND status = 'running'
+                RETURNING {EVENT_COLUMNS}
+                """),
+                {"wid": self.worker_id}
+            )
+            await publish(conn, result.mappings().all())
+
+    # ————————————————————————————————————————————————
+    # Public API
+    # ————————————————————————————————————————————————
+
+    async def submit(self, run_id: str, tables: list[str], priority: int = 0):
+        """Queue the whole chain for every table of a run; higher priority runs first."""
+        rows = [
+            {
+                "run": run_id,
+                "tbl": tbl,
+                "stage": stage,
+                "ord": order,
+                "status": "queued" if order == 0 else "pending",
+                "prio": priority,
+                "max": MAX_ATTEMPTS,
+            }
+            for tbl in tables
+            for order, (stage, _) in enumerate(self.stages)
+        ]
+        if not rows:
+            return
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(f"""
+                INSERT INTO pipeline_jobs
+                    (run_id, table_name, stage, stage_order, status, priority, attempts, max_attempts, created_at)
+                VALUES (:run, :tbl, :stage, :ord, :status, :prio, 0, :max, {_NOW})
+                """),
+                rows
+            )
+        self._wake(self.stages[0][0])
+
+    async def cancel(self, run_id: str) -> int:
+        """Cancel every unfinished job of a run; running agents are interrupted."""
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(f"""
+                UPDATE pipeline_jobs SET status = 'cancelled', finished_at = {_NOW}, worker_id = NULL
+                WHERE run_id = :run AND status IN ('pending', 'queued', 'running')
+                RETURNING id, {EVENT_COLUMNS}
+                """),
+                {"run": run_id}
+            )
+            rows = result.mappings().all()
+            await publish(conn, rows)
+        cancelled = [row["id"] for row in rows]
+        # Local tasks stop now; other workers notice on their next maintenance pass
+        for job_id in cancelled:
+            task = self._running.get(job_id)
+            if task:
+                task.cancel()
+        return len(cancelled)
+
+    async def run_status(self, run_id: str) -> dict:
+        """{ table: { stage: {status, attempts, started_at, finished_at, duration_ms, error} } }"""
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                text(f"SELECT {EVENT_COLUMNS} FROM pipeline_jobs WHERE run_id = :run ORDER BY id"),
+                {"run": run_id}
+            )
+            rows = result.mappings().all()
+
+        status: dict[str, dict[str, dict]] = {}
+        for row in rows:
+            event = job_event(row)
+            status.setdefault(event["table"], {})[event["stage"]] = {
+                key: event[key] for key in ("status", "attempts", "started_at", "finished_at", "duration_ms", "error")
+            }
+        return status
+
+    # ————————————————————————————————————————————————
+    # Workers
+    # ————————————————————————————————————————————————
+
+    def _wake(self, stage: str):
+        if stage in self._wakeups:
+            self._wakeups[stage].set()
+
+    async def _dispatch(self, stage: str):
+        """Claim jobs of one stage whenever a concurrency slot is free."""
+        limit, wakeup = self._limits[stage], self._wakeups[stage]
+        while not self._stopping:
+            await limit.acquire()
+            if self._stopping:
+                limit.release()
+                break
+            wakeup.clear()
+            try:
+                job = await self._claim(stage)
+            except Exception:
+                job = None  # database hiccup: back off and retry
+            if job is None:
+                limit.release()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._run(job))
+            self._running[job["id"]] = task
+
+            def _done(_task, job_id=job["id"]):
+                self._running.pop(job_id, None)
+                limit.release()
+            task.add_done_callback(_done)
+
+    async def _claim(self, stage: str):
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(f"""
+                UPDATE pipeline_jobs
+                SET status = 'running', attempts = attempts + 1, worker_id = :wid,
+                    started_at = {_NOW}, heartbeat_at = {_NOW}
+                WHERE id = (
+                    SELECT id FROM pipeline_jobs
+                    WHERE stage = :stage AND status = 'queued'
+                      AND (next_attempt_at IS NULL OR next_attempt_at <= {_NOW})
+                    ORDER BY priority DESC, id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, stage_order, max_attempts, {EVENT_COLUMNS}
+                """),
+                {"stage": stage, "wid": self.worker_id}
+            )
+            row = result.mappings().first()
+            if row:
+                await publish(conn, [row])
+        return dict(row) if row else None
+
+    async def _run(self, job: dict):
+        try:
+            # Pipeline SQL queues in its own lane, apart from interactive requests
+            with sql_lane("pipeline"):
+                await self.stage_funcs[job["stage"]](job["table_name"])
+        except asyncio.CancelledError:
+            # Cancelled runs are already marked in the table; on shutdown,
+            # stop() requeues whatever was still running
+            raise
+        except Exception as e:
+            await self._fail(job, e)
+        else:
+            await self._complete(job)
+
+    async def _complete(self, job: dict):
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(f"""
+                UPDATE pipeline_jobs SET status = 'done', finished_at = {_NOW}, worker_id = NULL
+                WHERE id = :id AND status = 'running'
+                RETURNING {EVENT_COLUMNS}
+                """),
+                {"id": job["id"]}
+            )
+            done = result.mappings().all()
+            if not done:
+                return  # cancelled meanwhile
+            result = await conn.execute(
+                text(f"""
+                UPDATE pipeline_jobs SET status = 'queued'
+                WHERE run_id = :run AND table_name = :tbl AND stage_order = :next AND status = 'pending'
+                RETURNING {EVENT_COLUMNS}
+                """),
+                {"run": job["run_id"], "tbl": job["table_name"], "next": job["stage_order"] + 1}
+            )
+            queued = result.mappings().all()
+            await publish(conn, done + queued)
+            next_stage = queued[0]["stage"] if queued else None
+        if next_stage:
+            self._wake(next_stage)
+
+    async def _fail(self, job: dict, exc: Exception):
+        error = f"{type(exc).__name__}: {exc}"
+        async with engine.begin() as conn:
+            if job["attempts"] < job["max_attempts"]:
+                delay = RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+                result = await conn.execute(
+                    text(f"""
+                    UPDATE pipeline_jobs
+                    SET status = 'queued', worker_id = NULL, error = :err,
+                        next_attempt_at = {_NOW} + :delay * interval '1 second'
+                    WHERE id = :id AND status = 'running'
+                    RETURNING {EVENT_COLUMNS}
+                    """),
+                    {"id": job["id"], "err": error, "delay": delay}
+                )
+                await publish(conn, result.mappings().all())
+                return
+
+            result = await conn.execute(
+                text(f"""
+                UPDATE pipeline_jobs SET status = 'failed', finished_at = {_NOW}, worker_id = NULL, error = :err
+                WHERE id = :id AND status = 'running'
+                RETURNING {EVENT_COLUMNS}
+                """),
+                {"id": job["id"], "err": error}
+            )
+            failed = result.mappings().all()
+            if failed:
+                await publish(conn, failed + await self._skip_rest(conn, job))
+
+    @staticmethod
+    async def _skip_rest(conn, job) -> list:
+        """Mark the stages after a failed job's as skipped; returns their event rows."""
+        result = await conn.execute(
+            text(f"""
+            UPDATE pipeline_jobs SET status = 'skipped'
+            WHERE run_id = :run AND table_name = :tbl AND stage_order > :ord AND status = 'pending'
+            RETURNING {EVENT_COLUMNS}
+            """),
+            {"run": job["run_id"], "tbl": job["table_name"], "ord": job["stage_order"]}
+        )
+        return result.mappings().all()
+
+    async def _maintain(self):
+        """Renew our leases, honour cancellations from other workers, requeue expired leases."""
+        interval = min(POLL_SECONDS * 5, LEASE_SECONDS / 3)
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            try:
+                async with engine.begin() as conn:
+                    running = list(self._running)
+                    if running:
+                        await conn.execute(
+                            text(f"""
+                            UPDATE pipeline_jobs SET heartbeat_at = {_NOW}
+                            WHERE id = ANY(:ids) AND worker_id = :wid
+                            """),
+                            {"ids": running, "wid": self.worker_id}
+                        )
+                        result = await conn.execute(
+                            text("SELECT id FROM pipeline_jobs WHERE id = ANY(:ids) AND status = 'cancelled'"),
+                            {"ids": running}
+                        )
+                        for (job_id,) in result.all():
+                            task = self._running.get(job_id)
+                            if task:
+                                task.cancel()
+
+                    # A job that keeps taking its worker down must not be retried
+                    # forever: out of attempts, it fails like a raised error would
+                    result = await conn.execute(
+                        text(f"""
+                        UPDATE pipeline_jobs
+                        SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                            finished_at = CASE WHEN attempts >= max_attempts THEN {_NOW} END,
+                            error = CASE WHEN attempts >= max_attempts THEN :err ELSE error END,
+                            worker_id = NULL
+                        WHERE status = 'running' AND heartbeat_at < {_NOW} - :lease * interval '1 second'
+                        RETURNING stage_order, {EVENT_COLUMNS}
+                        """),
+                        {"lease": LEASE_SECONDS, "err": "Lease expired: the worker running the job stopped"}
+                    )
+                    expired = result.mappings().all()
+                    skipped = []
+                    for row in expired:
+                        if row["status"] == "failed":
+                            skipped += await self._skip_rest(conn, row)
+                    await publish(conn, expired + skipped)
+                for row in expired:
+                    if row["status"] == "queued":
+                        self._wake(row["stage"])
+            except Exception:
+                continue
+
+
+scheduler = PipelineScheduler(PIPELINE_STAGES)
@@ -0,0 +1,165 @@
+# backend/schema_index.py
+"""
+Relevant-schema retrieval for NL→SQL prompts.
+
+A BM25 index over the catalogue: one document per column (table name,
+column name, type and dictionary description) plus one per table name. A
+question is scored against it, tables rank by their table document plus
+their best column, and only the top SCHEMA_TOP_TABLES tables, each with at
+most SCHEMA_TOP_COLUMNS of its best-matching columns, go into the prompt.
+
+The index is updated per table: `update_table` replaces that table's
+documents only when its columns or descriptions changed, so refreshing
+after a dictionary run re-tokenizes just the tables it touched.
+"""
+import os
+import re
+import math
+import hashlib
+from collections import Counter
+
+TOP_TABLES = int(os.getenv("SCHEMA_TOP_TABLES", "5"))
+TOP_COLUMNS = int(os.getenv("SCHEMA_TOP_COLUMNS", "40"))
+
+STOP_WORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "and", "or", "is", "are", "was",
+    "what", "which", "how", "me", "show", "give", "list", "per", "with", "from", "each", "all",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-case word tokens; snake_case and camelCase are split, plural 's' dropped."""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text or "")
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self._postings: dict[str, dict[tuple, int]] = {}   # term → { document key: term frequency }
+        self._terms: dict[tuple, list[str]] = {}           # document key → its distinct terms
+        self._lengths: dict[tuple, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, key: tuple, tokens: list[str]):
+        if key in self._lengths:
+            self.remove(key)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[key] = tf
+        self._terms[key] = list(counts)
+        self._lengths[key] = len(tokens)
+        self._total_length += len(tokens)
+
+    def remove(self, key: tuple):
+        self._total_length -= self._lengths.pop(key)
+        for term in self._terms.pop(key):
+            del self._postings[term][key]
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def score(self, tokens: list[str]) -> dict[tuple, float]:
+        """{ document key: BM25 score } for documents sharing at least one term."""
+        n = len(self._lengths)
+        if not n:
+            return {}
+        avg_length = self._total_length / n or 1
+        scores: dict[tuple, float] = {}
+        for term in set(tokens):
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for key, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[key] / avg_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return scores
+
+
+def _table_fingerprint(columns: list[tuple]) -> str:
+    return hashlib.sha1(repr(columns).encode()).hexdigest()
+
+
+class SchemaIndex:
+    """Catalogue columns by table, with a BM25 index over them."""
+
+    def __init__(self, top_tables: int = TOP_TABLES, top_columns: int = TOP_COLUMNS):
+        self.top_tables = top_tables
+        self.top_columns = top_columns
+        self.bm25 = BM25Index()
+        # { table: [(column, data_type, description), ...] in ordinal order }
+        self.tables: dict[str, list[tuple]] = {}
+        self._fingerprints: dict[str, str] = {}
+        self.updates = 0   # tables (re-)indexed since start-up
+
+    def update_table(self, table_name: str, columns: list[tuple]) -> bool:
+        """(Re-)index a table's (column, data_type, description) rows; False when unchanged."""
+        fingerprint = _table_fingerprint(columns)
+        if self._fingerprints.get(table_name) == fingerprint:
+            return False
+        self.remove_table(table_name)
+        self.tables[table_name] = columns
+        self._fingerprints[table_name] = fingerprint
+        self.bm25.add((table_name, None), tokenize(table_name))
+        for column_name, data_type, description in columns:
+            self.bm25.add(
+                (table_name, column_name),
+                tokenize(table_name) + tokenize(column_name) * 2 + tokenize(data_type) + tokenize(description),
+            )
+        self.updates += 1
+        return True
+
+    def remove_table(self, table_name: str):
+        for column_name, _, _ in self.tables.pop(table_name, []):
+            self.bm25.remove((table_name, column_name))
+        if self._fingerprints.pop(table_name, None) is not None:
+            self.bm25.remove((table_name, None))
+
+    def sync(self, columns_by_table: dict[str, list[tuple]]):
+        """Bring the index in line with the catalogue: changed tables are re-indexed, dropped ones removed."""
+        for table_name in set(self.tables) - set(columns_by_table):
+            self.remove_table(table_name)
+        for table_name, columns in columns_by_table.items():
+            self.update_table(table_name, columns)
+
+    def relevant(self, question: str) -> dict[str, list[tuple]]:
+        """
+        { table: its relevant (column, data_type, description) rows } for a question.
+        With no term in common, the most recently indexed tables are returned.
+        """
+        scores = self.bm25.score(tokenize(question))
+        table_scores: dict[str, float] = {}
+        best_column: dict[str, float] = {}
+        for (table_name, column_name), score in scores.items():
+            if column_name is None:
+                table_scores[table_name] = table_scores.get(table_name, 0.0) + score
+            else:
+                best_column[table_name] = max(best_column.get(table_name, 0.0), score)
+        for table_name, score in best_column.items():
+            table_scores[table_name] = table_scores.get(table_name, 0.0) + score
+
+        ranked = sorted(table_scores, key=lambda t: (-table_scores[t], t))[:self.top_tables]
+        if not ranked:
+            ranked = list(self.tables)[-self.top_tables:]
+
+        selected = {}
+        for table_name in ranked:
+            columns = self.tables[table_name]
+            if len(columns) > self.top_columns:
+                keep = sorted(
+                    range(len(columns)),
+                    key=lambda i: -scores.get((table_name, columns[i][0]), 0.0),
+                )[:self.top_columns]
+                columns = [columns[i] for i in sorted(keep)]   # back in ordinal order
+            selected[table_name] = columns
+        return selected
@@ -0,0 +1,173 @@
+# backend/sql_guard.py
+"""
+Guardrails for generated and metric SQL.
+
+Every statement read through `result_transport` runs inside `guarded`:
+  1. a SAVEPOINT that is made READ ONLY with a `statement_timeout`
+     (SQL_STATEMENT_TIMEOUT_MS); rolling back to it afterwards restores the
+     surrounding transaction, so callers that write later are unaffected
+  2. a LIMIT of the row cap + 1 is appended when the statement has none, and
+     a larger trailing LIMIT is lowered to it
+  3. EXPLAIN prices the statement: above SQL_REJECT_COST it is rejected;
+     above SQL_MAX_COST, or expected to produce more than
+     SQL_MAX_ROWS_ESTIMATE rows, it is downgraded to the lane's heavy queue,
+     which admits SQL_HEAVY_CONCURRENCY statements at a time
+  4. a concurrency slot of the caller's lane. API requests run in the
+     "interactive" lane (SQL_INTERACTIVE_CONCURRENCY); the scheduler puts
+     pipeline stages in the "pipeline" lane (SQL_PIPELINE_CONCURRENCY), so a
+     burst of uploads never queues ahead of someone waiting on a chart.
+"""
+import os
+import re
+import json
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager, contextmanager, AsyncExitStack
+from dataclasses import dataclass, field
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+MAX_COST = float(os.getenv("SQL_MAX_COST", "1e6"))
+REJECT_COST = float(os.getenv("SQL_REJECT_COST", "1e8"))
+MAX_ROWS_ESTIMATE = float(os.getenv("SQL_MAX_ROWS_ESTIMATE", "1e6"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "30000"))
+LANE_CONCURRENCY = {
+    "interactive": int(os.getenv("SQL_INTERACTIVE_CONCURRENCY", "8")),
+    "pipeline": int(os.getenv("SQL_PIPELINE_CONCURRENCY", "4")),
+}
+HEAVY_CONCURRENCY = int(os.getenv("SQL_HEAVY_CONCURRENCY", "1"))
+
+_TRAILING_LIMIT = re.compile(
+    r"\blimit\s+(\d+|all)(\s+offset\s+\d+)?\s*$|\bfetch\s+(first|next)\b[^;]*\bonly\s*$",
+    re.IGNORECASE,
+)
+_READ_STATEMENT = re.compile(r"(select|with|values|table)\b|\(", re.IGNORECASE)
+_lane = contextvars.ContextVar("sql_lane", default="interactive")
+_slots: dict[str, asyncio.Semaphore] = {}
+
+
+class QueryRejected(ValueError):
+    """The planner's estimate for a statement is over SQL_REJECT_COST."""
+
+
+@dataclass
+class GuardStats:
+    checked: int = 0
+    rejected: int = 0
+    downgraded: int = 0
+    limits_injected: int = 0
+    timeouts: int = 0
+    waiting: dict = field(default_factory=dict)   # { lane: statements queued for a slot }
+
+    def as_dict(self) -> dict:
+        return {
+            "checked": self.checked,
+            "rejected": self.rejected,
+            "downgraded": self.downgraded,
+            "limits_injected": self.limits_injected,
+            "timeouts": self.timeouts,
+            "waiting": dict(self.waiting),
+        }
+
+
+guard_stats = GuardStats()   # per process, since start-up
+
+
+@contextmanager
+def sql_lane(name: str):
+    """Run the statements issued inside this block in lane `name`."""
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def limit_sql(sql: str, limit: int) -> tuple[str, bool]:
+    """(`sql` returning at most `limit` rows, whether its LIMIT was added or lowered)."""
+    sql = sql.strip().rstrip(";").rstrip()
+    if not _READ_STATEMENT.match(sql):
+        return sql, False   # not a query: READ ONLY refuses it anyway
+    match = _TRAILING_LIMIT.search(sql)
+    if match is None:
+        # On its own line, so a trailing "-- comment" cannot swallow it
+        return f"{sql}\nLIMIT {limit}", True
+    if match.group(1) and match.group(1).isdigit() and int(match.group(1)) <= limit:
+        return sql, False
+    if match.group(1):
+        return sql[:match.start(1)] + str(limit) + sql[match.end(1):], True
+    return sql, False   # FETCH FIRST n ROWS: left alone, the cursor still stops at the cap
+
+
+async def estimate(session: AsyncSession, sql: str, params: dict = None) -> tuple[float, float]:
+    """(planner total cost, rows the statement would produce before its LIMIT)."""
+    result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params or {})
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]["Plan"]
+    rows = plan["Plans"][0]["Plan Rows"] if plan["Node Type"] == "Limit" and plan.get("Plans") else plan["Plan Rows"]
+    return plan["Total Cost"], rows
+
+
+def _slot(name: str) -> asyncio.Semaphore:
+    if name not in _slots:
+        lane = name.removesuffix(":heavy")
+        _slots[name] = asyncio.Semaphore(HEAVY_CONCURRENCY if name.endswith(":heavy")
+                                         else LANE_CONCURRENCY.get(lane, LANE_CONCURRENCY["interactive"]))
+    return _slots[name]
+
+
+async def _acquire(stack: AsyncExitStack, name: str):
+    lane = _lane.get()
+    guard_stats.waiting[lane] = guard_stats.waiting.get(lane, 0) + 1
+    try:
+        await stack.enter_async_context(_slot(name))
+    finally:
+        guard_stats.waiting[lane] -= 1
+
+
+def _is_timeout(exc: Exception) -> bool:
+    # asyncpg errors raised while streaming arrive unwrapped, others as SQLAlchemy DBAPIError
+    sqlstate = getattr(exc, "sqlstate", None) or getattr(getattr(exc, "orig", None), "sqlstate", None)
+    return sqlstate == "57014"   # query_canceled
+
+
+@asynccontextmanager
+async def guarded(session: AsyncSession, sql: str, params: dict = None, max_rows: int = None):
+    """
+    Check and admit `sql`; yields the statement to execute on `session`, at
+    most max_rows + 1 rows long so callers can still tell it was truncated.
+    Raises QueryRejected when it is too expensive to run at all.
+    """
+    if max_rows is not None:
+        sql, injected = limit_sql(sql, max_rows + 1)
+        guard_stats.limits_injected += injected
+
+    savepoint = await session.begin_nested()
+    try:
+        await session.execute(text("SET TRANSACTION READ ONLY"))
+        await session.execute(text(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}"))
+        cost, rows = await estimate(session, sql, params)
+        guard_stats.checked += 1
+        if cost > REJECT_COST:
+            guard_stats.rejected += 1
+            raise QueryRejected(
+                f"Query rejected: estimated cost {cost:,.0f} is over the limit of {REJECT_COST:,.0f}; "
+                f"narrow it down with filters or aggregates"
+            )
+
+        lane = _lane.get()
+        async with AsyncExitStack() as stack:
+            if cost > MAX_COST or rows > MAX_ROWS_ESTIMATE:
+                guard_stats.downgraded += 1
+                await _acquire(stack, f"{lane}:heavy")
+            await _acquire(stack, lane)
+            yield sql
+    except Exception as e:
+        if _is_timeout(e):
+            guard_stats.timeouts += 1
+        raise
+    finally:
+        # Also undoes READ ONLY and the timeout; an error leaves the outer transaction usable
+        await savepoint.rollback()
@@ -0,0 +1,184 @@
+# backend/staging.py
+"""
+Staging-table workflow for replace/append ingests.
+
+Data is COPYed into a staging table first; the target is only touched at
+the very end, in the same transaction:
+  • replace → the staging table takes over the target's indexes and
+    constraints and is renamed into place, so readers never see a missing
+    or half-loaded table. It is created logged: turning an UNLOGGED table
+    durable rewrites all of it into the WAL, a second full write of the data.
+  • append  → columns are reconciled, then rows are inserted (optionally
+    deduplicated / upserted on a key) with one INSERT ... SELECT. Its
+    staging table is UNLOGGED, as it is dropped once merged.
+"""
+import os
+import uuid
+import logging
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from loaders import fetch_column_types
+from type_inference import from_pg_type, widen, same_family
+
+# Re-ANALYZE an appended table once the new rows reach this fraction of its size
+ANALYZE_DELTA = float(os.getenv("INGEST_ANALYZE_DELTA", "0.1"))
+
+# Indexes of a table; the definition of the primary key / unique constraint an index backs
+INDEXES_SQL = text("""
+    SELECT c.relname, pg_get_indexdef(i.indexrelid), con.conname, pg_get_constraintdef(con.oid)
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    LEFT JOIN pg_constraint con
+        ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid AND con.contype IN ('p', 'u')
+    WHERE i.indrelid = to_regclass(:tbl)
+""")
+
+logger = logging.getLogger(__name__)
+
+
+def staging_name() -> str:
+    return f"__stage_{uuid.uuid4().hex[:12]}"
+
+
+async def table_exists(conn: AsyncConnection, table_name: str) -> bool:
+    result = await conn.execute(text("SELECT to_regclass(:tbl)"), {"tbl": f'"{table_name}"'})
+    return result.scalar() is not None
+
+
+async def swap_in(conn: AsyncConnection, staging: str, target: str):
+    """
+    Replace `target` with the fully loaded `staging` table: make it durable,
+    copy the target's indexes and key constraints onto it, then rename it
+    into place. Only the final renames take an exclusive lock on the target.
+    Objects depending on the target, such as views, make the swap fail
+    rather than be dropped with it.
+    """
+    # A no-op for a replace's logged load table; the UNLOGGED staging table
+    # of an append that creates its target is rewritten here
+    await conn.execute(text(f'ALTER TABLE "{staging}" SET LOGGED;'))
+    await conn.execute(text(f'ANALYZE "{staging}";'))
+
+    if not await table_exists(conn, target):
+        await conn.execute(text(f'ALTER TABLE "{staging}" RENAME TO "{target}";'))
+        return
+
+    result = await conn.execute(INDEXES_SQL, {"tbl": f'"{target}"'})
+    renames = []
+    for index_name, indexdef, constraint_name, constraintdef in result.all():
+        tmp_name = f"__idx_{uuid.uuid4().hex[:12]}"
+        if constraint_name:
+            # Primary keys and unique constraints come back as constraints, not bare indexes
+            statement = f'ALTER TABLE "{staging}" ADD CONSTRAINT "{tmp_name}" {constraintdef};'
+            rename = f'ALTER TABLE "{target}" RENAME CONSTRAINT "{tmp_name}" TO "{constraint_name}";'
+        else:
+            using = indexdef[indexdef.index(" USING "):]
+            unique = "UNIQUE " if indexdef.startswith("CREATE UNIQUE ") else ""
+            statement = f'CREATE {unique}INDEX "{tmp_name}" ON "{staging}"{using};'
+            rename = f'ALTER INDEX "{tmp_name}" RENAME TO "{index_name}";'
+        try:
+            # Columns may have disappeared from the new file; such indexes are left out
+            async with conn.begin_nested():
+                await conn.execute(text(statement))
+            renames.append(rename)
+        except DBAPIError as e:
+            logger.warning("replace of %s: index %s not copied (%s): %s", target, index_name, indexdef, e.orig)
+
+    retired = f"__retired_{uuid.uuid4().hex[:12]}"
+    await conn.execute(text(f'ALTER TABLE "{target}" RENAME TO "{retired}";'))
+    await conn.execute(text(f'ALTER TABLE "{staging}" RENAME TO "{target}";'))
+    try:
+        await conn.execute(text(f'DROP TABLE "{retired}";'))
+    except DBAPIError as e:
+        raise ValueError(f"Cannot replace '{target}': other objects depend on it ({e.orig})") from e
+    for rename in renames:
+        await conn.execute(text(rename))
+
+
+async def reconcile_columns(conn: AsyncConnection, staging: str, target: str) -> dict[str, str]:
+    """
+    Make `target` able to receive every staging column:
+      • columns only in the file are added to the target as nullable columns
+      • a target column is widened in place when the file needs a wider type of
+        the same family (SMALLINT → BIGINT, DATE → TIMESTAMP, ...)
+    Returns { column: SELECT expression } casting staging values to the target type.
+    """
+    stage_types = await fetch_column_types(conn, staging)
+    target_types = await fetch_column_types(conn, target)
+
+    select_exprs = {}
+    for col, stage_type in stage_types.items():
+        if col not in target_types:
+            await conn.execute(text(f'ALTER TABLE "{target}" ADD COLUMN "{col}" {stage_type};'))
+            select_exprs[col] = f's."{col}"'
+            continue
+
+        target_type = target_types[col]
+        if target_type == stage_type:
+            select_exprs[col] = f's."{col}"'
+            continue
+
+        current, incoming = from_pg_type(target_type), from_pg_type(stage_type)
+        merged = widen(current, incoming) if current and incoming else None
+        if merged and merged != current and same_family(merged, current):
+            await conn.execute(text(
+                f'ALTER TABLE "{target}" ALTER COLUMN "{col}" TYPE {merged} USING "{col}"::{merged};'
+            ))
+            target_type = merged
+        # Anything else is cast; values that do not fit fail the whole load
+        select_exprs[col] = f'CAST(s."{col}" AS {target_type})'
+    return select_exprs
+
+
+async def merge_into(conn: AsyncConnection, staging: str, target: str,
+                     key_columns: list[str] = None, on_conflict: str = "update") -> int:
+    """
+    Insert the staging rows into `target`. With `key_columns`, rows are
+    deduplicated on the key (last row of the file wins) and either upsert
+    (on_conflict="update") or skip (on_conflict="ignore") existing keys.
+    Returns the number of rows inserted or updated.
+    """
+    select_exprs = await reconcile_columns(conn, staging, target)
+    cols = ", ".join(f'"{c}"' for c in select_exprs)
+    select_list = ", ".join(f'{expr} AS "{c}"' for c, expr in select_exprs.items())
+
+    if not key_columns:
+        result = await conn.execute(text(f'INSERT INTO "{target}" ({cols}) SELECT {select_list} FROM "{staging}" s;'))
+        return result.rowcount
+
+    missing = [k for k in key_columns if k not in select_exprs]
+    if missing:
+        raise ValueError(f"Key column(s) {missing} not present in the uploaded file")
+
+    keys = ", ".join(f'"{k}"' for k in key_columns)
+    stage_keys = ", ".join(f's."{k}"' for k in key_columns)
+    await conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS "{target}__key" ON "{target}" ({keys});'))
+
+    updates = [f'"{c}" = EXCLUDED."{c}"' for c in select_exprs if c not in key_columns]
+    if on_conflict == "ignore" or not updates:
+        conflict = "DO NOTHING"
+    else:
+        conflict = "DO UPDATE SET " + ", ".join(updates)
+
+    result = await conn.execute(text(f"""
+        INSERT INTO "{target}" ({cols})
+        SELECT DISTINCT ON ({stage_keys}) {select_list}
+        FROM "{staging}" s
+        ORDER BY {stage_keys}, s.ctid DESC
+        ON CONFLICT ({keys}) {conflict};
+    """))
+    return result.rowcount
+
+
+async def analyze_if_needed(conn: AsyncConnection, table_name: str, new_rows: int) -> bool:
+    """ANALYZE after an append only when the row delta is a meaningful share of the table."""
+    result = await conn.execute(
+        text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:tbl)"),
+        {"tbl": f'"{table_name}"'}
+    )
+    reltuples = result.scalar()
+    # reltuples is -1 for a table that has never been analyzed
+    if reltuples is None or reltuples <= 0 or new_rows >= ANALYZE_DELTA * reltuples:
+        await conn.execute(text(f'ANALYZE "{table_name}";'))
+        return True
+    return False
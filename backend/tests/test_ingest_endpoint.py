@@ -0,0 +1,35 @@
+# backend/tests/test_ingest_endpoint.py
+import os
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://localhost/test")   # engines connect lazily
+
+import asyncio
+import httpx
+import main
+
+
+def test_multi_sheet_replace_queues_target_once(monkeypatch):
+    submitted = []
+
+    async def ingest_file(content, filename, mode, **options):
+        # Every sheet of a replace loads into the same target
+        return [options["target_table"], options["target_table"]]
+
+    async def submit(run_id, tables, priority=0):
+        submitted.append(tables)
+
+    monkeypatch.setattr(main.Ingestor, "ingest_file", ingest_file)
+    monkeypatch.setattr(main.scheduler, "submit", submit)
+
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.post(
+                "/ingest/",
+                data={"mode": "replace", "table_name": "orders"},
+                files={"file": ("book.xlsx", b"PK")},
+            )
+
+    response = asyncio.run(post())
+
+    assert response.status_code == 200
+    assert response.json()["tables"] == ["orders"]
+    assert submitted == [["orders"]]
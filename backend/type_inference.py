@@ -0,0 +1,280 @@
+# backend/type_inference.py
+"""
+Column profiling and Postgres type inference for ingested DataFrames.
+
+Every check runs over the whole column as a vectorized pandas/NumPy pass, and
+the result is the narrowest Postgres type that holds every value. When a file
+is streamed, each chunk is profiled and `widen` merges the per-chunk types, so
+the final schema reflects the entire file rather than its first rows.
+"""
+import re
+import warnings
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
+INT_RANGES = [
+    ("SMALLINT", -32768, 32767),
+    ("INTEGER", -2147483648, 2147483647),
+    ("BIGINT", -9223372036854775808, 9223372036854775807),
+]
+# Decimal digits an integer type can hold; used when merging ints with NUMERIC
+INT_DIGITS = {"SMALLINT": 5, "INTEGER": 10, "BIGINT": 19}
+# Decimals with at most this many fractional digits become NUMERIC(p, s)
+MAX_NUMERIC_SCALE = 4
+MAX_NUMERIC_PRECISION = 38
+
+TRUE_TOKENS = {"true", "t", "yes", "y"}
+FALSE_TOKENS = {"false", "f", "no", "n"}
+BOOL_MAP = {**{tok: True for tok in TRUE_TOKENS}, **{tok: False for tok in FALSE_TOKENS}}
+
+_NUMERIC_RE = re.compile(r"NUMERIC\((\d+),\s*(\d+)\)")
+
+
+@dataclass
+class ColumnProfile:
+    name: str
+    pg_type: Optional[str]          # None when the column held no values at all
+    null_fraction: float
+    n_distinct: int
+    datetime_format: Optional[str] = None   # strptime format for date strings
+
+    @property
+    def ddl_type(self) -> str:
+        return self.pg_type or "TEXT"
+
+
+# ————————————————————————————————————————————————
+# Per-type detectors
+# ————————————————————————————————————————————————
+
+def _numeric_type(values: np.ndarray) -> str:
+    """Narrowest type for a float64 array without NaNs."""
+    if not np.isfinite(values).all():
+        return "DOUBLE PRECISION"
+
+    max_abs = float(np.abs(values).max()) if len(values) else 0.0
+    int_digits = len(str(int(max_abs))) if max_abs >= 1 else 1
+
+    if np.array_equal(values, np.floor(values)):
+        lo, hi = values.min(), values.max()
+        for pg_type, type_lo, type_hi in INT_RANGES:
+            if lo >= type_lo and hi <= type_hi:
+                return pg_type
+        # Clamping the precision would not make such values fit
+        if int_digits > MAX_NUMERIC_PRECISION:
+            return "DOUBLE PRECISION"
+        return f"NUMERIC({int_digits},0)"
+
+    # Exact short decimals (prices, rates) keep their precision as NUMERIC
+    for scale in range(1, MAX_NUMERIC_SCALE + 1):
+        scaled = values * 10 ** scale
+        if np.allclose(scaled, np.round(scaled), rtol=0, atol=1e-6):
+            precision = int_digits + scale
+            if precision <= 18:
+                return f"NUMERIC({precision},{scale})"
+            break
+    return "DOUBLE PRECISION"
+
+
+def _datetime_type(ser: pd.Series) -> str:
+    if getattr(ser.dt, "tz", None) is not None:
+        return "TIMESTAMPTZ"
+    if (ser == ser.dt.normalize()).all():
+        return "DATE"
+    return "TIMESTAMP"
+
+
+def _string_type(text: pd.Series) -> tuple[str, Optional[str]]:
+    """Classify non-null values stored as strings. Returns (pg_type, datetime_format)."""
+    text = text.astype(str).str.strip()
+
+    numeric = pd.to_numeric(text, errors="coerce")
+    if numeric.notna().all():
+        # Leading zeros (zip codes, account ids) would be lost as numbers
+        if text.str.match(r"^[-+]?0\d").any():
+            return "TEXT", None
+        # So would the digits of integers too long for NUMERIC (ids, hashes)
+        if text.str.fullmatch(r"[-+]?\d+").all() and text.str.lstrip("+-").str.len().max() > MAX_NUMERIC_PRECISION:
+            return "TEXT", None
+        return _numeric_type(numeric.to_numpy(dtype="float64")), None
+
+    lowered = text.str.lower()
+    if lowered.isin(BOOL_MAP.keys()).all():
+        tokens = set(lowered.unique())
+        # A lone "F" or "N" column is more likely a code than a flag
+        if any(len(tok) > 1 for tok in tokens) or (tokens & TRUE_TOKENS and tokens & FALSE_TOKENS):
+            return "BOOLEAN", None
+
+    fmt = guess_datetime_format(text.iloc[0])
+    # Require a year and a month so month names or times alone stay TEXT
+    if fmt and ("%Y" in fmt or "%y" in fmt) and any(tok in fmt for tok in ("%m", "%b", "%B")):
+        if "%z" in fmt or "%Z" in fmt:
+            candidates = [(fmt, "TIMESTAMPTZ")]
+        elif any(tok in fmt for tok in ("%H", "%I", "%M", "%S")):
+            candidates = [(fmt, "TIMESTAMP")]
+        else:
+            candidates = [(fmt, "DATE")]
+        # ISO columns often mix bare dates with date-times
+        if fmt.startswith("%Y-%m-%d"):
+            candidates.append(("ISO8601", None))
+
+        for candidate, pg_type in candidates:
+            with warnings.catch_warnings():
+                # mixed UTC offsets: pandas warns and falls back to object dtype
+                warnings.simplefilter("ignore", FutureWarning)
+                try:
+                    parsed = pd.to_datetime(text, format=candidate, errors="coerce")
+                except (ValueError, TypeError):
+                    continue
+            if pd.api.types.is_datetime64_any_dtype(parsed) and parsed.notna().all():
+                return pg_type or _datetime_type(parsed), candidate
+    return "TEXT", None
+
+
+# ————————————————————————————————————————————————
+# Public API
+# ————————————————————————————————————————————————
+
+def profile_column(name: str, ser: pd.Series) -> ColumnProfile:
+    non_null = ser.dropna()
+    total = len(ser)
+    null_fraction = 1 - len(non_null) / total if total else 0.0
+    if non_null.empty:
+        return ColumnProfile(name, None, null_fraction, 0)
+
+    n_distinct = int(non_null.nunique())
+    fmt = None
+    if pd.api.types.is_bool_dtype(non_null):
+        pg_type = "BOOLEAN"
+    elif pd.api.types.is_datetime64_any_dtype(non_null):
+        pg_type = _datetime_type(non_null)
+    elif pd.api.types.is_numeric_dtype(non_null):
+        pg_type = _numeric_type(non_null.to_numpy(dtype="float64"))
+    elif pd.api.types.is_timedelta64_dtype(non_null):
+        pg_type = "TEXT"
+    else:
+        pg_type, fmt = _string_type(non_null)
+    return ColumnProfile(name, pg_type, null_fraction, n_distinct, fmt)
+
+
+def infer_schema(df: pd.DataFrame) -> dict[str, ColumnProfile]:
+    """Profile every column of `df`; keys keep the DataFrame column order."""
+    return {col: profile_column(col, df[col]) for col in df.columns}
+
+
+def _numeric_shape(pg_type: str) -> Optional[tuple[int, int]]:
+    """(integer digits, scale) of an integer or NUMERIC(p,s) type, else None."""
+    if pg_type in INT_DIGITS:
+        return INT_DIGITS[pg_type], 0
+    match = _NUMERIC_RE.fullmatch(pg_type)
+    if match:
+        precision, scale = int(match.group(1)), int(match.group(2))
+        return precision - scale, scale
+    return None
+
+
+def widen(current: Optional[str], other: Optional[str]) -> Optional[str]:
+    """Smallest type that can hold values of both `current` and `other`."""
+    if current is None or current == other:
+        return other
+    if other is None:
+        return current
+
+    int_order = [name for name, _, _ in INT_RANGES]
+    if current in int_order and other in int_order:
+        return max(current, other, key=int_order.index)
+
+    a, b = _numeric_shape(current), _numeric_shape(other)
+    if a and b:
+        digits, scale = max(a[0], b[0]), max(a[1], b[1])
+        if digits > MAX_NUMERIC_PRECISION:
+            return "DOUBLE PRECISION"
+        if digits + scale > MAX_NUMERIC_PRECISION:
+            return "NUMERIC"
+        return f"NUMERIC({digits + scale},{scale})"
+
+    numeric = {"DOUBLE PRECISION", "NUMERIC"}
+    if (a or current in numeric) and (b or other in numeric):
+        return "DOUBLE PRECISION" if "DOUBLE PRECISION" in (current, other) else "NUMERIC"
+
+    temporal = ["DATE", "TIMESTAMP", "TIMESTAMPTZ"]
+    if current in temporal and other in temporal:
+        return max(current, other, key=temporal.index)
+
+    return "TEXT"
+
+
+_PG_TYPE_NAMES = {
+    "smallint": "SMALLINT",
+    "integer": "INTEGER",
+    "bigint": "BIGINT",
+    "numeric": "NUMERIC",
+    "double precision": "DOUBLE PRECISION",
+    "boolean": "BOOLEAN",
+    "date": "DATE",
+    "timestamp without time zone": "TIMESTAMP",
+    "timestamp with time zone": "TIMESTAMPTZ",
+    "text": "TEXT",
+}
+
+FAMILIES = {
+    "numeric": {"SMALLINT", "INTEGER", "BIGINT", "NUMERIC", "DOUBLE PRECISION"},
+    "temporal": {"DATE", "TIMESTAMP", "TIMESTAMPTZ"},
+}
+
+
+def from_pg_type(formatted: str) -> Optional[str]:
+    """Map a format_type() string ('numeric(12,2)', 'timestamp without time zone')
+    to the names used here; None for types outside the inference lattice."""
+    match = re.fullmatch(r"numeric\((\d+),(\d+)\)", formatted)
+    if match:
+        return f"NUMERIC({match.group(1)},{match.group(2)})"
+    return _PG_TYPE_NAMES.get(formatted)
+
+
+def same_family(a: str, b: str) -> bool:
+    a, b = ("NUMERIC" if t.startswith("NUMERIC") else t for t in (a, b))
+    return any(a in members and b in members for members in FAMILIES.values())
+
+
+def with_headroom(pg_type: Optional[str]) -> Optional[str]:
+    """
+    Type to use when a column must be widened mid-stream. Each ALTER rewrites the
+    table, so integers jump straight to BIGINT and decimals to 18 digits.
+    """
+    if pg_type in INT_DIGITS:
+        return "BIGINT"
+    shape = _numeric_shape(pg_type) if pg_type else None
+    if shape and shape[0] + shape[1] < 18:
+        return f"NUMERIC(18,{shape[1]})"
+    return pg_type
+
+
+def coerce_frame(df: pd.DataFrame, profiles: dict[str, ColumnProfile]) -> pd.DataFrame:
+    """
+    Convert string-typed values to the Python types their profile detected
+    (dates with their inferred format, boolean tokens, numeric strings) so
+    every loader receives properly typed columns.
+    """
+    for col, profile in profiles.items():
+        ser = df[col]
+        if profile.pg_type in (None, "TEXT") or not pd.api.types.is_object_dtype(ser):
+            continue
+        text = ser.where(ser.isna(), ser.astype(str).str.strip())
+        if profile.pg_type == "BOOLEAN":
+            df[col] = text.str.lower().map(BOOL_MAP)
+        elif profile.datetime_format:
+            df[col] = pd.to_datetime(text, format=profile.datetime_format, utc=profile.pg_type == "TIMESTAMPTZ")
+        elif profile.pg_type.startswith("NUMERIC"):
+            # Kept as text: float64 would round them, and loaders send the digits as they are
+            df[col] = text
+        else:
+            df[col] = pd.to_numeric(text)
+    return df
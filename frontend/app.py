@@ -1,19 +1,136 @@
 import os
+import json
 import time
 import sys
 import requests
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import pyarrow as pa
 from dotenv import load_dotenv
 
 # Load environment (for API_BASE)
 load_dotenv()
 API_BASE = os.getenv("API_BASE", "http://backend:8000")
+# Charts are requested downsampled to at most this many points
+MAX_CHART_POINTS = int(os.getenv("MAX_CHART_POINTS", "1000"))
+# Shown for the bar that sums the categories left out of a downsampled bar chart
+OTHER_BAR_LABEL = "(all others)"
 
 st.set_page_config(page_title="Autonomous Analytics MVP", layout="wide")
 st.title("Autonomous Analytics")
 
+# Default stages; runs may add more (e.g. "materialize"), rendered in run order
+AGENTS = ["extractor", "dictionary", "analyst"]
+TERMINAL_STATES = ("done", "failed", "skipped", "cancelled")
+
+
+def sse_events(url):
+    """Yield (event, data) pairs from a server-sent event stream."""
+    with requests.get(url, stream=True, timeout=(5, 60)) as resp:
+        resp.raise_for_status()
+        event, data = "message", []
+        for line in resp.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if not line:
+                if data:
+                    yield event, json.loads("\n".join(data))
+                event, data = "message", []
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].strip())
+
+
+def run_finished(status):
+    return all(s["status"] in TERMINAL_STATES for stages in status.values() for s in stages.values())
+
+
+def render_run(placeholder, status, table_durations=None):
+    """Render a stepper row per table of the run."""
+    with placeholder.container():
+        for table, stages in status.items():
+            label = f"**`{table}`**"
+            if table_durations and table_durations.get(table) is not None:
+                label += f" — {table_durations[table] / 1000:.1f}s"
+            st.markdown(label)
+            agents = list(stages) or AGENTS
+            cols = st.columns(len(agents))
+            for idx, agent in enumerate(agents):
+                col = cols[idx]
+                col.markdown(f"**{agent.capitalize()}**")
+                stage = stages.get(agent, {})
+                s = stage.get("status", "pending")
+                if s in ("pending", "queued"):
+                    col.markdown(f"⏳ {s}")
+                elif s == "running":
+                    retry = f" (attempt {stage['attempts']})" if stage.get("attempts", 0) > 1 else ""
+                    col.markdown(f"🔄 running{retry}")
+                elif s == "done":
+                    took = f" in {stage['duration_ms'] / 1000:.1f}s" if stage.get("duration_ms") is not None else ""
+                    col.markdown(f"✅ done{took}")
+                elif s == "failed":
+                    col.markdown("❌ failed")
+                    with col.expander("Error details"):
+                        col.code(stage.get("error"))
+                elif s in ("skipped", "cancelled"):
+                    col.markdown(f"⏹️ {s}")
+
+
+def read_arrow(content):
+    """DataFrame of an Arrow IPC stream response, plus its metadata (viz, row_count, truncated)."""
+    reader = pa.ipc.open_stream(content)
+    batches, meta = [], {}
+    while True:
+        try:
+            batch, custom = reader.read_next_batch_with_custom_metadata()
+        except StopIteration:
+            break
+        batches.append(batch)
+        if custom:
+            meta.update({k.decode(): json.loads(v) for k, v in custom.items()})
+    for k, v in (reader.schema.metadata or {}).items():
+        meta[k.decode()] = json.loads(v)
+    return pa.Table.from_batches(batches, schema=reader.schema).to_pandas(), meta
+
+
+def label_other(data, x):
+    """Name the remainder bar of a top-K result; the API leaves its category NULL and flags it is_other."""
+    frame = pd.DataFrame(data)
+    if "is_other" in frame.columns and x in frame.columns:
+        frame[x] = frame[x].astype(object).where(~frame["is_other"].fillna(False).astype(bool), OTHER_BAR_LABEL)
+    return frame
+
+
+def render_chart(data, viz):
+    if viz and viz.get("type"):
+        x = viz.get("x")
+        y = viz.get("y")
+        kind = viz.get("type")
+        if kind == "bar":
+            fig = px.bar(label_other(data, x), x=x, y=y)
+        elif kind == "line":
+            fig = px.line(data, x=x, y=y)
+        else:
+            fig = px.scatter(data, x=x, y=y)
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def render_metric(name, data, viz, truncated=False, downsampled=None, approximate=None):
+    """Table and chart of one metric's rows."""
+    st.subheader(f"Results for `{name}`")
+    if approximate:
+        st.caption(f"Estimated from a {approximate['sample_percent']:g}% {approximate['method']} sample "
+                   f"of ~{approximate['estimated_rows']:,} rows ({approximate['confidence']:.0%} intervals)")
+    if truncated:
+        st.warning(f"Showing the first {len(data)} rows only.")
+    if downsampled and downsampled != "none":
+        st.caption(f"Downsampled to {len(data)} points ({downsampled})")
+    st.dataframe(data, use_container_width=True)
+    render_chart(data, viz)
+
+
 tabs = st.tabs(["Ingest Data", "Metrics Catalogue", "Natural-Language Query"])
 tab1, tab2, tab3 = tabs
 
@@ -28,8 +145,14 @@ with tab1:
 
     # If replace/append, ask for existing table name
     target_table = ""
+    key_columns = ""
+    on_conflict = "update"
     if mode in ("replace", "append"):
         target_table = st.text_input("Existing Table Name:")
+    if mode == "append":
+        key_columns = st.text_input("Key columns for dedupe / upsert (optional, comma-separated):")
+        if key_columns.strip():
+            on_conflict = st.radio("On existing key:", ["update", "ignore"], horizontal=True)
 
     # File uploader always run, so uploaded_file is defined
     uploaded_file = st.file_uploader("Upload CSV or Excel file", type=["csv", "xls", "xlsx"])
@@ -41,7 +164,12 @@ with tab1:
         else:
             with st.spinner("Uploading & starting agents..."):
                 files = {"file": (uploaded_file.name, uploaded_file.getvalue())}
-                data = {"mode": mode, "table_name": target_table or ""}
+                data = {
+                    "mode": mode,
+                    "table_name": target_table or "",
+                    "key_columns": key_columns,
+                    "on_conflict": on_conflict,
+                }
                 try:
                     resp = requests.post(f"{API_BASE}/ingest/", data=data, files=files)
                     resp.raise_for_status()
@@ -54,11 +182,28 @@ with tab1:
                 tables = info["tables"]
 
             st.success(f"Ingestion started (run {run_id[:8]}).")
+            for sheet, error in info.get("errors", {}).items():
+                st.warning(f"Sheet '{sheet}' was not loaded: {error}")
             placeholder = st.empty()
 
-            # Polling stepper
-            all_done = False
-            while not all_done:
+            status = {}
+            finished = False
+            # Push updates from the server-sent event stream ...
+            try:
+                for event, payload in sse_events(f"{API_BASE}/ingest/{run_id}/events"):
+                    if event in ("snapshot", "end"):
+                        status = payload["status"]
+                    elif event == "stage":
+                        status.setdefault(payload["table"], {})[payload["stage"]] = payload
+                    render_run(placeholder, status, payload.get("table_duration_ms") if event == "end" else None)
+                    if event == "end":
+                        finished = True
+                        break
+            except Exception:
+                pass
+
+            # ... with polling only as a fallback when the stream is unavailable
+            while not finished:
                 try:
                     status_resp = requests.get(f"{API_BASE}/ingest/{run_id}/status")
                     status_resp.raise_for_status()
@@ -66,36 +211,16 @@ with tab1:
                     st.error(f"Could not fetch status: {e}")
                     break
 
-                status = status_resp.json()["status"][tables[0]]
-
-                # Render horizontal stepper
-                with placeholder.container():
-                    cols = st.columns(3)
-                    for idx, agent in enumerate(["extractor", "dictionary", "analyst"]):
-                        col = cols[idx]
-                        col.markdown(f"**{agent.capitalize()}**")
-                        s = status[agent]["status"]
-                        if s == "pending":
-                            col.markdown("⏳ pending")
-                        elif s == "running":
-                            col.markdown("🔄 running")
-                        elif s == "done":
-                            col.markdown("✅ done")
-                        elif s == "failed":
-                            col.markdown("❌ failed")
-                            with col.expander("Error details"):
-                                col.code(status[agent]["error"])
-
-                states = [status[a]["status"] for a in status]
-                if all(s == "done" for s in states) or any(s == "failed" for s in states):
-                    all_done = True
-                else:
-                    time.sleep(1)
-
-            placeholder.empty()
+                status = status_resp.json()["status"]
+                render_run(placeholder, status)
+                finished = run_finished(status)
+                if not finished:
+                    time.sleep(2)
+
+            states = [s["status"] for stages in status.values() for s in stages.values()]
             if any(s == "failed" for s in states):
                 st.error("One or more agents failed during ingestion.")
-            else:
+            elif finished:
                 st.success("All agents completed successfully!")
                 st.experimental_rerun()
 
@@ -113,28 +238,31 @@ with tab2:
 
         if not df_metrics.empty:
             selected = st.selectbox("Select a metric to run:", df_metrics["name"])
+            approximate = st.checkbox("Approximate (sampled) on large tables", key="approximate_metric")
             if st.button("Run Metric"):
                 metric_id = int(df_metrics[df_metrics["name"] == selected]["id"].iloc[0])
-                resp2 = requests.get(f"{API_BASE}/metric/{metric_id}")
+                params = {"format": "arrow", "max_points": MAX_CHART_POINTS, "approximate": approximate}
+                resp2 = requests.get(f"{API_BASE}/metric/{metric_id}", params=params)
                 resp2.raise_for_status()
-                payload = resp2.json()
-                data = pd.DataFrame(payload["data"])
-                viz = payload["viz"]
-
-                st.subheader(f"Results for `{selected}`")
-                st.dataframe(data, use_container_width=True)
-
-                if viz and viz.get("type"):
-                    x = viz.get("x")
-                    y = viz.get("y")
-                    kind = viz.get("type")
-                    if kind == "bar":
-                        fig = px.bar(data, x=x, y=y)
-                    elif kind == "line":
-                        fig = px.line(data, x=x, y=y)
-                    else:
-                        fig = px.scatter(data, x=x, y=y)
-                    st.plotly_chart(fig, use_container_width=True)
+                data, meta = read_arrow(resp2.content)
+                render_metric(selected, data, meta.get("viz"), meta.get("truncated"), meta.get("downsampled"),
+                              meta.get("approximate"))
+
+            st.subheader("Dashboard")
+            tiles = st.multiselect("Metrics to show together:", df_metrics["name"])
+            if tiles and st.button("Run Dashboard"):
+                ids = [int(df_metrics[df_metrics["name"] == name]["id"].iloc[0]) for name in tiles]
+                resp3 = requests.post(f"{API_BASE}/metrics/batch", json={"metric_ids": ids, "max_points": MAX_CHART_POINTS})
+                resp3.raise_for_status()
+                batch = resp3.json()
+                st.caption(f"{len(ids)} metrics answered with {batch['queries']} queries")
+                for name, metric_id in zip(tiles, ids):
+                    if str(metric_id) in batch["results"]:
+                        result = batch["results"][str(metric_id)]
+                        render_metric(name, pd.DataFrame(result["data"]), result["viz"], result["truncated"],
+                                      result.get("downsampled"))
+                    elif str(metric_id) in batch["errors"]:
+                        st.error(f"`{name}`: {batch['errors'][str(metric_id)]}")
     except Exception as e:
         st.error(f"Failed to fetch metrics: {e}")
 
@@ -144,6 +272,7 @@ with tab2:
 with tab3:
     st.header("3. Natural-Language Query")
     nl_query = st.text_area("Enter your question in plain English", height=120)
+    approximate = st.checkbox("Approximate (sampled) on large tables", key="approximate_query")
     if st.button("Ask"):
         if not nl_query.strip():
             st.error("Please type a question.")
@@ -152,7 +281,8 @@ with tab3:
                 try:
                     resp = requests.post(
                         f"{API_BASE}/query/",
-                        data={"nl_query": nl_query, "user": "streamlit_user"}
+                        data={"nl_query": nl_query, "user": "streamlit_user", "max_points": MAX_CHART_POINTS,
+                              "approximate": approximate}
                     )
                     resp.raise_for_status()
                     payload = resp.json()
@@ -162,6 +292,12 @@ with tab3:
                     st.markdown("**Generated SQL:**")
                     st.code(sql_used, language="sql")
                     st.subheader("Query Results")
+                    if payload.get("approximate"):
+                        approx = payload["approximate"]
+                        st.caption(f"Estimated from a {approx['sample_percent']:g}% {approx['method']} sample")
+                    if payload.get("truncated"):
+                        st.warning(f"Showing the first {len(data)} rows only.")
                     st.dataframe(data, use_container_width=True)
+                    render_chart(data, payload.get("viz"))
                 except Exception as e:
                     st.error(f"Error: {e}")